@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures the memory used per connected client.
+
+Starts a minimal IRC server in a child process, then for each channel
+count connects `--clients` EasyClients in a fresh process, joins each of
+them to that many channels of their own and reports the growth in
+resident memory (and, on Python 3, in memory allocated by Python) per
+client.
+
+    python bench/memory.py --clients 1000 --channels 0,10
+
+On Python 2.7.18 with gevent 21.12 an idle EasyClient costs about 32.8 KB
+of RSS (41.5 KB before the writer was started on demand and the per
+client state was slimmed down), and one in 10 channels about 34.7 KB
+(43.7 KB before).
+"""
+import argparse
+import gc
+import os
+import subprocess
+import sys
+import time
+
+import gevent
+import gevent.event
+import gevent.server
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from utopia import signals  # noqa
+from utopia.client import EasyClient, Identity  # noqa
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def serve(port):
+    """
+    Just enough of a server to register clients and let them join
+    channels.
+    """
+    def handle(sock, address):
+        nick, buf = None, b''
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                return
+            buf += data
+            while b'\r\n' in buf:
+                line, buf = buf.split(b'\r\n', 1)
+                args = line.split(b' ')
+                if args[0] == b'NICK':
+                    nick = args[1]
+                elif args[0] == b'USER':
+                    sock.sendall(b':bench 001 ' + nick + b' :Welcome\r\n')
+                elif args[0] == b'JOIN':
+                    out = []
+                    for channel in args[1].lstrip(b':').split(b','):
+                        out.append(b':' + nick + b'!u@h JOIN ' + channel)
+                        out.append(b':bench 353 ' + nick + b' = ' +
+                                   channel + b' :' + nick)
+                        out.append(b':bench 366 ' + nick + b' ' + channel +
+                                   b' :End of /NAMES list.')
+                    sock.sendall(b'\r\n'.join(out) + b'\r\n')
+
+    gevent.server.StreamServer(('127.0.0.1', port), handle, backlog=1024) \
+        .serve_forever()
+
+
+def rss():
+    """
+    The resident set size of this process, in bytes.
+    """
+    with open('/proc/self/statm') as fin:
+        return int(fin.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(port, count, channels):
+    clients = []
+    done = gevent.event.Event()
+    pending = [count * max(channels, 1)]
+
+    def finished(client, *args, **kwargs):
+        pending[0] -= 1
+        if not pending[0]:
+            done.set()
+
+    def registered(client):
+        if channels:
+            names = ['#{0}-{1}'.format(client.identity.nick, i)
+                     for i in range(channels)]
+            for i in range(0, len(names), 10):
+                client.send('JOIN', ','.join(names[i:i + 10]))
+        else:
+            finished(client)
+
+    # Warm up imports and caches before the baseline.
+    warm = EasyClient(Identity('warmup'), '127.0.0.1', port)
+    warm.connect().get()
+    warm.terminate()
+    del warm
+
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    before_rss = rss()
+    before_py = tracemalloc.get_traced_memory()[0] if tracemalloc else 0
+
+    for i in range(count):
+        client = EasyClient(Identity('b{0}'.format(i)), '127.0.0.1', port)
+        signals.on_registered.connect(registered, sender=client)
+        signals.m.on_366.connect(finished, sender=client)
+        client.connect().get()
+        clients.append(client)
+
+    done.wait(60)
+    gevent.sleep(0.5)
+    gc.collect()
+
+    per_rss = (rss() - before_rss) / float(count)
+    per_py = None
+    if tracemalloc is not None:
+        per_py = (tracemalloc.get_traced_memory()[0] - before_py) / \
+            float(count)
+    return per_rss, per_py
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--channels', default='0,10',
+                        help='Comma separated channel counts to measure.')
+    parser.add_argument('--port', type=int, default=16667)
+    parser.add_argument('--serve', action='store_true',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--measure', type=int, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.port)
+
+    if args.measure is not None:
+        per_rss, per_py = measure(args.port, args.clients, args.measure)
+        print('{0} {1}'.format(per_rss, per_py))
+        return
+
+    server = subprocess.Popen([
+        sys.executable, __file__, '--serve', '--port', str(args.port)
+    ])
+    try:
+        time.sleep(1)
+        print('Python {0}, {1} clients'.format(
+            sys.version.split()[0], args.clients))
+        print('{0:>9} {1:>16} {2:>16}'.format(
+            'channels', 'RSS/client', 'Python/client'))
+        for channels in args.channels.split(','):
+            output = subprocess.check_output([
+                sys.executable, __file__,
+                '--port', str(args.port),
+                '--clients', str(args.clients),
+                '--measure', channels
+            ]).decode('ascii').split()
+            per_py = 'n/a'
+            if output[1] != 'None':
+                per_py = '{0:.0f} B'.format(float(output[1]))
+            print('{0:>9} {1:>16} {2:>16}'.format(
+                channels,
+                '{0:.0f} B'.format(float(output[0])),
+                per_py
+            ))
+    finally:
+        server.kill()
+
+
+if __name__ == '__main__':
+    main()
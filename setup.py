@@ -19,7 +19,9 @@ setup(
     packages=find_packages(),
     install_requires=[
         'gevent',
-        'blinker'
+        'blinker',
+        # concurrent.futures, for utopia.offload.Offloader(processes=...)
+        'futures; python_version < "3"'
     ],
     tests_require=[
         'sniffer',
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from utopia import signals
+from utopia.client import Identity
+
+try:
+    import asyncio
+    from utopia.aio import AsyncClient
+except ImportError:
+    # Python 2, the asyncio client isn't available.
+    asyncio = None
+
+
+def _new_loop():
+    loop = asyncio.new_event_loop()
+    # AsyncClient.connect() uses the current loop.
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+def test_aio_dispatch():
+    """
+    Ensure lines are dispatched to plugins and consumed lines skip
+    on_raw_message.
+    """
+    if asyncio is None:
+        return
+
+    client = AsyncClient(Identity('aio'), 'localhost')
+    raw = []
+
+    def have_message(client, message):
+        return message.command == 'NOTICE'
+
+    def have_raw_message(client, prefix, command, args):
+        raw.append((command, args))
+
+    signals.on_message.connect(have_message, sender=client)
+    signals.on_raw_message.connect(have_raw_message, sender=client)
+
+    client.process_line(u':srv NOTICE aio :consumed')
+    client.process_line(u':srv PRIVMSG aio :hello')
+    assert(raw == [('PRIVMSG', ['aio', 'hello'])])
+
+
+def test_aio_connect_send():
+    """
+    Ensure the client connects, writes messages queued before and after
+    connecting (respecting the delay), dispatches replies and notices
+    the server closing the connection.
+    """
+    if asyncio is None:
+        return
+
+    received = []
+
+    class Server(asyncio.Protocol):
+        def connection_made(self, transport):
+            self.transport = transport
+            self.buffer = b''
+
+        def data_received(self, data):
+            self.buffer += data
+            while b'\r\n' in self.buffer:
+                line, self.buffer = self.buffer.split(b'\r\n', 1)
+                received.append(line)
+                if line.startswith(b'USER'):
+                    self.transport.write(b':srv 001 aio :Welcome\r\n')
+                elif line == b'QUIT':
+                    self.transport.close()
+
+    loop = _new_loop()
+    try:
+        server = loop.run_until_complete(
+            loop.create_server(Server, '127.0.0.1', 0)
+        )
+        port = server.sockets[0].getsockname()[1]
+
+        client = AsyncClient(Identity('aio'), '127.0.0.1', port)
+        client._message_delay = 0.05
+        welcome = loop.create_future()
+        events = []
+
+        def have_connected(client):
+            events.append('connect')
+            client.send('USER', 'aio', '8', '*', 'aio')
+
+        def have_welcome(client, prefix, command, args):
+            if command == '001':
+                welcome.set_result(args)
+
+        def have_disconnected(client):
+            events.append('disconnect')
+
+        signals.on_connect.connect(have_connected, sender=client)
+        signals.on_raw_message.connect(have_welcome, sender=client)
+        signals.on_disconnect.connect(have_disconnected, sender=client)
+
+        # Queued until connected.
+        client.send('NICK', 'aio')
+        assert(loop.run_until_complete(client.connect()) is True)
+        started = loop.time()
+        assert(loop.run_until_complete(asyncio.wait_for(welcome, 5)) ==
+               ['aio', 'Welcome'])
+        # USER waited for the delay after NICK.
+        assert(loop.time() - started >= 0.04)
+
+        client.send('QUIT')
+        loop.run_until_complete(asyncio.wait_for(client.wait_closed(), 5))
+
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    assert(received == [b'NICK aio', b'USER aio 8 * aio', b'QUIT'])
+    assert(events == ['connect', 'disconnect'])
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import gevent
+
+from utopia import signals
+from utopia.client import CoreClient
+from utopia.plugins.batch import BatchPlugin
+from test.util import unique_identity
+
+
+def _client(**kwargs):
+    client = CoreClient(unique_identity(), 'localhost', plugins=[
+        BatchPlugin(**kwargs)
+    ])
+
+    events = []
+
+    def on_raw_message(client, prefix, command, args):
+        events.append(command)
+
+    def on_netsplit(client, servers, prefixes):
+        events.append(('netsplit', servers, [p.nick for p in prefixes]))
+
+    def on_netjoin(client, servers, joins):
+        events.append(('netjoin', servers,
+                       [(p.nick, channel) for p, channel in joins]))
+
+    def on_batch(client, batch):
+        events.append(('batch', batch.type, len(batch.messages)))
+
+    for signal, receiver in ((signals.on_raw_message, on_raw_message),
+                             (signals.on_netsplit, on_netsplit),
+                             (signals.on_netjoin, on_netjoin),
+                             (signals.on_batch, on_batch)):
+        signal.connect(receiver, sender=client, weak=False)
+
+    return client, events
+
+
+def _process(client, *lines):
+    for line in lines:
+        client.process_line(line)
+    gevent.sleep(0.01)
+
+
+def test_batches():
+    """
+    Ensure tagged batches are coalesced into one event, and other batch
+    types are still dispatched line by line.
+    """
+    client, events = _client()
+
+    _process(
+        client,
+        u':irc.host BATCH +1 netsplit irc.a.net irc.b.net',
+        u'@batch=1 :a!u@h QUIT :irc.a.net irc.b.net',
+        u'@batch=1 :b!u@h QUIT :irc.a.net irc.b.net',
+        u':irc.host BATCH -1',
+        u':irc.host BATCH +2 chathistory #c',
+        u'@batch=2;time=2020-01-01T00:00:00.000Z :a!u@h PRIVMSG #c :hi',
+        u':irc.host BATCH -2'
+    )
+
+    # Batch events are fired as the batch ends, before the lines that
+    # are dispatched on their own greenlets.
+    assert(events == [
+        ('batch', 'netsplit', 2),
+        ('netsplit', ('irc.a.net', 'irc.b.net'), ['a', 'b']),
+        ('batch', 'chathistory', 1),
+        'BATCH',
+        'PRIVMSG',
+        'BATCH'
+    ])
+
+    message = client.protocol.parse_line(
+        u'@batch=2;msgid=x :a!u@h PRIVMSG #c :hi'
+    )
+    assert(message.tags == {'batch': '2', 'msgid': 'x'})
+    assert(message.args == ['#c', 'hi'])
+    assert(client.protocol.parse_line(u'PING :x').tags is None)
+
+
+def test_nested_batches():
+    """
+    Ensure a batch opened inside another one collects its own lines.
+    """
+    client, events = _client()
+
+    _process(
+        client,
+        u':irc.host BATCH +outer chathistory #c',
+        u'@batch=outer :irc.host BATCH +inner netsplit irc.a.net irc.b.net',
+        u'@batch=inner :a!u@h QUIT :irc.a.net irc.b.net',
+        u'@batch=inner :b!u@h QUIT :irc.a.net irc.b.net',
+        u'@batch=outer :irc.host BATCH -inner',
+        u':irc.host BATCH -outer'
+    )
+
+    assert(events == [
+        ('batch', 'netsplit', 2),
+        ('netsplit', ('irc.a.net', 'irc.b.net'), ['a', 'b']),
+        ('batch', 'chathistory', 2),
+        'BATCH',
+        'BATCH'
+    ])
+
+
+def test_cap_end_once():
+    """
+    Ensure CAP END is only sent while registering.
+    """
+    client, events = _client()
+    plugin = client._plugins[0]
+    plugin.have_connected(client)
+    client._message_queue.get()
+
+    _process(client, u':irc.host CAP * ACK :batch')
+    assert(plugin.enabled)
+    assert(client._message_queue.get(timeout=1) == b'CAP END\r\n')
+
+    _process(
+        client,
+        u':irc.host 001 nick :Welcome',
+        u':irc.host CAP nick NAK :batch'
+    )
+    assert(client._message_queue.empty())
+
+
+def test_netsplit_heuristic():
+    """
+    Ensure netsplits are detected from QUIT messages and the QUITs and
+    JOINs of the split are coalesced.
+    """
+    client, events = _client(window=0.05)
+
+    _process(
+        client,
+        u':a!u@h QUIT :irc.a.net irc.b.net',
+        u':b!u@h QUIT :irc.a.net irc.b.net',
+        u':c!u@h QUIT :Quit: irc.a.net irc.b.net',
+        u':d!u@h JOIN #c'
+    )
+    gevent.sleep(0.15)
+
+    _process(
+        client,
+        u':a!u@h JOIN #c',
+        u':a!u@h JOIN #d',
+        u':b!u@h JOIN #c',
+        u':c!u@h JOIN #c'
+    )
+    gevent.sleep(0.15)
+
+    assert(events == [
+        'QUIT',
+        'JOIN',
+        ('netsplit', ('irc.a.net', 'irc.b.net'), ['a', 'b']),
+        'JOIN',
+        ('netjoin', ('irc.a.net', 'irc.b.net'),
+         [('a', '#c'), ('a', '#d'), ('b', '#c')])
+    ])
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import gevent
+import gevent.socket
+
+from utopia.client import CoreClient
+from utopia.plugins.bouncer import BouncerPlugin
+from test.util import unique_identity
+
+
+def test_bouncer_fan_out():
+    """
+    Ensure every subscriber receives each message, new subscribers get
+    recent history and their messages are echoed to the others.
+    """
+    bouncer = BouncerPlugin(history=2)
+    client = CoreClient(unique_identity(), 'localhost', plugins=[bouncer])
+    nick = client.identity.nick
+
+    first = bouncer.subscribe()
+    client.process_line(u':{0}!u@h JOIN :#test'.format(nick))
+    client.process_line(u'PING :irc.test.host')
+    client.process_line(u':Other!o@h PRIVMSG #test :one')
+    client.process_line(u':Other!o@h PRIVMSG #test :two')
+
+    assert(bouncer.channels == set(['#test']))
+    assert([m.command for m in list(bouncer.history)] == ['PRIVMSG'] * 2)
+    assert(first.get(timeout=1).command == 'JOIN')
+
+    second = bouncer.subscribe()
+    assert(second.get(timeout=1).args == ['#test', 'one'])
+    assert(second.get(timeout=1).args == ['#test', 'two'])
+
+    second.send('PRIVMSG', '#test', 'hello there')
+    assert(client._message_queue.get(timeout=1) ==
+           b'PRIVMSG #test :hello there\r\n')
+
+    assert(first.get(timeout=1).args == ['#test', 'one'])
+    assert(first.get(timeout=1).args == ['#test', 'two'])
+    echo = first.get(timeout=1)
+    assert(echo.prefix[0] == nick)
+    assert(echo.args == ['#test', 'hello there'])
+    assert(second._queue.empty())
+
+    bouncer.close()
+    assert(first.get(timeout=1) is None)
+    assert(bouncer.subscribers == 0)
+
+
+def test_bouncer_reregister():
+    """
+    Ensure a new registration replaces the welcome burst and channels
+    of the previous one.
+    """
+    bouncer = BouncerPlugin()
+    client = CoreClient(unique_identity(), 'localhost', plugins=[bouncer])
+    nick = client.identity.nick
+
+    for _ in range(2):
+        for numeric in ('001', '002', '003', '004', '005'):
+            client.process_line(u':irc.test.host {0} {1} :hi'.format(
+                numeric, nick
+            ))
+        assert(bouncer.channels == set())
+        client.process_line(u':{0}!u@h JOIN :#test'.format(nick))
+
+    assert([m.command for m in bouncer._welcome] == [
+        '001', '002', '003', '004', '005'
+    ])
+    assert(bouncer.channels == set(['#test']))
+
+
+def test_bouncer_slow_subscriber():
+    """
+    Ensure a subscriber that falls behind is dropped.
+    """
+    bouncer = BouncerPlugin(maxsize=2)
+    client = CoreClient(unique_identity(), 'localhost', plugins=[bouncer])
+
+    subscription = bouncer.subscribe()
+    for i in range(3):
+        client.process_line(u':Other!o@h PRIVMSG #test :{0}'.format(i))
+
+    assert(subscription.overflowed)
+    assert(subscription.get(timeout=1) is None)
+    assert(bouncer.subscribers == 0)
+
+
+def test_bouncer_tcp():
+    """
+    Ensure IRC clients can attach to the bouncer over TCP.
+    """
+    bouncer = BouncerPlugin(listen=('127.0.0.1', 0), password='secret')
+    client = CoreClient(unique_identity(), 'localhost', plugins=[bouncer])
+    nick = client.identity.nick
+
+    client.process_line(u':irc.test.host 001 {0} :Welcome!'.format(nick))
+    client.process_line(u':{0}!u@h JOIN :#test'.format(nick))
+
+    sock = gevent.socket.create_connection(bouncer.address, timeout=5)
+    try:
+        sock.sendall(b'PASS secret\r\nNICK someone\r\nUSER a b c :d\r\n')
+
+        received = b''
+        while received.count(b'\r\n') < 4:
+            received += sock.recv(4096)
+        lines = received.split(b'\r\n')
+        assert(lines[0].startswith(b':irc.test.host 001 '))
+        assert(lines[1] == u':{0} JOIN #test'.format(nick).encode('utf-8'))
+        # Replayed history.
+        assert(lines[2].startswith(b':irc.test.host 001 '))
+        assert(lines[3].endswith(b' JOIN :#test'))
+
+        # Registration commands stay with the bouncer.
+        sock.sendall(b'NICK taken\r\nPRIVMSG #test :from downstream\r\n')
+        assert(client._message_queue.get(timeout=1) ==
+               b'PRIVMSG #test :from downstream\r\n')
+
+        client.process_line(u':Other!o@h PRIVMSG #test :upstream')
+        received = sock.recv(4096)
+        assert(received == b':Other!o@h PRIVMSG #test :upstream\r\n')
+    finally:
+        sock.close()
+        bouncer.close()
+
+
+class _DeadSocket(object):
+    def sendall(self, data):
+        raise gevent.socket.error('Connection reset by peer')
+
+    def close(self):
+        pass
+
+
+def test_bouncer_dead_consumer():
+    """
+    Ensure a TCP consumer whose socket fails is dropped.
+    """
+    bouncer = BouncerPlugin()
+    client = CoreClient(unique_identity(), 'localhost', plugins=[bouncer])
+    subscription = bouncer.subscribe()
+
+    writer = gevent.spawn(
+        bouncer._write, _DeadSocket(), client.protocol, subscription
+    )
+    client.process_line(u':Other!o@h PRIVMSG #test :hi')
+    writer.join(timeout=1)
+
+    assert(writer.successful())
+    assert(subscription.closed)
+    assert(bouncer.subscribers == 0)
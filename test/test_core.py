@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+from utopia.core import (
+    Closed,
+    Connection,
+    command_of,
+    interests,
+    sources_of
+)
+from utopia.plugins.handshake import HandshakePlugin
+from utopia.plugins.protocol import ProtocolPlugin
+from utopia.plugins.util import RecPlugin
+
+
+def test_receive_framing():
+    """
+    Ensure lines split across arbitrary chunks are reassembled and
+    parsed, and incomplete lines are held back.
+    """
+    data = (
+        b':irc.test.host 001 TestNick :Welcome to the test server!\r\n'
+        b':TestNick!TestUsername@test.host JOIN :#test\r\n'
+        b'PING :irc.test.host\r\n'
+    )
+
+    connection = Connection()
+    events = []
+    for i in range(0, len(data), 7):
+        events.extend(connection.receive_data(data[i:i + 7]))
+
+    assert([e.command for e in events] == ['001', 'JOIN', 'PING'])
+    assert(events[1].prefix.nick == 'TestNick')
+    assert(events[1].args == ['#test'])
+    assert(events[2].line == u'PING :irc.test.host')
+    assert(connection.bytes_received == len(data))
+
+    assert(connection.receive_data(b'PING :no end') == [])
+    assert(connection.receive_data(b'') == [Closed()])
+    assert(connection.closed)
+
+
+def test_receive_tags_only():
+    """
+    Ensure a line with tags but no command is skipped.
+    """
+    connection = Connection()
+    events = connection.receive_data(b'@a=b\r\n@a=b \r\nPING :x\r\n')
+
+    assert([e.command for e in events] == ['PING'])
+    assert(connection.parse_line(u'@a=b') is None)
+
+
+def test_receive_decoding():
+    """
+    Ensure the fallback encoding only applies to the line that needs it.
+    """
+    connection = Connection()
+    events = connection.receive_data(
+        u'PRIVMSG #test :äöü\r\n'.encode('utf-8') +
+        u'PRIVMSG #test :äöü\r\n'.encode('iso-8859-1')
+    )
+
+    assert(events[0].args[1] == u'äöü')
+    assert(events[1].args[1] == u'äöü')
+    assert(connection.decode_fallbacks == 1)
+
+
+def test_encoding_hints():
+    """
+    Ensure senders needing the fallback encoding are remembered without
+    mangling their UTF-8 lines, and channel encodings are honoured.
+    """
+    assert(sources_of(b':Nick!u@h PRIVMSG #Test :hi') == (b'nick', b'#test'))
+    assert(sources_of(b':Nick!u@h PRIVMSG Other :hi') == (b'nick', None))
+    assert(sources_of(b'PING :irc.test.host') == (None, None))
+
+    connection = Connection(channel_encodings={'#ru': 'cp1251'})
+    latin = u':old!u@h PRIVMSG #test :äöü\r\n'.encode('iso-8859-1')
+    utf8 = u':old!u@h PRIVMSG #test :äöü\r\n'.encode('utf-8')
+
+    events = connection.receive_data(latin + latin + utf8 + latin)
+    assert([e.args[1] for e in events] == [u'äöü'] * 4)
+    assert(connection.decode_fallbacks == 3)
+    assert(b'old' in connection._hints)
+    events = connection.receive_data(b':old!u@h PRIVMSG #test :ascii\r\n')
+    assert(events[0].args[1] == u'ascii')
+
+    cyrillic = u'привет'
+    events = connection.receive_data(
+        b':new!u@h PRIVMSG #RU :' + cyrillic.encode('cp1251') + b'\r\n'
+    )
+    assert(events[0].args[1] == cyrillic)
+    assert(connection.decode_fallbacks == 3)
+
+    connection.send('PRIVMSG', '#ru', cyrillic)
+    connection.send('PRIVMSG', '#test', cyrillic)
+    assert(connection.data_to_send() == (
+        b'PRIVMSG #ru ' + cyrillic.encode('cp1251') + b'\r\n' +
+        b'PRIVMSG #test ' + cyrillic.encode('utf-8') + b'\r\n'
+    ))
+
+
+def test_interests():
+    """
+    Ensure lines nobody is interested in are dropped unparsed.
+    """
+    assert(command_of(b'@a=b :nick!u@h privmsg #test :hi') == b'PRIVMSG')
+    assert(command_of(b':irc.test.host 001 TestNick') == b'001')
+    assert(command_of(b'PING') == b'PING')
+
+    wanted = interests(
+        [HandshakePlugin, ProtocolPlugin(commands=['PRIVMSG'])],
+        ['JOIN']
+    )
+    assert(wanted == set([b'PRIVMSG', b'JOIN', b'001', b'PING']))
+    assert(interests([HandshakePlugin, RecPlugin()]) is None)
+
+    connection = Connection(interests=wanted)
+    events = connection.receive_data(
+        b':irc.test.host 372 TestNick :MOTD line\r\n'
+        b':nick!u@h PRIVMSG #test :hi\r\n'
+        b'\xff\xfe garbage\r\n'
+        b'PING :irc.test.host\r\n'
+    )
+
+    assert([e.command for e in events] == ['PRIVMSG', 'PING'])
+    assert(connection.lines_skipped == 2)
+    assert(connection.decode_fallbacks == 0)
+
+
+def test_send():
+    """
+    Ensure queued messages are encoded and returned once.
+    """
+    connection = Connection()
+    connection.send('NICK', 'TestNick')
+    connection.send('PRIVMSG', '#test', u'± äöü')
+    connection.send_raw(u'PING test')
+
+    assert(connection.data_to_send() == (
+        b'NICK TestNick\r\n' +
+        u'PRIVMSG #test :± äöü\r\n'.encode('utf-8') +
+        b'PING test\r\n'
+    ))
+    assert(connection.data_to_send() == b'')
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+
+from utopia import signals
+from utopia.parsing import Prefix
+from utopia.plugins.dcc import DCCPlugin, Transfer, unpack_address
+from utopia.plugins.handshake import HandshakePlugin
+from utopia.plugins.protocol import EasyProtocolPlugin
+from test.util import TestVarContainer, get_two_joined_clients
+
+
+def _transfer(passive=False, resume=False):
+    dcc_plugins = []
+
+    def _plugins():
+        dcc_plugins.append(DCCPlugin(host='127.0.0.1', timeout=5))
+        return [HandshakePlugin, EasyProtocolPlugin(), dcc_plugins[-1]]
+
+    client1, client2 = get_two_joined_clients(protocol_factory=_plugins)
+    sender, receiver = dcc_plugins
+
+    directory = tempfile.mkdtemp()
+    source = os.path.join(directory, 'source file.bin')
+    target = os.path.join(directory, 'target.bin')
+    payload = os.urandom(256 * 1024 + 17)
+    with open(source, 'wb') as fout:
+        fout.write(payload)
+    if resume:
+        with open(target, 'wb') as fout:
+            fout.write(payload[:100000])
+
+    c = TestVarContainer('sent', 'received')
+    results = {}
+
+    def on_offer(client, offer):
+        results['offer'] = offer
+        receiver.accept(client, offer, target, resume=resume)
+
+    def on_complete(client, transfer):
+        results[client] = transfer
+        (c.sent if transfer.outgoing else c.received).set()
+
+    c._dumpster.update((on_offer, on_complete))
+    signals.on_dcc_offer.connect(on_offer, sender=client2)
+    signals.on_dcc_complete.connect(on_complete, sender=client1)
+    signals.on_dcc_complete.connect(on_complete, sender=client2)
+
+    try:
+        sender.send_file(client1, client2.identity.nick, source,
+                         passive=passive)
+        assert c.wait_all(timeout=5)
+
+        assert(results['offer'].filename == 'source file.bin')
+        assert(results['offer'].size == len(payload))
+        assert((results['offer'].port == 0) == passive)
+        with open(target, 'rb') as fin:
+            assert(fin.read() == payload)
+        return results[client1], results[client2]
+    finally:
+        client1.terminate()
+        client2.terminate()
+        shutil.rmtree(directory)
+
+
+def test_dcc_send():
+    """
+    Ensure a file can be sent between two clients.
+    """
+    sent, received = _transfer()
+    assert(sent.position == received.position == 0)
+    assert(sent.completed == received.completed == sent.size)
+
+
+def test_dcc_passive():
+    """
+    Ensure passive (reverse) DCC works.
+    """
+    _transfer(passive=True)
+
+
+def test_dcc_resume():
+    """
+    Ensure a partially received file is resumed instead of restarted.
+    """
+    sent, received = _transfer(resume=True)
+    assert(sent.position == received.position == 100000)
+    assert(received.transferred == received.size - 100000)
+
+
+class _ShortReads(object):
+    """
+    A socket that never returns more than 10 bytes per read.
+    """
+    def __init__(self, data):
+        self.data = data
+
+    def recv(self, count):
+        data, self.data = self.data[:min(count, 10)], self.data[10:]
+        return data
+
+    def sendall(self, data):
+        pass
+
+
+class _Buffer(object):
+    """
+    Stands in for the mmap of the target file.
+    """
+    def __init__(self, size):
+        self.data = bytearray(size)
+
+    def __setitem__(self, index, data):
+        self.data[index] = data
+
+    def flush(self):
+        pass
+
+
+class _Bucket(object):
+    def __init__(self):
+        self.charged = []
+
+    def wait(self, amount):
+        self.charged.append(amount)
+
+
+def test_dcc_short_reads():
+    """
+    Ensure the bandwidth limit is charged for the bytes actually read.
+    """
+    transfer = Transfer(None, 'nick', 'file', None, 25, False)
+    buffer = _Buffer(25)
+    bucket = _Bucket()
+
+    DCCPlugin()._receive_into(
+        transfer, _ShortReads(b'x' * 25), buffer, bucket
+    )
+    assert(bytes(buffer.data) == b'x' * 25)
+    assert(bucket.charged == [10, 10, 5])
+
+
+def test_dcc_bad_address():
+    """
+    Ensure offers with an address out of range are ignored.
+    """
+    assert(unpack_address('2130706433') == '127.0.0.1')
+    for value in ('4294967296', '99999999999999999999'):
+        try:
+            unpack_address(value)
+        except ValueError:
+            pass
+        else:
+            assert False, value
+
+    dcc = DCCPlugin()
+    prefix = Prefix('nick', 'u', 'h')
+    dcc.on_dcc(None, prefix, 'me', 'DCC', 'SEND file 4294967296 5000 10')
+    assert(not dcc._pending)
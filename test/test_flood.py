@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from utopia import signals
+from utopia.client import CoreClient
+from utopia.plugins.flood import FloodPlugin, SlidingSketch, fingerprint
+from test.util import unique_identity
+
+
+def test_sliding_sketch():
+    """
+    Ensure counts cover a sliding window and expire a bucket at a time.
+    """
+    sketch = SlidingSketch(window=10, buckets=5, width=64, depth=3)
+    for i in range(5):
+        assert(sketch.add('a', now=100 + i) == i + 1)
+    assert(sketch.add('b', now=104) == 1)
+
+    # The first two adds (at 100 and 101) fall out of the window.
+    assert(sketch.count('a', now=111) == 3)
+    assert(sketch.count('a', now=120) == 0)
+    assert(sketch.count('b', now=120) == 0)
+
+    # Many more keys than counters still never underestimates.
+    sketch = SlidingSketch(window=10, width=16, depth=2)
+    for i in range(1000):
+        sketch.add(i, now=100)
+    assert(all(sketch.count(i, now=100) >= 1 for i in range(1000)))
+
+
+def test_fingerprint():
+    """
+    Ensure lines differing only by case, digits and punctuation match.
+    """
+    assert(fingerprint(u'Buy cheap stuff! 1234') ==
+           fingerprint(u'buy CHEAP stuff 98'))
+    assert(fingerprint(u'buy cheap stuff') != fingerprint(u'buy stuff'))
+    assert(fingerprint(u':) 123') is None)
+
+
+def test_flood_plugin():
+    """
+    Ensure message, repeat, join and highlight floods fire on_flood once
+    per crossing.
+    """
+    client = CoreClient(unique_identity(), 'localhost', plugins=[
+        FloodPlugin(limits={'messages': 3, 'repeats': 2, 'joins': 2,
+                            'highlights': 2})
+    ])
+
+    floods = []
+
+    def on_flood(client, kind, prefix, channel, count):
+        floods.append((kind, prefix.nick, channel, count))
+
+    signals.on_flood.connect(on_flood, sender=client)
+
+    # Nick changes don't reset the count, the host is the same.
+    for i, nick in enumerate(('a1', 'a2', 'a3', 'a4', 'a5')):
+        client.process_line(
+            u':{0}!u@bad.host PRIVMSG #c :hello {1}'.format(nick, i)
+        )
+    assert(floods == [
+        ('repeats', 'a3', '#c', 3),
+        ('messages', 'a4', '#c', 4)
+    ])
+
+    del floods[:]
+    for nick in ('x', 'y', 'z'):
+        client.process_line(u':{0}!u@{0}.host JOIN #d'.format(nick))
+    client.process_line(u':x!u@x.host PART #d')
+    client.process_line(u':x!u@x.host JOIN #d')
+    client.process_line(u':x!u@x.host PART #d')
+    assert(floods == [('joins', 'x', '#d', 3)])
+
+    del floods[:]
+    client.process_line(
+        u':spam!u@s.host 353 me = #e :@op +voiced alice bob carol'
+    )
+    client.process_line(u':spam!u@s.host PRIVMSG #e :alice: hi bob')
+    client.process_line(u':spam!u@s.host PRIVMSG #e :op, voiced alice bob')
+    assert(floods == [('highlights', 'spam', '#e', 4)])
+
+
+def test_flood_plugin_saturated():
+    """
+    Ensure every sender over the limit fires exactly once, even when
+    colliding keys make the estimates jump past the limit.
+    """
+    client = CoreClient(unique_identity(), 'localhost', plugins=[
+        FloodPlugin(limits={'messages': 10, 'repeats': None}, width=64,
+                    depth=2)
+    ])
+
+    floods = []
+
+    def on_flood(client, kind, prefix, channel, count):
+        floods.append(prefix.host)
+
+    signals.on_flood.connect(on_flood, sender=client)
+
+    for i in range(12):
+        for sender in range(200):
+            client.process_line(
+                u':n{0}!u@host{0} PRIVMSG #c :line {1}'.format(sender, i)
+            )
+
+    assert(sorted(floods) == sorted(
+        'host{0}'.format(sender) for sender in range(200)
+    ))
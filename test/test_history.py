@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import itertools
+import time
+
+import gevent
+
+from utopia.client import CoreClient
+from utopia.plugins.history import HistoryPlugin
+from utopia.plugins.protocol import EasyProtocolPlugin
+from test.util import unique_identity
+
+
+def test_history_queries():
+    """
+    Ensure messages are stored across compressed segments and can be
+    queried by nick and by words, newest first.
+    """
+    history = HistoryPlugin(segment_size=4)
+    client = CoreClient(unique_identity(), 'localhost', plugins=[
+        EasyProtocolPlugin(),
+        history
+    ])
+
+    nicks = itertools.cycle(['alice', 'bob', 'carol'])
+    for i in range(10):
+        text = u'message number {0}{1}'.format(i, u' ± café' * (i % 2))
+        client.process_line(u':{0}!u@h PRIVMSG #Test :{1}'.format(
+            next(nicks), text
+        ))
+    client.process_line(u':dave!u@h PRIVMSG {0} :psst'.format(
+        client.identity.nick
+    ))
+    gevent.sleep(0.1)
+
+    assert(history.count('#test') == 10)
+    assert(len(history._logs['#test'].segments) == 2)
+
+    last = list(history.last('#test'))
+    assert([e.text.split()[2] for e in last[:3]] == ['9', '8', '7'])
+    assert(last[-1].nick == 'alice')
+    assert(last[0].channel == '#Test')
+
+    bob = list(history.last('#TEST', nick='Bob'))
+    assert([e.text.split()[2] for e in bob] == ['7', '4', '1'])
+
+    found = list(history.search('#test', u'CAFÉ number'))
+    assert([e.text.split()[2] for e in found] == ['9', '7', '5', '3', '1'])
+    found = list(history.search('#test', u'café', nick='bob'))
+    assert([e.text.split()[2] for e in found] == ['7', '1'])
+    assert(list(history.search('#test', u'missing')) == [])
+
+    assert([e.text for e in history.last('dave')] == ['psst'])
+
+
+def test_history_retention():
+    """
+    Ensure expired segments are dropped along with their index entries.
+    """
+    history = HistoryPlugin(segment_size=2, retention=60)
+    now = time.time()
+    for i in range(6):
+        history.add('#test', 'nick', 'old {0}'.format(i), now - 120)
+    for i in range(2):
+        history.add('#test', 'nick', 'new {0}'.format(i), now)
+
+    # The segment sealed by the last message triggers compaction.
+    assert(history.count('#test') == 2)
+    assert([e.text for e in history.last('#test')] == ['new 1', 'new 0'])
+    assert(list(history.search('#test', 'old')) == [])
+    assert('old' not in history._logs['#test'].words)
+    assert(list(history.last('#test', since=now + 1)) == [])
+
+
+def test_history_time_range():
+    """
+    Ensure since and until only decompress the segments they fall in,
+    plus those holding the results.
+    """
+    history = HistoryPlugin(segment_size=2, cache=100)
+    for i in range(21):
+        history.add('#test', 'nick{0}'.format(i % 2), u'line {0}'.format(i),
+                    1000 + i)
+    log = history._logs['#test']
+
+    assert([e.text for e in history.last('#test', since=1014.5,
+                                         until=1016)] == ['line 15'])
+    assert(set(number for _, number in history._cache) == set([7, 8]))
+
+    assert([e.text for e in history.last('#test', since=1019)] ==
+           ['line 20', 'line 19'])
+    assert([e.text for e in history.last('#test', until=1002)] ==
+           ['line 1', 'line 0'])
+    assert([e.text for e in history.search('#test', 'line', nick='nick1',
+                                           since=1004, until=1009)] ==
+           ['line 7', 'line 5'])
+    assert(list(history.last('#test', since=1009, until=1002)) == [])
+    assert(list(history.last('#test', since=2000)) == [])
+    assert(len(log) == 21)
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
+import gevent
+
 from utopia import signals
 from utopia.client import CoreClient
-from test.util import unique_identity
+from utopia.plugins.handshake import HandshakePlugin
+from utopia.plugins.protocol import ProtocolPlugin
+from test.util import TestVarContainer, unique_identity
 
 
 def test_connect_success():
@@ -44,3 +48,102 @@ def test_disconnect_event():
     client.terminate()
     assert(connect_plugin.got_connect)
     assert(connect_plugin.got_disconnect)
+
+
+def test_metrics_snapshot():
+    """
+    Ensure a client with metrics enabled counts traffic and reports it
+    through metrics_snapshot() and on_stats.
+    """
+    identity = unique_identity()
+
+    client = CoreClient(
+        identity,
+        'localhost',
+        plugins=[HandshakePlugin],
+        metrics=True,
+        stats_interval=0.1
+    )
+    assert(CoreClient(identity, 'localhost').metrics_snapshot() is None)
+
+    c = TestVarContainer('got_stats', 'got_message')
+    signals.on_stats.connect(c.set_callback('got_stats'), sender=client)
+    signals.on_raw_message.connect(
+        c.set_callback('got_message'),
+        sender=client
+    )
+
+    assert(client.connect().get() is True)
+    assert(c.wait_all(timeout=2))
+    client.sendraw(u'@label=1 :{0} PING :tagged'.format(identity.nick))
+    client.sendraw(u':{0} PING :prefixed'.format(identity.nick))
+    gevent.sleep(0.1)
+    client.terminate()
+
+    stats = client.metrics_snapshot()
+    assert(stats['bytes_in'] > 0)
+    assert(stats['bytes_out'] > 0)
+    assert(stats['lines_in'] >= 1)
+    assert(stats['commands_in']['001'] == 1)
+    assert(stats['commands_out']['NICK'] == 1)
+    assert(stats['commands_out']['PING'] == 2)
+    assert(stats['dispatch_latency']['count'] == stats['lines_in'])
+    assert(stats['outbound_queue'] == 0)
+
+
+def test_send_after_terminate():
+    """
+    Ensure messages sent while disconnected are written once the client
+    reconnects.
+    """
+    identity = unique_identity()
+    client = CoreClient(identity, 'localhost', plugins=[ProtocolPlugin()])
+
+    c = TestVarContainer('got_welcome')
+    signals.m.on_001.connect(c.set_callback('got_welcome'), sender=client)
+
+    assert(client.connect().get() is True)
+    client.send('PING', 'before')
+    gevent.sleep(0.1)
+    assert(client._writer is None)
+    client.terminate()
+
+    client.send('NICK', identity.nick)
+    client.send('USER', identity.user, '8', '*', identity.real)
+    assert(client._writer is None)
+    assert(client._message_queue.qsize() == 2)
+
+    assert(client.connect().get() is True)
+    assert(c.wait_all(timeout=2))
+    assert(client._message_queue.empty())
+    client.terminate()
+
+
+def test_receiver_error():
+    """
+    Ensure a receiver raising an exception doesn't disconnect the client
+    or keep the other receivers from running.
+    """
+    identity = unique_identity()
+    client = CoreClient(identity, 'localhost', plugins=[HandshakePlugin])
+    messages = []
+
+    def broken(client, message):
+        raise AttributeError('broken receiver')
+
+    signals.on_message.connect(broken, sender=client)
+    signals.on_message.connect(
+        lambda client, message: messages.append(message.command),
+        sender=client,
+        weak=False
+    )
+
+    assert(client.connect().get() is True)
+    gevent.sleep(0.2)
+    client.send('PING', 'still')
+    gevent.sleep(0.2)
+
+    assert(client.socket is not None)
+    assert('001' in messages)
+    assert('PONG' in messages)
+    client.terminate()
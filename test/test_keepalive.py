@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import gevent.server
+
+from utopia import signals
+from utopia.client import CoreClient
+from utopia.plugins.handshake import HandshakePlugin
+from utopia.plugins.keepalive import KeepalivePlugin
+from utopia.plugins.protocol import ProtocolPlugin
+from test.util import TestVarContainer, unique_identity
+
+
+def test_lag():
+    """
+    Ensure the round trip time is measured from the server's PONGs.
+    """
+    keepalive = KeepalivePlugin(interval=0.1, timeout=5)
+    client = CoreClient(unique_identity(), 'localhost', plugins=[
+        HandshakePlugin,
+        ProtocolPlugin(),
+        keepalive
+    ])
+
+    container = TestVarContainer('lag')
+    lags = []
+
+    def on_lag(client, lag):
+        lags.append(lag)
+        container.lag.set()
+
+    signals.on_lag.connect(on_lag, sender=client)
+
+    assert(client.connect().get() is True)
+    assert(container.wait_all(timeout=5))
+    client.terminate()
+
+    assert(keepalive.lag is not None)
+    assert(0 <= lags[0] < 1)
+
+
+def test_dead_connection():
+    """
+    Ensure a connection that stops responding is terminated.
+    """
+    def black_hole(sock, address):
+        while sock.recv(4096):
+            pass
+
+    server = gevent.server.StreamServer(('127.0.0.1', 0), black_hole)
+    server.start()
+
+    client = CoreClient(
+        unique_identity(), '127.0.0.1', port=server.server_port,
+        plugins=[KeepalivePlugin(interval=0.1, timeout=0.3, user_timeout=1)]
+    )
+
+    container = TestVarContainer('timeout', 'disconnect')
+    signals.on_timeout.connect(
+        container.set_callback('timeout'), sender=client
+    )
+    signals.on_disconnect.connect(
+        container.set_callback('disconnect'), sender=client
+    )
+
+    try:
+        assert(client.connect().get() is True)
+        assert(container.wait_all(timeout=5))
+    finally:
+        server.stop()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+
+import gevent
+
+from utopia.client import CoreClient
+from utopia.plugins.util import BatchingHandler, LogPlugin
+from test.util import unique_identity
+
+
+class _Collect(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _logger(name, level=logging.DEBUG):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(level)
+    del logger.handlers[:]
+    return logger
+
+
+def test_log_plugin_filters():
+    """
+    Ensure LogPlugin only logs the commands asked for, skips ignored
+    ones, samples and does nothing if the logger is disabled.
+    """
+    lines = [
+        u':a!u@h PRIVMSG #c :hello',
+        u':a!u@h NOTICE #c :hello',
+        u':a!u@h JOIN #c'
+    ]
+
+    def run(logger, **kwargs):
+        collect = _Collect()
+        logger.addHandler(collect)
+        client = CoreClient(unique_identity(), 'localhost', plugins=[
+            LogPlugin(logger, **kwargs)
+        ])
+        for line in lines:
+            client.process_line(line)
+        gevent.sleep(0.1)
+        return [record.args[2] for record in collect.records]
+
+    assert(run(_logger('test.log.all')) == ['PRIVMSG', 'NOTICE', 'JOIN'])
+    assert(run(
+        _logger('test.log.commands'),
+        commands=['PRIVMSG', 'NOTICE'],
+        ignore=['NOTICE']
+    ) == ['PRIVMSG'])
+    assert(run(_logger('test.log.sample'), sample=0.0) == [])
+    assert(run(_logger('test.log.disabled', logging.INFO)) == [])
+    assert(run(
+        _logger('test.log.level', logging.INFO),
+        level=logging.INFO
+    ) == ['PRIVMSG', 'NOTICE', 'JOIN'])
+
+
+def test_batching_handler():
+    """
+    Ensure records are written in order, once the interval passed or
+    the capacity is reached, including records logged from other
+    threads, and close() writes what is left.
+    """
+    target = _Collect()
+    handler = BatchingHandler(target, interval=0.2, capacity=3)
+    logger = _logger('test.batching')
+    logger.addHandler(handler)
+
+    logger.info('one %s', 1)
+    gevent.sleep(0.05)
+    assert(target.records == [])
+    gevent.sleep(0.3)
+    assert([r.getMessage() for r in target.records] == ['one 1'])
+
+    # Reaching the capacity flushes straight away.
+    for i in range(3):
+        logger.info('full %s', i)
+    gevent.sleep(0.05)
+    assert(len(target.records) == 4)
+
+    thread = threading.Thread(
+        target=lambda: [logger.info('thread %s', i) for i in range(50)]
+    )
+    thread.start()
+    thread.join()
+    gevent.sleep(0.5)
+    assert([r.getMessage() for r in target.records[4:]] == [
+        'thread {0}'.format(i) for i in range(50)
+    ])
+
+    logger.info('last')
+    gevent.sleep(0.05)
+    assert(handler._flusher is not None)
+    handler.close()
+    assert(handler._flusher is None)
+    assert(target.records[-1].getMessage() == 'last')
+    logger.removeHandler(handler)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import gevent
+
+from utopia import signals
+from utopia.client import CoreClient
+from utopia.parsing import irc_lower
+from utopia.plugins.matcher import AhoCorasick, MatcherPlugin
+from utopia.plugins.protocol import EasyProtocolPlugin
+from test.util import unique_identity
+
+
+def test_aho_corasick():
+    """
+    Ensure every occurrence of every keyword is found, including
+    overlapping ones, and keywords can be added and removed.
+    """
+    automaton = AhoCorasick({'he': 1, 'she': 2, 'his': 3, 'hers': 4})
+    found = sorted(
+        (start, key) for start, _, _, key in automaton.finditer('ushers')
+    )
+    assert(found == [(1, 2), (2, 1), (2, 4)])
+
+    automaton.remove('he')
+    automaton.add('us')
+    found = sorted(key for _, _, _, key in automaton.finditer('ushers'))
+    assert(found == [2, 4, 'us'])
+    assert(list(AhoCorasick().finditer('anything')) == [])
+
+
+def test_irc_lower():
+    """
+    Ensure casemappings fold their special characters.
+    """
+    assert(irc_lower(u'Nick[]\\~') == u'nick{}|^')
+    assert(irc_lower(u'Nick[]\\~', 'strict-rfc1459') == u'nick{}|~')
+    assert(irc_lower(u'Nick[]', 'ascii') == u'nick[]')
+    assert(irc_lower(u'ÄÖÜ', 'ascii') == u'ÄÖÜ')
+
+
+def test_matcher_plugin():
+    """
+    Ensure messages are matched case insensitively on word boundaries
+    and fire on_match.
+    """
+    matcher = MatcherPlugin({u'utopia': 'project', u'Café': 'cafe'})
+    client = CoreClient(unique_identity(), 'localhost', plugins=[
+        EasyProtocolPlugin(),
+        matcher
+    ])
+
+    assert(matcher.match(u'I love UTOPIA!') == set(['project']))
+    assert(matcher.match(u'dystopias and utopian ideas') == set())
+    assert(matcher.match(u'a café, in utopia') == set(['cafe', 'project']))
+
+    matcher.add(u'nick[away]', 'away')
+    assert(matcher.match(u'ping NICK{AWAY}') == set(['away']))
+    matcher.remove(u'utopia')
+    assert(matcher.match(u'utopia') == set())
+
+    matched = []
+
+    def on_match(client, prefix, target, text, matches):
+        matched.append((prefix.nick, target, matches))
+
+    signals.on_match.connect(on_match, sender=client)
+    client.process_line(u':someone!u@h PRIVMSG #test :to the CAFÉ')
+    client.process_line(u':someone!u@h PRIVMSG #test :nothing here')
+    gevent.sleep(0.1)
+
+    assert(matched == [('someone', '#test', set(['cafe']))])
+
+
+def test_matcher_folded_keywords():
+    """
+    Ensure keywords that fold to the same pattern report all of their
+    keys, and removing one leaves the others.
+    """
+    matcher = MatcherPlugin({u'Utopia': 'upper', u'utopia': 'lower'})
+    assert(matcher.match(u'UTOPIA') == set(['upper', 'lower']))
+
+    matcher.add(u'UTOPIA', 'shout')
+    matcher.remove(u'Utopia')
+    assert(matcher.match(u'utopia') == set(['lower', 'shout']))
+
+    matcher.remove(u'utopia')
+    matcher.remove(u'UTOPIA')
+    assert(matcher.match(u'utopia') == set())
+    assert(len(matcher._automaton) == 0)
+
+    matcher.add(u'Utopia', 'again')
+    matcher.on_005(None, None, None, ['CASEMAPPING=ascii'])
+    assert(matcher.match(u'utopia') == set(['again']))
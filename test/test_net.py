@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import socket
+import time
+
+import gevent
+import gevent.server
+
+from utopia.net import Resolver, create_connection, interleave
+
+
+def _info(family, host, port):
+    return (family, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (host, port))
+
+
+def test_resolver_cache():
+    """
+    Ensure lookups are cached until their TTL expires.
+    """
+    calls = []
+
+    def lookup(host, port):
+        calls.append(host)
+        return [_info(socket.AF_INET, '127.0.0.1', port)]
+
+    resolver = Resolver(ttl=60, lookup=lookup)
+    assert(resolver.resolve('irc.test.host', 6667) ==
+           resolver.resolve('irc.test.host', 6667))
+    assert(calls == ['irc.test.host'])
+
+    resolver.invalidate('irc.test.host')
+    resolver.resolve('irc.test.host', 6667)
+    assert(len(calls) == 2)
+
+    resolver.ttl = 0
+    resolver.invalidate()
+    resolver.resolve('irc.test.host', 6667)
+    resolver.resolve('irc.test.host', 6667)
+    assert(len(calls) == 4)
+
+
+def test_resolver_killed_lookup():
+    """
+    Ensure waiters for a lookup whose greenlet was killed do their own.
+    """
+    calls = []
+
+    def lookup(host, port):
+        calls.append(host)
+        if len(calls) == 1:
+            gevent.sleep(10)
+        return [_info(socket.AF_INET, '127.0.0.1', port)]
+
+    resolver = Resolver(lookup=lookup)
+    first = gevent.spawn(resolver.resolve, 'irc.test.host', 6667)
+    second = gevent.spawn(resolver.resolve, 'irc.test.host', 6667)
+    gevent.sleep(0.01)
+    first.kill()
+
+    assert(second.get(timeout=1)[0][4] == ('127.0.0.1', 6667))
+    assert(len(calls) == 2)
+
+
+def test_connect_unexpected_error():
+    """
+    Ensure an attempt failing with something other than socket.error
+    raises it rather than hanging.
+    """
+    def lookup(host, port):
+        # Not a valid AF_INET address, connect() raises a TypeError.
+        return [_info(socket.AF_INET, '127.0.0.1', port)[:4] + (
+            ('127.0.0.1',),
+        )]
+
+    with gevent.Timeout(2):
+        try:
+            create_connection(
+                ('irc.test.host', 6667),
+                resolver=Resolver(lookup=lookup)
+            )
+        except TypeError:
+            pass
+        else:
+            assert(False)
+
+
+def test_interleave():
+    """
+    Ensure address families alternate, starting with the first one.
+    """
+    addresses = [
+        _info(socket.AF_INET6, '::1', 1),
+        _info(socket.AF_INET6, '::2', 1),
+        _info(socket.AF_INET6, '::3', 1),
+        _info(socket.AF_INET, '127.0.0.1', 1)
+    ]
+    ordered = [a[4][0] for a in interleave(addresses)]
+    assert(ordered == ['::1', '127.0.0.1', '::2', '::3'])
+
+
+def test_happy_eyeballs_skips_dead_addresses():
+    """
+    Ensure a dead address doesn't hold up connecting to a live one.
+    """
+    server = gevent.server.StreamServer(('127.0.0.1', 0), lambda s, a: None)
+    server.start()
+
+    # Find a port nothing is listening on.
+    dead = socket.socket()
+    dead.bind(('127.0.0.1', 0))
+    dead_port = dead.getsockname()[1]
+    dead.close()
+
+    def lookup(host, port):
+        return [
+            _info(socket.AF_INET, '127.0.0.1', dead_port),
+            _info(socket.AF_INET, '127.0.0.1', server.server_port)
+        ]
+
+    try:
+        started = time.time()
+        sock = create_connection(
+            ('irc.test.host', 6667),
+            timeout=5,
+            resolver=Resolver(lookup=lookup),
+            delay=2
+        )
+        assert(time.time() - started < 1)
+        assert(sock.getpeername()[1] == server.server_port)
+        sock.close()
+    finally:
+        server.stop()
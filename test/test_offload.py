@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+
+import gevent
+
+from utopia import signals
+from utopia.client import CoreClient
+from utopia.offload import Offloader
+from test.util import TestVarContainer, unique_identity
+
+
+def _pid(value):
+    return os.getpid(), value * 2
+
+
+def test_offloaded_receivers():
+    """
+    Ensure offloaded receivers run off the hub, within the concurrency
+    limit, and their results are delivered back to the hub.
+    """
+    offloader = Offloader(threads=4, limit=2)
+    client = CoreClient(unique_identity(), 'localhost')
+    container = TestVarContainer('done')
+
+    lock = threading.Lock()
+    running = [0, 0]
+    results = []
+
+    def heavy(prefix, command, args):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        # Blocks this thread, not the hub.
+        time.sleep(0.2)
+        with lock:
+            running[0] -= 1
+        return args[-1].upper()
+
+    def have_result(client, result):
+        assert(isinstance(client, CoreClient))
+        results.append(result)
+        if len(results) == 4:
+            container.done.set()
+
+    offloader.connect(
+        signals.on_raw_message, heavy, client, callback=have_result
+    )
+
+    ticks = []
+    ticker = gevent.spawn(
+        lambda: [ticks.append(gevent.sleep(0.01)) for _ in range(40)]
+    )
+
+    started = time.time()
+    for i in range(4):
+        client.process_line(u'PRIVMSG #test :message {0}'.format(i))
+
+    assert(container.wait_all(timeout=5))
+    ticker.join()
+    offloader.close()
+
+    assert(sorted(results) == ['MESSAGE {0}'.format(i) for i in range(4)])
+    assert(running[1] == 2)
+    assert(0.4 <= time.time() - started < 1)
+    assert(len(ticks) == 40)
+
+
+def test_offloaded_processes():
+    """
+    Ensure decorated and undecorated receivers can run in worker
+    processes.
+    """
+    global _pid
+
+    offloader = Offloader(threads=2, processes=2)
+    client = CoreClient(unique_identity(), 'localhost')
+
+    # Decorated the way a module would be, so the receiver takes the
+    # function's name.
+    plain = _pid
+    _pid = offloader.offload()(plain)
+    try:
+        pid, value = _pid(client, value=21)
+        assert(pid != os.getpid())
+        assert(value == 42)
+
+        assert(offloader.run(divmod, 7, 2) == (3, 1))
+    finally:
+        _pid = plain
+        offloader.close()
@@ -3,7 +3,9 @@ from itertools import repeat
 
 from nose.tools import timed
 
+from utopia.parsing import pack_message
 from utopia.parsing import unpack_message
+from utopia.parsing import unpack_tagged_message
 from utopia.parsing import unpack_005
 
 
@@ -110,3 +112,89 @@ def test_parse_005():
         'PREFIX': {'o': '@', 'v': '+'},
         'STATUSMSG': ('@', '+')
     })
+
+
+def test_pack_message():
+    """
+    Ensure pack_message is the inverse of unpack_message.
+    """
+    messages = [
+        ('PRIVMSG', ['#test', u'± äöü with spaces']),
+        ('PRIVMSG', ['#test', ':-)']),
+        ('TOPIC', ['#test', '']),
+        ('MODE', ['#test', '+o', 'TestNick']),
+        ('QUIT', [])
+    ]
+
+    for command, params in messages:
+        packed = pack_message(command, params)
+        assert(packed.endswith(b'\r\n'))
+        assert(unpack_message(packed.decode('utf-8')) == (
+            None, command, params
+        ))
+
+    assert(pack_message('MODE', ['#test', '+o']) == b'MODE #test +o\r\n')
+    assert(pack_message('QUIT', []) == b'QUIT\r\n')
+
+    prefix = ('TestNick', 'TestUsername', 'test.host')
+    packed = pack_message('JOIN', ['#test'], prefix=prefix)
+    assert(packed == b':TestNick!TestUsername@test.host JOIN #test\r\n')
+    assert(unpack_message(packed.decode('utf-8'))[0] == prefix)
+
+
+def test_pack_message_tags():
+    """
+    Ensure IRCv3 tags survive a round trip, including escaped values.
+    """
+    tags = {'batch': 'yXNAbvnRHTRBv', 'example.com/x': 'a; b\\c', 'flag': None}
+    packed = pack_message('PRIVMSG', ['#test', 'hello'], tags=tags)
+
+    assert(packed.startswith(b'@'))
+    assert(unpack_tagged_message(packed.decode('utf-8')) == (
+        tags, None, 'PRIVMSG', ['#test', 'hello']
+    ))
+    assert(unpack_message(packed.decode('utf-8')) == (
+        None, 'PRIVMSG', ['#test', 'hello']
+    ))
+
+
+def test_pack_message_validation():
+    """
+    Ensure pack_message refuses parameters that would corrupt or inject
+    messages.
+    """
+    invalid = [
+        ('PRIVMSG', ['#test', 'hi\r\nQUIT :injected']),
+        ('PRIVMSG', ['#test\nQUIT', 'hi']),
+        ('PRIVMSG', ['#test #other', 'hi']),
+        ('PRIVMSG', [':#test', 'hi']),
+        ('PRIVMSG', ['', 'hi']),
+        ('PRIV MSG', ['#test', 'hi']),
+        ('', ['#test'])
+    ]
+
+    for command, params in invalid:
+        try:
+            pack_message(command, params)
+        except ValueError:
+            pass
+        else:
+            assert False, (command, params)
+
+
+def test_parse_tags_only():
+    """
+    Ensure a line with tags but no command is treated as empty.
+    """
+    for line in (u'@a=b', u'@a=b ', u'@a=b\r\n'):
+        assert(unpack_message(line) is None)
+        assert(unpack_tagged_message(line) is None)
+
+
+def test_pack_message_coerce():
+    """
+    Ensure non-string parameters are converted to strings.
+    """
+    packed = pack_message('MODE', ['#test', '+l', 10])
+    assert(packed == b'MODE #test +l 10\r\n')
+    assert(pack_message('PONG', [1.5]) == b'PONG 1.5\r\n')
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import gevent
+
+from utopia import signals
+from utopia.client import CoreClient
+from utopia.pool import SenderPool
+from test.util import unique_identity
+
+
+def _join(client, *channels):
+    for channel in channels:
+        client.process_line(u':{0}!u@h JOIN {1}'.format(
+            client.identity.nick, channel
+        ))
+
+
+def _sent(client):
+    lines = []
+    while not client._message_queue.empty():
+        lines.append(client._message_queue.get())
+    return lines
+
+
+def test_sender_pool_routing():
+    """
+    Ensure messages go through connections in the target channel with
+    the most budget left, keeping each target's lines in order.
+    """
+    first = CoreClient(unique_identity(), 'localhost')
+    second = CoreClient(unique_identity(), 'localhost')
+    pool = SenderPool([first, second], rate=100, burst=2)
+    _join(first, '#a', '#b')
+    _join(second, '#a')
+
+    assert(pool.route('#b') is first)
+    for i in range(4):
+        pool.privmsg('#b', 'b{0}'.format(i))
+    # first now has a backlog, so #a goes through second.
+    assert(pool.route('#a') is second)
+    pool.notice('#a', 'a')
+    pool.privmsg('somebody', 'hello')
+
+    gevent.sleep(0.2)
+    assert(_sent(first) == [
+        'PRIVMSG #b b{0}\r\n'.format(i).encode('utf-8') for i in range(4)
+    ])
+    assert(_sent(second) == [
+        b'NOTICE #a a\r\n',
+        b'PRIVMSG somebody hello\r\n'
+    ])
+    assert(not pool._pinned)
+
+    first.process_line(u':{0}!u@h PART #b'.format(first.identity.nick))
+    try:
+        pool.privmsg('#b', 'lost')
+    except ValueError:
+        pass
+    else:
+        assert(False)
+
+    pool.close()
+
+
+def test_sender_pool_invalid():
+    """
+    Ensure an invalid message is refused without stopping the pool.
+    """
+    client = CoreClient(unique_identity(), 'localhost')
+    pool = SenderPool([client], rate=100, burst=5)
+
+    try:
+        pool.privmsg('bad target', 'x')
+    except ValueError:
+        pass
+    else:
+        assert(False)
+
+    pool.privmsg('somebody', 'hello')
+    gevent.sleep(0.1)
+    assert(_sent(client) == [b'PRIVMSG somebody hello\r\n'])
+    assert(not pool._pinned)
+
+    pool.close()
+
+
+def test_sender_pool_reconnect():
+    """
+    Ensure a connection that reconnects is used again.
+    """
+    first = CoreClient(unique_identity(), 'localhost')
+    second = CoreClient(unique_identity(), 'localhost')
+    pool = SenderPool([first, second])
+
+    signals.on_disconnect.send(first)
+    signals.on_disconnect.send(second)
+    try:
+        pool.route('nick')
+    except ValueError:
+        pass
+    else:
+        assert False
+
+    signals.on_connect.send(first)
+    assert(pool.route('nick') is first)
+    signals.on_connect.send(second)
+    assert(all(member.connected for member in pool.members))
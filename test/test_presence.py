@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from utopia import signals
+from utopia.client import CoreClient
+from utopia.plugins.presence import PresencePlugin, chunks
+from test.util import unique_identity
+
+
+def _client(nicks, isupport):
+    presence = PresencePlugin(nicks, interval=3600)
+    client = CoreClient(unique_identity(), 'localhost', plugins=[presence])
+
+    sent = []
+    client.send = lambda *args: sent.append(args)
+
+    changes = []
+
+    def on_presence(client, nick, online):
+        changes.append((nick, online))
+
+    signals.on_presence.connect(on_presence, sender=client, weak=False)
+
+    client.process_line(u':irc.host 005 me {0} :are supported'.format(
+        isupport))
+    client.process_line(u':irc.host 376 me :End of MOTD')
+    return client, presence, sent, changes
+
+
+def test_chunks():
+    """
+    Ensure items are packed into as few lines as fit.
+    """
+    nicks = [u'nick{0:04d}'.format(i) for i in range(1000)]
+    lines = list(chunks(nicks, len('ISON :')))
+    assert(sum(len(line) for line in lines) == 1000)
+    assert(all(len('ISON :' + u' '.join(line)) <= 510 for line in lines))
+    # 8 characters and a space per nick, 504 left for them.
+    assert(len(lines[0]) == 56)
+
+
+def test_monitor():
+    """
+    Ensure MONITOR is used up to its limit and the rest is polled.
+    """
+    client, presence, sent, changes = _client(
+        [u'Alice', u'bob', u'carol'], u'MONITOR=2'
+    )
+
+    assert(presence.mode == 'monitor')
+    assert(sent == [('MONITOR', '+', u'Alice,bob'), ('ISON', u'carol')])
+    assert(presence.polled == [u'carol'])
+
+    client.process_line(u':irc.host 730 me :alice!a@h')
+    client.process_line(u':irc.host 731 me :bob')
+    client.process_line(u':irc.host 303 me :Carol')
+    client.process_line(u':irc.host 730 me :bob!b@h')
+    client.process_line(u':carol!c@h QUIT :bye')
+    assert(changes == [
+        (u'Alice', True),
+        (u'bob', False),
+        (u'carol', True),
+        (u'bob', True),
+        (u'carol', False)
+    ])
+    assert(sorted(presence.online) == [u'Alice', u'bob'])
+
+    del sent[:]
+    presence.remove(u'ALICE')
+    presence.add(u'dave')
+    assert(sent == [('MONITOR', '-', u'ALICE'), ('MONITOR', '+', u'dave')])
+    assert(presence.is_online(u'dave') is None)
+
+
+def test_watch_and_ison():
+    """
+    Ensure WATCH is used when MONITOR isn't available, and ISON when
+    neither is.
+    """
+    client, presence, sent, changes = _client([u'alice', u'bob'], 'WATCH=128')
+    assert(presence.mode == 'watch')
+    assert(sent == [('WATCH', u'+alice +bob')])
+    client.process_line(u':irc.host 604 me alice a h 0 :is online')
+    client.process_line(u':irc.host 605 me bob * * 0 :is offline')
+    client.process_line(u':irc.host 601 me alice a h 0 :logged offline')
+    assert(changes == [(u'alice', True), (u'bob', False), (u'alice', False)])
+
+    nicks = [u'nick{0:04d}'.format(i) for i in range(120)]
+    client, presence, sent, changes = _client(nicks, 'NICKLEN=30')
+    assert(presence.mode == 'ison')
+    assert([command for command, _ in sent] == ['ISON'] * 3)
+    for _, nicks in sent:
+        client.process_line(u':irc.host 303 me :' + nicks.split()[0])
+    assert(len(changes) == 120)
+    assert(len(presence.online) == 3)
+
+
+def test_ison_reply_matching():
+    """
+    Ensure replies to ISONs the plugin didn't send are ignored.
+    """
+    client, presence, sent, changes = _client(
+        [u'alice', u'bob'], 'NICKLEN=30'
+    )
+    assert(sent == [('ISON', u'alice bob')])
+
+    client.process_line(u':irc.host 303 me :carol alice')
+    assert(changes == [])
+    client.process_line(u':irc.host 303 me :Bob')
+    assert(changes == [(u'alice', False), (u'bob', True)])
+
+
+def test_ison_casemapping():
+    """
+    Ensure nicks are folded with the server's casemapping, and polls that
+    were never answered don't stop polling.
+    """
+    client, presence, sent, changes = _client(
+        [u'Foo[x]', u'bar'], 'CASEMAPPING=rfc1459'
+    )
+    assert(sent == [('ISON', u'Foo[x] bar')])
+    assert(u'FOO{X}' in presence)
+
+    client.process_line(u':irc.host 303 me :foo{x}')
+    assert(changes == [(u'Foo[x]', True), (u'bar', False)])
+    assert(not presence._polls)
+
+    # The next reply is lost; the poll after it is still sent.
+    presence._poll(client)
+    presence.interval = 0
+    presence._poll(client)
+    assert(sent[1:] == [('ISON', u'Foo[x] bar')] * 2)
+
+    client, presence, sent, changes = _client([u'Foo[x]'], 'CASEMAPPING=ascii')
+    assert(u'foo{x}' not in presence)
+    assert(presence.is_online(u'FOO[X]') is None)
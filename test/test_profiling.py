@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import sys
+import time
+
+import gevent
+
+from utopia import signals
+from utopia.profiling import DispatchProfiler, subscribers
+
+
+class Receiver(object):
+    def fast(self, sender, value):
+        return value
+
+    def slow(self, sender, value):
+        # Deliberately blocks the hub.
+        time.sleep(0.05)
+
+    def blocking(self, sender, value):
+        time.sleep(0.5)
+
+
+def test_profiler_report():
+    """
+    Ensure the profiler records calls per signal and receiver qualname,
+    and flags receivers running past the threshold.
+    """
+    receiver = Receiver()
+    signal = signals.signal('test-profiler-report')
+    signal.connect(receiver.fast)
+    signal.connect(receiver.slow)
+
+    with DispatchProfiler(threshold=0.01, monitor=False) as profiler:
+        for i in range(3):
+            results = signal.send(None, value=i)
+
+    assert(signals.Signal.profiler is None)
+    assert(sorted(r for _, r in results if r is not None) == [2])
+
+    report = profiler.report()['test-profiler-report']
+    fast = report['test.test_profiling.Receiver.fast']
+    slow = report['test.test_profiling.Receiver.slow']
+
+    assert(fast['calls'] == 3)
+    assert(fast['slow'] == 0)
+    assert(slow['calls'] == 3)
+    assert(slow['slow'] == 3)
+    assert(slow['max'] >= 0.05)
+    assert(slow['total'] >= slow['max'])
+
+
+def test_profiler_monitor():
+    """
+    Ensure receivers blocking the hub are flagged by the monitoring
+    thread, and stop() ends the thread.
+    """
+    if subscribers is None:
+        return
+
+    receiver = Receiver()
+    signal = signals.signal('test-profiler-monitor')
+    signal.connect(receiver.blocking)
+
+    hub = gevent.get_hub()
+    assert(hub.periodic_monitoring_thread is None)
+
+    profiler = DispatchProfiler(threshold=0.05).install()
+    thread = hub.periodic_monitoring_thread
+    assert(thread is not None)
+    gevent.sleep(0.1)
+    signal.send(None, value=1)
+
+    assert(profiler.stop(timeout=5))
+    assert(hub.periodic_monitoring_thread is None)
+    assert(thread.monitor_thread_ident not in sys._current_frames())
+    assert(signals.Signal.profiler is None)
+
+    report = profiler.report()['test-profiler-monitor']
+    assert(report['test.test_profiling.Receiver.blocking']['blocked'] == 1)
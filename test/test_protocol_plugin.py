@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
+from utopia.client import EasyClient
 from utopia.plugins.handshake import HandshakePlugin
 from utopia.plugins.protocol import EasyProtocolPlugin
 from utopia.plugins.util import LogPlugin
 from utopia import signals
-from test.util import TestVarContainer, get_two_joined_clients, unique_channel
+from test.util import (
+    TestVarContainer,
+    get_two_joined_clients,
+    unique_channel,
+    unique_identity
+)
 
 
 def test_ctcp_events():
@@ -77,3 +83,20 @@ def test_pubmsg_targets():
     client2.notice(client1.identity.nick, 'private notice')
 
     assert c.wait_all(timeout=2)
+
+
+def test_easy_interests():
+    """
+    Ensure events made up by EasyProtocolPlugin ask for the commands
+    they are made from.
+    """
+    client = EasyClient(
+        unique_identity(), 'localhost',
+        commands=['PUBMSG', 'privnotice', 'CTCP_VERSION', 'JOIN']
+    )
+    assert(client.protocol.interests == set([
+        b'PRIVMSG', b'NOTICE', b'JOIN', b'001', b'PING', b'005'
+    ]))
+    assert(EasyClient(unique_identity(), 'localhost').protocol.interests
+           is None)
+
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+
+import gevent
+
+from utopia.client import CoreClient
+from utopia.plugins.util import RecPlugin, RecordedLog
+from test.util import unique_identity
+
+LINES = [
+    u':irc.test.host 001 TestNick :Welcome to the test server!',
+    u':TestNick!TestUsername@test.host JOIN :#test',
+    u':Other!other@test.host PRIVMSG #test :± äöü',
+    u'PING :irc.test.host'
+]
+
+
+def test_record_and_replay():
+    """
+    Ensure RecPlugin writes a log that RecordedLog can read back and
+    replay through a client.
+    """
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'capture.log')
+    try:
+        recorder = RecPlugin(path=path)
+        client = CoreClient(unique_identity(), 'localhost', plugins=[
+            recorder
+        ])
+        for line in LINES:
+            client.process_line(line)
+        gevent.sleep(0)
+        recorder.close()
+
+        log = RecordedLog(path)
+        assert(len(log) == len(LINES))
+        assert([line for _, line in log] == LINES)
+        assert(log[-1][1] == LINES[-1])
+        assert(log.find(log[2][0]) <= 2)
+        assert(log.find(log[-1][0] + 1) == len(LINES))
+
+        rec_plugin = RecPlugin(maxlen=2)
+        replayed = CoreClient(unique_identity(), 'localhost', plugins=[
+            rec_plugin
+        ])
+        assert(log.replay(replayed) == len(LINES))
+        gevent.sleep(0)
+        log.close()
+
+        assert(len(rec_plugin.received) == 2)
+        assert(rec_plugin.did_receive('001'))
+        assert(rec_plugin.did_receive('PRIVMSG'))
+        assert(not rec_plugin.did_receive('QUIT'))
+        assert(rec_plugin.received[-1][1] == 'PING')
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import gevent
+
+from utopia import signals
+from utopia.client import CoreClient
+from utopia.plugins.protocol import EasyProtocolPlugin
+from utopia.plugins.router import CommandRouter, CommandError, split_args
+from test.util import unique_identity
+
+
+def _process(client, *lines):
+    for line in lines:
+        client.process_line(line)
+    gevent.sleep(0.1)
+
+
+# blinker tracks receivers by id(), keep routers alive so a new one can't
+# reuse the id of one that is being cleaned up.
+_routers = []
+
+
+def _router(**kwargs):
+    router = CommandRouter(**kwargs)
+    client = CoreClient(unique_identity(), 'localhost', plugins=[
+        EasyProtocolPlugin(),
+        router
+    ])
+    _routers.append(router)
+    return client, router
+
+
+def test_split_args():
+    """
+    Ensure quoted words are kept together.
+    """
+    words = split_args(u'a "b c" "d \\"e\\""  f')
+    assert([w for w, _ in words] == [u'a', u'b c', u'd "e"', u'f'])
+    assert(words[-1][1] == 19)
+
+
+def test_routing():
+    """
+    Ensure commands, aliases, subcommands and abbreviations are routed,
+    and arguments are converted.
+    """
+    client, router = _router()
+    called = []
+
+    @router.command('add', args=(int, int))
+    def add(invocation, a, b=1):
+        called.append(('add', a + b))
+
+    @router.command('say', aliases=('echo',), args=(str, str))
+    def say(invocation, target, text):
+        called.append(('say', target, text, invocation.channel))
+
+    @router.command('config set', args=(str, str))
+    def config_set(invocation, key, value):
+        called.append(('set', key, value))
+
+    @router.command('config get')
+    def config_get(invocation):
+        called.append(('get', invocation.args))
+
+    @router.command('stats')
+    def stats(invocation):
+        called.append(('stats',))
+
+    errors = []
+
+    def on_error(client, invocation, error):
+        errors.append(str(error))
+
+    signals.on_command_error.connect(on_error, sender=client)
+
+    lines = [
+        u':n!u@h PRIVMSG #c :!add 2 3',
+        u':n!u@h PRIVMSG #c :!ADD 2',
+        u':n!u@h PRIVMSG #c :!echo #other hello there, world',
+        u':n!u@h PRIVMSG #c :!conf s "a key" value with spaces',
+        u':n!u@h PRIVMSG #c :!config get x y',
+        u':n!u@h PRIVMSG #c :!st',
+        u':n!u@h PRIVMSG #c :just talking !stats',
+        u':n!u@h PRIVMSG me :stats',
+        u':n!u@h PRIVMSG #c :!s',
+        u':n!u@h PRIVMSG #c :!add x',
+        u':n!u@h PRIVMSG #c :!config',
+        u':n!u@h PRIVMSG #c :!unknown',
+        u':n!u@h PRIVMSG #c :!'
+    ]
+    _process(client, *lines)
+
+    assert(called == [
+        ('add', 5),
+        ('add', 3),
+        ('say', '#other', u'hello there, world', '#c'),
+        ('set', 'a key', u'value with spaces'),
+        ('get', [u'x', u'y']),
+        ('stats',),
+        ('stats',)
+    ])
+    assert(len(errors) == 3)
+    assert(errors[0].startswith('Ambiguous'))
+    assert('config' in errors[2] and 'get|set' in errors[2])
+
+    router.remove('config')
+    assert('config set' not in router)
+    _process(client, u':n!u@h PRIVMSG #c :!conf get')
+    assert(len(called) == 7)
+    _process(client, u':n!u@h PRIVMSG #c :!sa hi "there" you')
+    assert(called[-1] == ('say', 'hi', u'"there" you', '#c'))
+
+
+def test_cooldowns():
+    """
+    Ensure cooldowns apply per user or channel and handlers can report
+    errors.
+    """
+    client, router = _router()
+    called = []
+
+    @router.command('slow', cooldown=60)
+    def slow(invocation):
+        called.append(invocation.prefix.nick)
+
+    @router.command('shared', cooldown=60, per='channel')
+    def shared(invocation):
+        called.append(invocation.channel)
+
+    @router.command('fail')
+    def fail(invocation):
+        raise CommandError('nope')
+
+    errors = []
+
+    def on_error(client, invocation, error):
+        errors.append((invocation.command.name, str(error)))
+
+    signals.on_command_error.connect(on_error, sender=client)
+
+    _process(
+        client,
+        u':a!u@h PRIVMSG #c :!slow',
+        u':a!u@h PRIVMSG #c :!slow',
+        u':b!u@h PRIVMSG #c :!slow',
+        u':a!u@h PRIVMSG #c :!shared',
+        u':b!u@h PRIVMSG #c :!shared',
+        u':b!u@h PRIVMSG #d :!shared',
+        u':a!u@h PRIVMSG #c :!fail'
+    )
+
+    assert(called == ['a', 'b', '#c', '#d'])
+    assert([name for name, _ in errors] == ['slow', 'shared', 'fail'])
+    assert(errors[-1][1] == 'nope')
+
+
+def test_cooldown_usage_error():
+    """
+    Ensure a usage error doesn't put the user on cooldown.
+    """
+    client, router = _router()
+    called = []
+
+    @router.command('roll', cooldown=60, args=(int,))
+    def roll(invocation, sides):
+        called.append(sides)
+
+    _process(
+        client,
+        u':a!u@h PRIVMSG #c :!roll',
+        u':a!u@h PRIVMSG #c :!roll six',
+        u':a!u@h PRIVMSG #c :!roll 6',
+        u':a!u@h PRIVMSG #c :!roll 20'
+    )
+
+    assert(called == [6])
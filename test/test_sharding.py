@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from gevent.event import Event
+
+from utopia import signals
+from utopia.sharding import Coordinator, HashRing, channel_limit
+from test.util import unique_channel, unique_identity
+
+
+def test_hash_ring():
+    """
+    Ensure removing a node only moves the keys that belonged to it.
+    """
+    ring = HashRing(range(4))
+    keys = ['#channel{0}'.format(i) for i in range(1000)]
+    before = dict((key, ring.get(key)) for key in keys)
+    assert(len(set(before.values())) == 4)
+
+    ring.remove(2)
+    assert(ring.nodes == set([0, 1, 3]))
+    for key in keys:
+        if before[key] != 2:
+            assert(ring.get(key) == before[key])
+        else:
+            assert(ring.get(key) != 2)
+
+    assert(sorted(ring.iter_nodes('#test')) == [0, 1, 3])
+    assert(HashRing().get('#test') is None)
+
+
+def test_channel_limit():
+    """
+    Ensure channel limits are read from CHANLIMIT, then MAXCHANNELS.
+    """
+    assert(channel_limit({'CHANLIMIT': {'#&': 20, '+': 10}}) == 20)
+    assert(channel_limit({'CHANLIMIT': {'#&': 20, '+': 10}}, '+') == 10)
+    assert(channel_limit({'CHANLIMIT': {'#': ''}}) is None)
+    assert(channel_limit({'MAXCHANNELS': 30}) == 30)
+    assert(channel_limit({}) is None)
+
+
+def test_coordinator():
+    """
+    Ensure channels are spread over the workers' connections within
+    their channel limits and events reach the coordinator.
+    """
+    channels = [unique_channel() for _ in range(7)]
+    coordinator = Coordinator(
+        unique_identity(), 'localhost',
+        channels=channels,
+        workers=2,
+        connections=2,
+        max_channels=2
+    )
+
+    joined = set()
+    done = Event()
+
+    def on_message(coordinator, slot, message):
+        if message.command == 'JOIN':
+            joined.add((message.args[0], slot))
+            if len(joined) == len(channels):
+                done.set()
+
+    signals.on_shard_message.connect(on_message, sender=coordinator)
+    coordinator.start()
+    try:
+        assert(done.wait(timeout=15))
+        assert(not coordinator.pending)
+        for channel, slot in joined:
+            assert(coordinator.slot_for(channel) == slot)
+
+        per_slot = [slot for _, slot in joined]
+        assert(max(per_slot.count(s) for s in set(per_slot)) <= 2)
+    finally:
+        coordinator.stop()
+
+
+def test_coordinator_placement():
+    """
+    Ensure a repeated MOTD doesn't let a slot go over its limit and
+    channels that weren't placed can't be sent to.
+    """
+    channels = [unique_channel() for _ in range(5)]
+    coordinator = Coordinator(
+        unique_identity(), 'localhost',
+        channels=channels,
+        workers=1,
+        connections=2,
+        max_channels=2
+    )
+    sent = []
+    coordinator.send = lambda slot, command, *args: sent.append(
+        (slot, command)
+    )
+
+    coordinator._ready(0, '0')
+    coordinator._ready(1, '0')
+    joins = len(sent)
+    coordinator._ready(0, '0')
+    coordinator._ready(1, '0')
+
+    assert(len(sent) == joins)
+    assert(len(coordinator.placed) == 4)
+    assert(len(coordinator.pending) == 1)
+    for slot in (0, 1):
+        assert(len(coordinator._joined[slot]) == 2)
+
+    placed = next(iter(coordinator.placed))
+    coordinator.send_channel(placed, 'PRIVMSG', placed, 'hello')
+    assert(sent[-1] == (coordinator.slot_for(placed), 'PRIVMSG'))
+
+    try:
+        coordinator.send_channel(list(coordinator.pending)[0], 'PRIVMSG')
+    except KeyError:
+        pass
+    else:
+        assert(False)
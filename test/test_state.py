@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+
+from utopia.client import CoreClient
+from utopia.plugins.state import StatePlugin
+from test.util import unique_identity
+
+
+def _sent(client):
+    lines = []
+    while not client._message_queue.empty():
+        lines.append(client._message_queue.get())
+    return lines
+
+
+def test_state_tracking():
+    """
+    Ensure channel topics, modes and users are tracked.
+    """
+    state = StatePlugin()
+    client = CoreClient(unique_identity(), 'localhost', plugins=[state])
+    nick = client.identity.nick
+
+    for line in (
+            u':irc.test.host 001 {0} :Welcome'.format(nick),
+            u':irc.test.host 005 {0} PREFIX=(ov)@+ CHANMODES=b,k,l,imnt '
+            u':are supported'.format(nick),
+            u':{0}!u@h JOIN #Test'.format(nick),
+            u':irc.test.host 332 {0} #test :The topic'.format(nick),
+            u':irc.test.host 353 {0} = #test :@{0} +other'.format(nick),
+            u':irc.test.host 366 {0} #test :End'.format(nick),
+            u':{0}!u@h MODE #test +ntl-v+ob 10 other other x!*@*'.format(
+                nick
+            ),
+            u':third!u@h JOIN #test',
+            u':third!u@h NICK fourth',
+            u':other!u@h PART #test'):
+        client.process_line(line)
+
+    channel = state['#TEST']
+    assert(channel.name == '#Test')
+    assert(channel.topic == 'The topic')
+    assert(channel.modes == {'n': None, 't': None, 'l': '10'})
+    assert(channel.users == {nick: '@', 'fourth': ''})
+    assert(not channel.provisional)
+    assert(state.isupport[1]['PREFIX'] == {'o': '@', 'v': '+'})
+
+
+def test_state_snapshot():
+    """
+    Ensure a saved snapshot is loaded as provisional state and only the
+    missing parts are queried after reconnecting.
+    """
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'state')
+    try:
+        state = StatePlugin(path=path)
+        client = CoreClient(unique_identity(), 'localhost', plugins=[state])
+        nick = client.identity.nick
+        for line in (
+                u':irc.test.host 001 {0} :Welcome'.format(nick),
+                u':irc.test.host 005 {0} CHANTYPES=# :are supported'.format(
+                    nick
+                ),
+                u':{0}!u@h JOIN #one'.format(nick),
+                u':{0}!u@h JOIN #two'.format(nick),
+                u':irc.test.host 324 {0} #one +nt'.format(nick)):
+            client.process_line(line)
+        state.save()
+
+        restored = StatePlugin(path=path)
+        client = CoreClient(unique_identity(), 'localhost', plugins=[
+            restored
+        ])
+        assert(sorted(restored.provisional) == ['#one', '#two'])
+        assert(restored['#one'].modes == {'n': None, 't': None})
+        assert(restored.isupport[1]['CHANTYPES'] == ('#',))
+
+        client.process_line(u':irc.test.host 001 {0} :Hi'.format(nick))
+        assert(_sent(client) == [b'JOIN #one,#two\r\n', b'MODE #two\r\n'])
+
+        client.process_line(u':{0}!u@h JOIN #one'.format(nick))
+        client.process_line(u':irc.test.host 366 {0} #one :End'.format(nick))
+        assert(restored.provisional == ['#two'])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_state_rejoin_keys():
+    """
+    Ensure channels with a key are rejoined with it.
+    """
+    state = StatePlugin()
+    client = CoreClient(unique_identity(), 'localhost', plugins=[state])
+    nick = client.identity.nick
+    for line in (
+            u':irc.test.host 001 {0} :Welcome'.format(nick),
+            u':{0}!u@h JOIN #open'.format(nick),
+            u':{0}!u@h JOIN #locked'.format(nick),
+            u':{0}!u@h JOIN #other'.format(nick),
+            u':irc.test.host 324 {0} #locked +nk secret'.format(nick),
+            u':{0}!u@h MODE #other +k-k+k old old new'.format(nick),
+            u':{0}!u@h MODE #open +k-k x x'.format(nick)):
+        client.process_line(line)
+    _sent(client)
+
+    client.process_line(u':irc.test.host 001 {0} :Hi'.format(nick))
+    assert(_sent(client)[0] == b'JOIN #locked,#other,#open secret,new\r\n')
+
+
+def test_state_malformed():
+    """
+    Ensure malformed lines are ignored and our own nick is recognised
+    regardless of case.
+    """
+    state = StatePlugin()
+    client = CoreClient(unique_identity(), 'localhost', plugins=[state])
+    for line in (
+            u':irc.test.host 001 Me[x] :Welcome',
+            u'JOIN #x',
+            u'PART #x',
+            u'QUIT :bye',
+            u'NICK other',
+            u':irc.test.host KICK #x',
+            u':irc.test.host 332 me #x',
+            u':irc.test.host 353 me = #x',
+            u':me{x}!u@h JOIN #x',
+            u':someone!u@h JOIN #x',
+            u':op!u@h KICK #x me{X} :bye'):
+        # Called directly, so an exception isn't just logged.
+        state.have_message(client, client.protocol.parse_line(line))
+
+    assert(state.channels == {})
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import time
+
+import gevent
+
+from utopia.client import CoreClient
+from utopia.timers import TimerWheel
+from test.util import unique_identity
+
+
+def test_timers():
+    """
+    Ensure timers fire in order, close to their deadline, and cancelled
+    ones don't fire at all.
+    """
+    wheel = TimerWheel(resolution=0.01)
+    start = time.time()
+    fired = []
+
+    def fire(name):
+        fired.append((name, time.time() - start))
+
+    wheel.call_later(0.3, fire, 'c')
+    wheel.call_later(0.1, fire, 'a')
+    wheel.call_later(0.2, fire, 'b')
+    wheel.call_later(0.15, fire, 'cancelled').cancel()
+    # Several timers in the same tick expire together.
+    for i in range(1000):
+        wheel.call_later(0.25, fire, i)
+    assert(len(wheel) == 1003)
+
+    gevent.sleep(0.4)
+
+    assert([name for name, _ in fired if isinstance(name, str)] ==
+           ['a', 'b', 'c'])
+    assert(len(fired) == 1003)
+    assert(all(0 <= elapsed - delay < 0.08 for (_, elapsed), delay in zip(
+        fired[:2], (0.1, 0.2))))
+    assert(len(wheel) == 0)
+
+
+def test_repeating_timers():
+    """
+    Ensure repeating timers keep firing until cancelled, even from their
+    own callback.
+    """
+    wheel = TimerWheel(resolution=0.01)
+    calls = []
+
+    def tick():
+        calls.append(time.time())
+        if len(calls) == 5:
+            timer.cancel()
+
+    timer = wheel.call_every(0.05, tick)
+    gevent.sleep(0.5)
+
+    assert(len(calls) == 5)
+    assert(not timer.active)
+    assert(len(wheel) == 0)
+
+
+def test_far_timers():
+    """
+    Ensure timers beyond the last wheel fire on time.
+    """
+    wheel = TimerWheel(resolution=1, levels=2)
+    fired = []
+    for delay in (1, 63, 64, 4095, 4096, 10000):
+        wheel.call_later(delay, fired.append, delay)
+
+    # Step through the ticks rather than waiting.
+    wheel._driver.kill()
+    base = wheel._tick
+    while wheel._tick < base + 10002:
+        for timer in wheel._advance():
+            timer.func(*timer.args)
+            assert(timer.tick == wheel._tick)
+
+    assert(fired == [1, 63, 64, 4095, 4096, 10000])
+
+
+def test_client_timers():
+    """
+    Ensure clients create a wheel on demand or use a shared one.
+    """
+    wheel = TimerWheel()
+    client = CoreClient(unique_identity(), 'localhost')
+    shared = CoreClient(unique_identity(), 'localhost', timers=wheel)
+
+    assert(isinstance(client.timers, TimerWheel))
+    assert(client.timers is client.timers)
+    assert(shared.timers is wheel)
+
+
+def test_client_timers_terminate():
+    """
+    Ensure terminating a client closes its own wheel but not a shared
+    one.
+    """
+    wheel = TimerWheel(resolution=0.01)
+    client = CoreClient(unique_identity(), 'localhost')
+    shared = CoreClient(unique_identity(), 'localhost', timers=wheel)
+    fired = []
+
+    client.timers.call_later(0.05, fired.append, 'own')
+    shared.timers.call_later(0.05, fired.append, 'shared')
+    client.terminate()
+    shared.terminate()
+
+    assert(len(client.timers) == 0)
+    assert(client.timers._driver is None)
+    gevent.sleep(0.2)
+    assert(fired == ['shared'])
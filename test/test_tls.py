@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import os.path
+import sys
+
+import gevent.server
+import gevent.socket
+import gevent.ssl
+
+import utopia.tls
+
+_CERT = os.path.join(os.path.dirname(__file__), 'tls.pem')
+
+
+class _Socket(object):
+    def __init__(self, context, session):
+        self.context = context
+        self.session = session
+        self.session_reused = False
+
+    def do_handshake(self):
+        pass
+
+
+class _Context(object):
+    """
+    Wraps sockets like a Python 2 `SSLContext`, which can't resume
+    sessions.
+    """
+    def __init__(self):
+        self.wrapped = []
+
+    def wrap_socket(self, sock, **kwargs):
+        if 'session' in kwargs:
+            raise TypeError('unexpected keyword argument session')
+        self.wrapped.append(kwargs)
+        return _Socket(self, None)
+
+
+def test_remember_session():
+    """
+    Ensure sessions are cached per context, host and port.
+    """
+    cache = utopia.tls.SessionCache(maxsize=2)
+    first, second = object(), object()
+
+    utopia.tls.remember_session(_Socket(first, 'a'), 'host', 1, cache)
+    utopia.tls.remember_session(_Socket(second, 'b'), 'host', 1, cache)
+    utopia.tls.remember_session(_Socket(second, None), 'host', 2, cache)
+
+    assert(len(cache) == 2)
+    assert(cache.get(utopia.tls.session_key(first, 'host', 1)) ==
+           (first, 'a'))
+    assert(cache.get(utopia.tls.session_key(second, 'host', 1)) ==
+           (second, 'b'))
+
+    utopia.tls.remember_session(_Socket(first, 'c'), 'other', 1, cache)
+    assert(len(cache) == 2)
+    assert(cache.get(utopia.tls.session_key(first, 'host', 1)) is None)
+
+
+def test_wrap_socket_fallback():
+    """
+    Ensure wrapping still works where sessions can't be resumed, and a
+    session cached for another context is never used.
+    """
+    cache = utopia.tls.SessionCache()
+    context, other = _Context(), _Context()
+    cache.put(utopia.tls.session_key(context, 'host', 1), (context, 'a'))
+    cache.put(utopia.tls.session_key(other, 'host', 1), (context, 'b'))
+
+    sock, _, resumed = utopia.tls.wrap_socket(
+        object(), 'host', 1, context=context, cache=cache
+    )
+    assert(not resumed)
+    assert(sock.context is context)
+    assert(len(context.wrapped) == 1)
+
+    utopia.tls.wrap_socket(object(), 'host', 1, context=other, cache=cache)
+    assert(len(other.wrapped) == 1)
+    assert(cache.get(utopia.tls.session_key(other, 'host', 1)) is None)
+
+
+def test_resume():
+    """
+    Ensure a reconnect resumes the session, and a client with another
+    context sharing the cache connects without resuming it.
+    """
+    if sys.version_info < (3, 6):
+        # Session resumption requires Python 3.6.
+        return
+
+    server_context = gevent.ssl.SSLContext(gevent.ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(_CERT)
+    # TLS 1.2 sends the session with the handshake.
+    server_context.maximum_version = gevent.ssl.TLSVersion.TLSv1_2
+
+    def handle(sock, address):
+        sock.recv(1)
+
+    server = gevent.server.StreamServer(
+        ('127.0.0.1', 0), handle, ssl_context=server_context
+    )
+    server.start()
+
+    def connect(context):
+        sock, _, resumed = utopia.tls.wrap_socket(
+            gevent.socket.create_connection(server.address),
+            'localhost',
+            server.address[1],
+            context=context,
+            cache=cache
+        )
+        sock.close()
+        return resumed
+
+    try:
+        cache = utopia.tls.SessionCache()
+        context = utopia.tls.context_from_args({})
+        other = utopia.tls.context_from_args({})
+
+        assert(connect(context) is False)
+        assert(connect(context) is True)
+        assert(connect(other) is False)
+        assert(connect(other) is True)
+        assert(len(cache) == 2)
+    finally:
+        server.stop()
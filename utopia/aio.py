@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+An asyncio client built on the same protocol core (:mod:`utopia.core`) as
+the gevent `CoreClient`. Plugins and signals work the same way, with
+receivers called on the event loop instead of in their own greenlets.
+
+Requires Python 3.5 or newer. If uvloop is installed, `new_event_loop`
+can be used to run on it instead of the default asyncio loop.
+
+The client is written with callbacks and futures rather than ``async``
+functions, so the module still parses (and lints) on Python 2, where
+importing it raises an ImportError for asyncio.
+"""
+import asyncio
+from collections import deque
+
+from utopia import signals
+from utopia.core import Closed, Connection, consumed, interests
+
+
+def new_event_loop(use_uvloop=True):
+    """
+    Returns a new event loop, using uvloop if it is requested and
+    available.
+    """
+    if use_uvloop:
+        try:
+            import uvloop
+        except ImportError:
+            pass
+        else:
+            return uvloop.new_event_loop()
+
+    return asyncio.new_event_loop()
+
+
+class _StreamProtocol(asyncio.Protocol):
+    def __init__(self, client):
+        self.client = client
+
+    def data_received(self, data):
+        self.client._receive_data(data)
+
+    def eof_received(self):
+        self.client._receive_data(b'')
+
+    def connection_lost(self, exc):
+        self.client._connection_lost()
+
+
+class AsyncClient(object):
+    def __init__(self, identity, host, port=6667, ssl=False, plugins=None,
+                 commands=None):
+        self._host = host
+        self._port = port
+        self._ssl = ssl
+        self._identity = identity
+        self._transport = None
+
+        # Outgoing message queue. Used to throttle network writes.
+        self._message_queue = deque()
+        # Message write delay in seconds.
+        self._message_delay = 0
+        # The `asyncio.TimerHandle` writing the next queued message
+        # once the delay has passed.
+        self._writer = None
+        self._closed = None
+
+        self._protocol = Connection(encoding='utf-8')
+
+        # Setup plugins.
+        self._plugins = [p.bind(self) for p in plugins or []]
+
+        # If `commands` is given, lines are only parsed and dispatched if
+        # their command is in it or asked for by a plugin (see
+        # `utopia.core.interests`). The rest are dropped unparsed.
+        if commands is not None:
+            self._protocol.interests = interests(self._plugins, commands)
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def ssl(self):
+        return self._ssl
+
+    @property
+    def socket(self):
+        if self._transport is None:
+            return None
+        return self._transport.get_extra_info('socket')
+
+    @property
+    def identity(self):
+        return self._identity
+
+    @property
+    def protocol(self):
+        return self._protocol
+
+    def connect(self, timeout=10, source=None, ssl_context=None):
+        """
+        Connect to the remote IRC server.
+
+        :param timeout: How long to wait before giving up on the connect.
+        :param source: The source address to bind to.
+        :param ssl_context: An `ssl.SSLContext` to use if using ssl. If
+                            not provided, a default context is created.
+        :returns: A future resolving to True once connected.
+        :rtype: asyncio.Future
+        """
+        loop = asyncio.get_event_loop()
+
+        ssl_context = ssl_context or self.ssl or None
+        self._closed = loop.create_future()
+        result = loop.create_future()
+
+        def connected(future):
+            if future.cancelled():
+                result.cancel()
+            elif future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                self._transport = future.result()[0]
+                loop.call_soon(signals.on_connect.send, self)
+                # Messages sent while disconnected.
+                self._write_queued()
+                result.set_result(True)
+
+        asyncio.ensure_future(asyncio.wait_for(
+            loop.create_connection(
+                lambda: _StreamProtocol(self),
+                self.host,
+                self.port,
+                ssl=ssl_context,
+                local_addr=source
+            ),
+            timeout
+        )).add_done_callback(connected)
+
+        return result
+
+    def wait_closed(self):
+        """
+        Returns a future resolving once the connection has been closed.
+        """
+        return asyncio.shield(self._closed)
+
+    def _receive_data(self, data):
+        for event in self._protocol.receive_data(data):
+            if isinstance(event, Closed):
+                self.terminate()
+                return
+
+            self._dispatch(event)
+
+    def _dispatch(self, message):
+        signals.on_raw_line.send_isolated(self, line=message.line)
+        if consumed(signals.on_message.send_isolated(self, message=message)):
+            return
+        signals.on_raw_message.send(
+            self,
+            prefix=message.prefix,
+            command=message.command,
+            args=message.args
+        )
+
+    def _connection_lost(self):
+        self._transport = None
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+
+        if not self._closed.done():
+            self._closed.set_result(True)
+            signals.on_disconnect.send(self)
+
+    def _write_queued(self):
+        self._writer = None
+        queue = self._message_queue
+        while queue and self._transport is not None:
+            self._transport.write(queue.popleft())
+
+            if self._message_delay > 0:
+                self._writer = asyncio.get_event_loop().call_later(
+                    self._message_delay,
+                    self._write_queued
+                )
+                return
+
+    def _queue(self, data):
+        self._message_queue.append(data)
+        if self._writer is None:
+            self._write_queued()
+
+    def process_line(self, line):
+        """
+        Parses and dispatches a single message as if it had just been
+        received from the server.
+
+        :param line: A complete IRC message, without the trailing CRLF.
+        """
+        message = self._protocol.parse_line(line)
+        if message is not None:
+            self._dispatch(message)
+
+    def send(self, command, *args):
+        """
+        Sends an IRC message to the server. The last argument (if any)
+        will be prepended by ':' if required.
+
+        :param command: The command to send (ex: PING, NICK)
+        :param *args: Arguments for the given command.
+        :raises ValueError: If an argument would corrupt the message,
+                            see `utopia.parsing.pack_message`.
+        """
+        self._protocol.send(command, *args)
+        self._queue(self._protocol.data_to_send())
+
+    def send_many(self, messages):
+        """
+        Encodes several IRC messages and queues them as a single write,
+        so no other message can be sent in between.
+
+        :param messages: An iterable of (command, args) tuples.
+        """
+        self._protocol.send_many(messages)
+        data = self._protocol.data_to_send()
+        if data:
+            self._queue(data)
+
+    def sendraw(self, message, appendrn=True):
+        """
+        Sends a raw message to the server.
+
+        :param message: The message to send.
+        :param appendrn: If True (default) adds \r\n if missing.
+        """
+        self._protocol.send_raw(message, appendrn)
+        self._queue(self._protocol.data_to_send())
+
+    def terminate(self):
+        """
+        Close the connection immediately.
+        """
+        if self._transport is not None:
+            self._transport.close()
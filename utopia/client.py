@@ -1,17 +1,21 @@
 # -*- coding: utf-8 -*-
-from collections import defaultdict
 from functools import wraps
 import socket
+import time
 
 import gevent
-import gevent.ssl
 import gevent.pool
 import gevent.event
 import gevent.queue
 import gevent.socket
 
+import utopia.net
 import utopia.parsing
+import utopia.tls
 from utopia import signals
+from utopia.core import Connection, command_of, consumed, interests
+from utopia.metrics import ClientMetrics, stats_loop
+from utopia.timers import TimerWheel
 from utopia.plugins.handshake import HandshakePlugin
 from utopia.plugins.protocol import EasyProtocolPlugin
 
@@ -34,6 +38,8 @@ class Identity(object):
     Manages the "identity" of a client, including the nickname,
     username, realname, and server password.
     """
+    __slots__ = ('_nick', '_user', '_real', '_password')
+
     def __init__(self, nick, user=None, real=None, password=None):
         self._nick = nick
         self._user = user or nick
@@ -58,7 +64,18 @@ class Identity(object):
 
 
 class CoreClient(object):
-    def __init__(self, identity, host, port=6667, ssl=False, plugins=None):
+    # Message write delay in seconds.
+    # Set to 0 seconds since it is an undocumented feature for now.
+    # Some networks will send new limits upon registration.
+    _message_delay = 0
+
+    # Maximum number of bytes to read from the socket in one
+    # call to recv().
+    _chunk_size = 4096
+
+    def __init__(self, identity, host, port=6667, ssl=False, plugins=None,
+                 metrics=False, stats_interval=None, commands=None,
+                 timers=None):
         assert(isinstance(ssl, bool))
         assert(isinstance(port, (int, long)))
 
@@ -68,28 +85,49 @@ class CoreClient(object):
         self._socket = None
         self._identity = identity
 
+        # Time taken by the last TLS handshake, and the cache its
+        # session was stored in.
+        self._tls_handshake_time = None
+        self._ssl_sessions = None
+
         # Outgoing message queue. Used to throttle network
         # writes.
         self._message_queue = gevent.queue.Queue()
-        # Message write delay in seconds.
-        # Set to 0 seconds since it is an undocumented feature for now.
-        # Some networks will send new limits upon registration.
-        self._message_delay = 0
+        # The greenlet writing the queue. Only runs while there is
+        # something to write, as idle clients far outnumber busy ones.
+        self._writer = None
 
         # Used to cleanly shutdown the IO workers on termination.
-        self._io_workers = gevent.pool.Group()
-
-        # Maximum number of bytes to read from the socket in one
-        # call to recv().
-        self._chunk_size = 4096
-
-        # Default encoding, for this connection, everything will
-        # be sent as this encoding and decoded on arrival using this encoding.
-        self._encoding = 'utf-8'
+        # Created on connect.
+        self._io_workers = None
+
+        # The I/O-free protocol state machine handling framing, decoding
+        # and parsing. Everything will be sent as utf-8 and decoded on
+        # arrival using utf-8, falling back to latin-1.
+        self._protocol = Connection(encoding='utf-8')
+
+        # Optional instrumentation. When disabled this is None and the
+        # IO loops skip all bookkeeping.
+        self._metrics = ClientMetrics() if metrics else None
+        # If set, on_stats will be fired every `stats_interval` seconds
+        # while connected.
+        self._stats_interval = stats_interval
+
+        # The `utopia.timers.TimerWheel` plugins schedule their timers
+        # on. Created on first use unless a shared one is given. Only a
+        # wheel created here is closed by `terminate`.
+        self._timers = timers
+        self._owns_timers = False
 
         # Setup plugins.
         self._plugins = [p.bind(self) for p in plugins or []]
 
+        # If `commands` is given, lines are only parsed and dispatched if
+        # their command is in it or asked for by a plugin (see
+        # `utopia.core.interests`). The rest are dropped unparsed.
+        if commands is not None:
+            self._protocol.interests = interests(self._plugins, commands)
+
     @property
     def host(self):
         return self._host
@@ -110,54 +148,135 @@ class CoreClient(object):
     def identity(self):
         return self._identity
 
+    @property
+    def tls_handshake_time(self):
+        """
+        Seconds taken by the TLS handshake of the current connection, or
+        None if not using ssl.
+        """
+        return self._tls_handshake_time
+
+    @property
+    def protocol(self):
+        """
+        The :class:`utopia.core.Connection` used by this client.
+        """
+        return self._protocol
+
+    @property
+    def timers(self):
+        """
+        The :class:`utopia.timers.TimerWheel` for this client. Several
+        clients can share one by passing it as `timers`.
+        """
+        if self._timers is None:
+            self._timers = TimerWheel()
+            self._owns_timers = True
+        return self._timers
+
+    @property
+    def metrics(self):
+        """
+        The :class:`utopia.metrics.ClientMetrics` for this client, or None
+        if metrics are disabled.
+        """
+        return self._metrics
+
+    def metrics_snapshot(self):
+        """
+        Returns a snapshot dict of this client's metrics, or None if
+        metrics are disabled.
+        """
+        if self._metrics is None:
+            return None
+        return self._metrics.snapshot(self)
+
     @async_result
-    def connect(self, timeout=10, source=None, ssl_args=None):
+    def connect(self, timeout=10, source=None, ssl_args=None,
+                ssl_context=None, ssl_sessions=utopia.tls.sessions,
+                resolver=None):
         """
         Connect to the remote IRC server.
 
+        All addresses the host resolves to are raced, see
+        `utopia.net.create_connection`.
+
         :param timeout: How long to wait before giving up on the connect.
         :param source: The source address to bind to.
         :param ssl_args: A dict of arguments to pass to wrap_socket if using
-                         ssl.
+                         ssl. Ignored if `ssl_context` is given.
+        :param ssl_context: An `SSLContext` to use if using ssl. Share one
+                            between clients to avoid rebuilding TLS state.
+                            Defaults to `utopia.tls.default_context()`.
+        :param ssl_sessions: A `utopia.tls.SessionCache` used to resume TLS
+                             sessions on reconnect, or None to disable.
+        :param resolver: The `utopia.net.Resolver` to use. Defaults to one
+                         shared by all clients, which caches lookups.
         :rtype: gevent.event.AsyncResult
         """
-        self._socket = gevent.socket.create_connection(
+        self._socket = utopia.net.create_connection(
             (self.host, self.port),
             timeout=timeout,
-            source_address=source
+            source_address=source,
+            resolver=resolver
         )
 
         if self.ssl:
-            ssl_args = ssl_args or {}
-            self._socket = gevent.ssl.wrap_socket(self._socket, **ssl_args)
+            if ssl_context is None and ssl_args:
+                ssl_context = utopia.tls.context_from_args(ssl_args)
+
+            self._ssl_sessions = ssl_sessions
+            self._socket, handshake, resumed = utopia.tls.wrap_socket(
+                self._socket,
+                self.host,
+                self.port,
+                context=ssl_context,
+                cache=ssl_sessions
+            )
+            self._tls_handshake_time = handshake
+
+            if self._metrics is not None:
+                self._metrics.tls_handshake = handshake
+                self._metrics.tls_resumed = resumed
 
         # Wait until we can write before continuing.
         gevent.socket.wait_write(self.socket.fileno(), timeout=timeout)
         gevent.spawn(signals.on_connect.send, self)
 
-        # Start our read/write workers.
+        if self._io_workers is None:
+            self._io_workers = gevent.pool.Group()
+        # A writer from an earlier connection is gone, see terminate().
+        self._writer = None
+
+        # Start our read worker. The writer is started on demand, see
+        # _queue().
         read = self._io_workers.spawn(self._io_read)
         # the read greenlet exits (e.g. other end closes connection, timeout)
-        # but the write greenlet will still wait for information
+        # but the write greenlet may still be busy writing
         read.link(lambda g: self.terminate())
         # notify everyone, the client disconnected
         # the callable will already be called in its own greenlet, so no
         # need to call send via gevent.spawn
         read.link(lambda g: signals.on_disconnect.send(self))
-        self._io_workers.spawn(self._io_write)
+        if not self._message_queue.empty():
+            self._writer = self._io_workers.spawn(self._io_write)
+
+        if self._metrics is not None and self._stats_interval:
+            self._io_workers.spawn(stats_loop, self, self._stats_interval)
 
         return True
 
     def _io_read(self):
-        # TODO: The cost from using a string for our buffer is probably
-        #       pretty high. Evaluate alternatives like bytearray.
-        message_buffer = u''
+        metrics = self._metrics
+        protocol = self._protocol
+        # terminate() forgets the socket before this worker is killed.
+        sock = self._socket
         while True:
-            gevent.socket.wait_read(self.socket.fileno())
+            gevent.socket.wait_read(sock.fileno())
 
             message_chunk = ''
             try:
-                message_chunk = self.socket.recv(self._chunk_size)
+                message_chunk = sock.recv(self._chunk_size)
             except socket.error:
                 pass
 
@@ -166,56 +285,133 @@ class CoreClient(object):
                 # the remote end disconnected.
                 break
 
-            try:
-                message_chunk = message_chunk.decode(self._encoding)
-            except UnicodeDecodeError:
-                # Fallback if the above fails, IRC has no set encoding
-                # and a lot of old clients use latin-1 by default
-                message_chunk = message_chunk.decode(
-                    'iso-8859-1', errors='ignore'
-                )
+            if metrics is not None:
+                metrics.bytes_in += len(message_chunk)
+
+            for message in protocol.receive_data(message_chunk):
+                self._dispatch(message)
+
+    def process_line(self, line):
+        """
+        Parses and dispatches a single message as if it had just been
+        received from the server.
+
+        :param line: A complete IRC message, without the trailing CRLF.
+        """
+        message = self._protocol.parse_line(line)
+        if message is not None:
+            self._dispatch(message)
+
+    def _dispatch(self, message):
+        # These run on the read loop, a failing receiver mustn't end it.
+        signals.on_raw_line.send_isolated(self, line=message.line)
+        handled = consumed(
+            signals.on_message.send_isolated(self, message=message)
+        )
 
-            message_buffer += message_chunk
-            while '\r\n' in message_buffer:
-                line, message_buffer = message_buffer.split('\r\n', 1)
-                message = utopia.parsing.unpack_message(line)
+        metrics = self._metrics
+        if metrics is None:
+            if not handled:
                 gevent.spawn(
                     signals.on_raw_message.send,
                     self,
-                    prefix=message[0],
-                    command=message[1],
-                    args=message[2]
+                    prefix=message.prefix,
+                    command=message.command,
+                    args=message.args
                 )
+            return
+
+        metrics.lines_in += 1
+        metrics.commands_in[message.command] += 1
+        if handled:
+            return
+        metrics.pending_dispatch += 1
+        gevent.spawn(self._timed_dispatch, time.time(), message)
+
+    def _timed_dispatch(self, received, message):
+        metrics = self._metrics
+        metrics.pending_dispatch -= 1
+        metrics.dispatch_latency.observe(time.time() - received)
+        signals.on_raw_message.send(
+            self,
+            prefix=message.prefix,
+            command=message.command,
+            args=message.args
+        )
 
     def _io_write(self):
-        while True:
-            # Block until there's a message to write.
-            next_message = self._message_queue.get()
+        try:
+            self._write_queued()
+        except (OSError, socket.error):
+            # The connection is gone, the read worker notices as well
+            # and terminates the client.
+            pass
+        finally:
+            # Nothing left to write, the next send starts a new writer.
+            if self._writer is gevent.getcurrent():
+                self._writer = None
+
+    def _write_queued(self):
+        metrics = self._metrics
+        queue = self._message_queue
+        sock = self._socket
+        while sock is not None and not queue.empty():
+            next_message = queue.get()
             # gevent will yield on this sendall() if it can't write it
             # all to the socket at once.
             # TODO: Evaluate if we need to worry about trickle attacks.
             #       It's possible for malicious servers to accept writes
             #       very, very slowly. We should probably timeout here.
-            self.socket.sendall(next_message)
+            if metrics is None:
+                sock.sendall(next_message)
+            else:
+                start = time.time()
+                sock.sendall(next_message)
+                metrics.send_blocked += time.time() - start
+                metrics.bytes_out += len(next_message)
+                # A single write may hold several lines, see send_many().
+                for line in next_message.split(b'\r\n')[:-1]:
+                    metrics.lines_out += 1
+                    metrics.commands_out[command_of(line)] += 1
 
             if self._message_delay > 0:
                 gevent.sleep(self._message_delay)
 
+    def _queue(self, data):
+        """
+        Queues `data` for writing, starting the writer if it isn't
+        running and the client is connected.
+        """
+        self._message_queue.put(data)
+
+        if self._writer is None and self._io_workers is not None and \
+                self._socket is not None:
+            self._writer = self._io_workers.spawn(self._io_write)
+
     def send(self, command, *args):
         """
         Sends an IRC message to the server. The last argument (if any)
-        will be prepended by ':'.
+        will be prepended by ':' if required.
 
         :param command: The command to send (ex: PING, NICK)
         :param *args: Arguments for the given command.
+        :raises ValueError: If an argument would corrupt the message,
+                            see `utopia.parsing.pack_message`.
         """
-        message = [command]
-        if args:
-            message.extend(args[:-1])
-            message.append(u':' + args[-1])
-        message = u' '.join(message)
+        self._protocol.send(command, *args)
+        self._queue(self._protocol.data_to_send())
 
-        self.sendraw(message, True)
+    def send_many(self, messages):
+        """
+        Encodes several IRC messages and queues them as a single write,
+        so no other message can be sent in between.
+
+        :param messages: An iterable of (command, args) tuples.
+        """
+        self._protocol.send_many(messages)
+        data = self._protocol.data_to_send()
+        if data:
+            self._queue(data)
 
     def sendraw(self, message, appendrn=True):
         """
@@ -224,27 +420,47 @@ class CoreClient(object):
         :param message: The message to send.
         :param appendrn: If True (default) adds \r\n if missing.
         """
-
-        if not message.endswith('\r\n') and appendrn:
-            message = message + '\r\n'
-
-        if isinstance(message, unicode):
-            message = message.encode(self._encoding)
-
-        self._message_queue.put(message)
+        self._protocol.send_raw(message, appendrn)
+        self._queue(self._protocol.data_to_send())
 
     def terminate(self, block=True):
         """
-        Terminate IO workers immediately.
+        Terminate IO workers immediately. Messages sent afterwards are
+        queued until the next `connect`.
         """
-        try:
-            self.socket.shutdown(gevent.socket.SHUT_RDWR)
-            self.socket.close()
-        except (OSError, socket.error):
-            # Connection already down
-            pass
+        sock, self._socket = self._socket, None
+
+        if sock is not None:
+            if self._ssl_sessions is not None:
+                # Servers using TLS 1.3 send session tickets after the
+                # handshake, so this may be newer than the one from
+                # connect.
+                utopia.tls.remember_session(
+                    sock, self.host, self.port, self._ssl_sessions
+                )
+
+            try:
+                sock.shutdown(gevent.socket.SHUT_RDWR)
+                sock.close()
+            except (OSError, socket.error):
+                # Connection already down
+                pass
+
+        if self._io_workers is not None:
+            self._io_workers.kill(block=block)
+        self._writer = None
+
+        if self._owns_timers:
+            # A shared wheel is left to its owner.
+            self._timers.close()
 
-        self._io_workers.kill(block=block)
+
+def _given(*args):
+    """
+    Returns the arguments that were actually provided, dropping optional
+    parameters that are None or empty.
+    """
+    return [arg for arg in args if arg]
 
 
 class ProtocolClient(CoreClient):
@@ -252,7 +468,7 @@ class ProtocolClient(CoreClient):
         self.ctcp(target, ((u'ACTION', action),))
 
     def admin(self, server=None):
-        self.sendraw(u'ADMIN {0}'.format(server or u''))
+        self.send('ADMIN', *_given(server))
 
     def ctcp(self, target, messages):
         """
@@ -271,137 +487,139 @@ class ProtocolClient(CoreClient):
         self.notice(target, utopia.parsing.make_ctcp_string(messages))
 
     def globops(self, text):
-        self.sendraw(u'GLOBOPS :{0}'.format(text))
+        self.send('GLOBOPS', text)
 
     def info(self, server=None):
-        self.sendraw(u'INFO {0}'.format(server or u''))
+        self.send('INFO', *_given(server))
 
     def invite(self, nick, channel):
-        self.sendraw(u'INVITE {0} {1}'.format(nick, channel))
+        self.send('INVITE', nick, channel)
 
     def ison(self, nicks):
-        self.sendraw(u'ISON {0}'.format(u' '.join(nicks)))
+        self.send('ISON', *nicks)
 
     def join_channel(self, channel, key=None):
-        self.sendraw(u'JOIN {0} {1}'.format(channel, key or u''))
+        self.send('JOIN', *_given(channel, key))
 
     def kick(self, channel, nick, comment=None):
-        self.sendraw(u'KICK {0} {1} :{2}'.format(
-            channel, nick, comment or u'')
-        )
+        self.send('KICK', channel, nick, *_given(comment))
 
     def links(self, server_mask, remote_server=None):
-        cmd = u'LINKS'
-        if remote_server is not None:
-            cmd += u' ' + remote_server
-        cmd += u' ' + server_mask
-        self.sendraw(cmd)
+        self.send('LINKS', *_given(remote_server, server_mask))
 
     def list(self, channels=None, server=None):
-        cmd = u'LIST'
-        if channels is not None:
-            cmd = u'LIST {0}'.format(u','.join(channels))
-        cmd += u' ' + (server or u'')
-        self.sendraw(cmd)
+        self.send('LIST', *_given(u','.join(channels or ()), server))
 
     def lusers(self, server=None):
-        self.sendraw(u'LUSERS {0}'.format(server or u''))
+        self.send('LUSERS', *_given(server))
 
     def mode(self, channel, mode, user=None):
-        self.sendraw(u'MODE {0} {1} {2}'.format(channel, mode, user or u''))
+        self.send('MODE', *_given(channel, mode, user))
 
     def motd(self, server=None):
-        self.sendraw(u'MOTD {0}'.format(server or u''))
+        self.send('MOTD', *_given(server))
 
     def names(self, channel=None):
-        self.sendraw(u'NAMES {0}'.format(channel or u''))
+        self.send('NAMES', *_given(channel))
 
     def nick(self, newnick):
-        self.sendraw(u'NICK {0}'.format(newnick))
+        self.send('NICK', newnick)
 
     def notice(self, target, text):
-        for part in utopia.parsing.ssplit(text, 420):
-            self.sendraw(u'NOTICE {0} :{1}'.format(
-                target, u''.join(filter(None, part)))
-            )
+        self.send_many(
+            ('NOTICE', (target, part))
+            for part in utopia.parsing.ssplit(text, 420)
+        )
 
     def oper(self, nick, password):
-        self.sendraw(u'OPER {0} {1}'.format(nick, password))
+        self.send('OPER', nick, password)
 
     def part(self, channel, message=None):
-        self.sendraw(u'PART {0} {1}'.format(channel, message or u''))
+        self.send('PART', *_given(channel, message))
 
     def pass_(self, password):
-        self.sendraw(u'PASS {0}'.format(password))
+        self.send('PASS', password)
 
     def ping(self, target, target2=None):
-        self.sendraw(u'PING {0} {1}'.format(target, target2 or u''))
+        self.send('PING', *_given(target, target2))
 
     def pong(self, target, target2=None):
-        self.sendraw(u'PONG {0} {1}'.format(target, target2 or u''))
+        self.send('PONG', *_given(target, target2))
 
     def privmsg(self, target, text):
-        for part in utopia.parsing.ssplit(text, 420):
-            self.sendraw(u'PRIVMSG {0} :{1}'.format(
-                target, u''.join(filter(None, part)))
-            )
+        self.send_many(
+            ('PRIVMSG', (target, part))
+            for part in utopia.parsing.ssplit(text, 420)
+        )
 
     def privmsg_many(self, targets, text):
-        for part in utopia.parsing.ssplit(text, 420):
-            self.sendraw(u'PRIVMSG {0} :{1}'.format(
-                u','.join(targets), u''.join(filter(None, part))))
+        self.privmsg(u','.join(targets), text)
 
     def quit(self, message=None):
-        self.sendraw(u'QUIT :{0}'.format(message or u''))
+        self.send('QUIT', *_given(message))
 
     def squit(self, server, comment=None):
-        self.sendraw(u'SQUIT {0} :{1}'.format(server, comment or u''))
+        self.send('SQUIT', server, comment or u'')
 
     def stats(self, statstype, server=None):
-        self.sendraw(u'STATS {0} {1}'.format(statstype, server or u''))
+        self.send('STATS', *_given(statstype, server))
 
     def time(self, server=None):
-        self.sendraw(u'TIME {0}'.format(server or u''))
+        self.send('TIME', *_given(server))
 
     def topic(self, channel, new_topic=None):
         if new_topic is None:
-            self.sendraw(u'TOPIC {0}'.format(channel))
+            self.send('TOPIC', channel)
         else:
-            self.sendraw(u'TOPIC {0} :{1}'.format(channel, new_topic))
+            self.send('TOPIC', channel, new_topic)
 
     def trace(self, target=None):
-        self.sendraw('TRACE {0}'.format(target or u''))
+        self.send('TRACE', *_given(target))
 
     def user(self, username, realname):
-        self.sendraw(u'USER {0} 0 * :{1}'.format(username, realname))
+        self.send('USER', username, u'0', u'*', realname)
 
     def userhost(self, nick):
-        self.sendraw(u'USERHOST {0}'.format(nick))
+        self.send('USERHOST', nick)
 
     def users(self, server=None):
-        self.sendraw(u'USERS {0}'.format(server or u''))
+        self.send('USERS', *_given(server))
 
     def version(self, server=None):
-        self.sendraw(u'VERSION {0}'.format(server or u''))
+        self.send('VERSION', *_given(server))
 
     def wallops(self, text):
-        self.sendraw(u'WALLOPS :{0}'.format(text))
+        self.send('WALLOPS', text)
 
     def who(self, target, op=None):
-        self.sendraw(u'WHO {0} {1}'.format(target, op or u''))
+        self.send('WHO', *_given(target, op))
 
     def whois(self, target):
-        self.sendraw(u'WHOIS {0}'.format(target))
+        self.send('WHOIS', target)
 
     def whowas(self, nick, max=None, server=None):
-        self.sendraw(u'WHOWAS {0} {1} {2}'.format(
-            nick, max or u'', server or u'')
-        )
+        self.send('WHOWAS', *_given(nick, max and str(max), server))
 
 
 class EasyClient(ProtocolClient):
     def __init__(self, identity, host, port=6667, ssl=False, plugins=None,
-                 pubmsg=True):
+                 pubmsg=True, commands=None, **kwargs):
+        """
+        A `ProtocolClient` with the handshake and `EasyProtocolPlugin`
+        already set up.
+
+        :param commands: If given, only these commands (and those other
+                         plugins ask for) are parsed. Events such as
+                         PUBMSG can be given, see `EasyProtocolPlugin`.
+        """
         plugins = plugins or []
-        plugins.extend([HandshakePlugin, EasyProtocolPlugin(pubmsg=pubmsg)])
-        ProtocolClient.__init__(self, identity, host, port, ssl, plugins)
+        plugins.extend([
+            HandshakePlugin,
+            EasyProtocolPlugin(pubmsg=pubmsg, commands=commands)
+        ])
+        ProtocolClient.__init__(
+            self, identity, host, port, ssl, plugins,
+            # The plugin already asks for the commands events come from.
+            commands=None if commands is None else (),
+            **kwargs
+        )
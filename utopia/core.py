@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+An I/O-free IRC protocol state machine.
+
+:class:`Connection` takes bytes in and hands back parsed events, and
+queues outgoing messages as bytes for the caller to write. It never
+touches a socket, so the same core drives the gevent `CoreClient`, the
+asyncio `AsyncClient` and tests.
+"""
+import re
+from collections import OrderedDict, namedtuple
+
+import utopia.parsing
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+try:
+    _isascii = bytes.isascii
+except AttributeError:
+    # Python < 3.7
+    _non_ascii = re.compile(b'[\x80-\xff]').search
+
+    def _isascii(line):
+        return _non_ascii(line) is None
+
+# A UTF-8 lead byte followed by a continuation byte. Rare in 8-bit
+# encodings, so lines without one needn't be tried as UTF-8 when the
+# sender is known to use the fallback encoding.
+_utf8_sequence = re.compile(b'[\xc2-\xf4][\x80-\xbf]').search
+
+_CHANNEL_PREFIXES = b'#&!+'
+
+
+#: A complete message received from the server. `line` is the decoded
+#: line without its trailing CRLF, the rest is as returned by
+#: `utopia.parsing.unpack_message`.
+Message = namedtuple('Message', ['line', 'prefix', 'command', 'args',
+                                 'tags'])
+# IRCv3 message tags are only present if the server sent any.
+Message.__new__.__defaults__ = (None,)
+
+#: Returned by `Connection.receive_data` once the remote end has closed
+#: the connection.
+Closed = namedtuple('Closed', [])
+
+
+def command_of(line):
+    """
+    Returns the upper cased command of a raw line of bytes, skipping any
+    tags and prefix, without parsing the rest of it.
+    """
+    start = 0
+    if line[:1] == b'@':
+        start = line.find(b' ') + 1
+    if line[start:start + 1] == b':':
+        start = line.find(b' ', start) + 1
+
+    end = line.find(b' ', start)
+    return line[start:end if end != -1 else len(line)].upper()
+
+
+def sources_of(line):
+    """
+    Returns the lower cased nick and channel (or None for either) a raw
+    line of bytes came from, without parsing the rest of it.
+    """
+    start = 0
+    if line[:1] == b'@':
+        start = line.find(b' ') + 1
+
+    nick = None
+    if line[start:start + 1] == b':':
+        end = line.find(b' ', start)
+        nick = line[start + 1:end].split(b'!', 1)[0].lower()
+        start = end + 1
+
+    parts = line[start:].split(b' ', 2)
+    if len(parts) > 1:
+        first = parts[1][:1]
+        if first and first in _CHANNEL_PREFIXES:
+            return nick, parts[1].lower()
+    return nick, None
+
+
+def consumed(results):
+    """
+    Returns True if any receiver of a signal returned True, given the
+    results of `Signal.send`. See `on_message`.
+    """
+    return any(value is True for _, value in results)
+
+
+def interests(plugins, commands=()):
+    """
+    Returns the commands `plugins` and `commands` are interested in, as
+    a set of upper cased bytes suitable for `Connection.interests`, or
+    None if any plugin wants every command.
+
+    A plugin declares the commands it needs with a `commands` attribute.
+    Plugins without one, or where it is None, receive everything.
+    """
+    wanted = set(c.upper().encode('ascii') for c in commands)
+    for plugin in plugins:
+        declared = getattr(plugin, 'commands', None)
+        if declared is None:
+            return None
+        wanted.update(c.upper().encode('ascii') for c in declared)
+
+    return frozenset(wanted)
+
+
+class Connection(object):
+    __slots__ = ('encoding', 'fallback_encoding', 'interests', 'closed',
+                 'bytes_received', 'decode_fallbacks', 'lines_skipped',
+                 '_channel_encodings', '_hints', '_max_hints', '_buffer',
+                 '_outgoing')
+
+    def __init__(self, encoding='utf-8', fallback_encoding='iso-8859-1',
+                 interests=None, channel_encodings=None, hints=1024):
+        """
+        :param encoding: Everything will be sent as this encoding and
+                         decoded on arrival using this encoding.
+        :param fallback_encoding: Used for lines that can't be decoded
+                                  with `encoding`. IRC has no set encoding
+                                  and a lot of old clients use latin-1.
+        :param interests: If not None, a set of upper cased commands (as
+                          bytes). Received lines with any other command
+                          are dropped without being decoded or parsed.
+        :param channel_encodings: A dict of channel names to the encoding
+                                  used in them, see
+                                  `set_channel_encoding`.
+        :param hints: The number of nicks and channels to remember the
+                      fallback encoding was needed for. Their lines are
+                      decoded with it straight away.
+        """
+        self.encoding = encoding
+        self.fallback_encoding = fallback_encoding
+        self.interests = interests
+        self.closed = False
+
+        self.bytes_received = 0
+        self.decode_fallbacks = 0
+        self.lines_skipped = 0
+
+        # Lower cased channel names (as bytes) to encodings.
+        self._channel_encodings = {}
+        for channel, channel_encoding in (channel_encodings or {}).items():
+            self.set_channel_encoding(channel, channel_encoding)
+
+        # A bounded LRU of nicks and channels known to need the fallback
+        # encoding. Created the first time it is needed.
+        self._hints = None
+        self._max_hints = hints
+
+        # Incomplete trailing line from the last call to receive_data().
+        self._buffer = b''
+        self._outgoing = []
+
+    def receive_data(self, data):
+        """
+        Feeds bytes received from the server into the state machine.
+
+        :param data: The received bytes. Empty when the remote end has
+                     closed the connection.
+        :returns: A list of `Message` (and finally `Closed`) events.
+        """
+        if not data:
+            self.closed = True
+            return [Closed()]
+
+        self.bytes_received += len(data)
+
+        lines = (self._buffer + data).split(b'\r\n')
+        self._buffer = lines.pop()
+
+        events = []
+        interests = self.interests
+        for line in lines:
+            if interests is not None and command_of(line) not in interests:
+                self.lines_skipped += 1
+                continue
+
+            message = self.parse_line(self.decode(line))
+            if message is not None:
+                events.append(message)
+
+        return events
+
+    def set_channel_encoding(self, channel, encoding):
+        """
+        Decodes lines sent to `channel` as `encoding`, and encodes
+        messages sent to it with it, instead of guessing. Pass None to
+        go back to guessing.
+        """
+        if isinstance(channel, text_type):
+            channel = channel.encode(self.encoding)
+
+        if encoding is None:
+            self._channel_encodings.pop(channel.lower(), None)
+        else:
+            self._channel_encodings[channel.lower()] = encoding
+
+    def decode(self, line):
+        """
+        Decodes a single line of bytes.
+
+        ASCII lines are decoded as such. Otherwise the channel's
+        configured encoding is used if there is one, then `encoding`,
+        then `fallback_encoding`. Nicks and channels that needed the
+        fallback are remembered, so their next lines skip the failing
+        attempt unless they look like UTF-8.
+        """
+        if _isascii(line):
+            return line.decode('ascii')
+
+        nick, channel = sources_of(line)
+        if channel is not None and self._channel_encodings:
+            encoding = self._channel_encodings.get(channel)
+            if encoding is not None:
+                return line.decode(encoding, 'replace')
+
+        hints = self._hints
+        hinted = hints is not None and (
+            (nick is not None and nick in hints) or
+            (channel is not None and channel in hints)
+        )
+        if not hinted or _utf8_sequence(line):
+            try:
+                text = line.decode(self.encoding)
+            except UnicodeDecodeError:
+                pass
+            else:
+                if hinted:
+                    hints.pop(nick, None)
+                    hints.pop(channel, None)
+                return text
+
+        self.decode_fallbacks += 1
+        if hints is None:
+            hints = self._hints = OrderedDict()
+        for key in (nick, channel):
+            if key is not None:
+                hints.pop(key, None)
+                hints[key] = True
+        while len(hints) > self._max_hints:
+            hints.popitem(last=False)
+
+        return line.decode(self.fallback_encoding, 'ignore')
+
+    def _encoding_for(self, args):
+        if self._channel_encodings and args:
+            target = args[0]
+            if isinstance(target, text_type):
+                target = target.encode(self.encoding)
+            return self._channel_encodings.get(target.lower(), self.encoding)
+        return self.encoding
+
+    def parse_line(self, line):
+        """
+        Parses a single decoded line, returning a `Message` or None if the
+        line was empty (or only had tags).
+        """
+        if line[:1] == u'@':
+            message = utopia.parsing.unpack_tagged_message(line)
+            if message is None:
+                return None
+            return Message(line, *(message[1:] + message[:1]))
+
+        message = utopia.parsing.unpack_message(line)
+        if message is None:
+            return None
+
+        return Message(line, *message)
+
+    def send(self, command, *args):
+        """
+        Queues an IRC message. The last argument (if any) will be
+        prepended by ':' if required.
+
+        :param command: The command to send (ex: PING, NICK)
+        :param *args: Arguments for the given command.
+        :raises ValueError: If an argument would corrupt the message,
+                            see `utopia.parsing.pack_message`.
+        """
+        self._outgoing.append(utopia.parsing.pack_message(
+            command, args, encoding=self._encoding_for(args)
+        ))
+
+    def send_many(self, messages):
+        """
+        Queues several IRC messages. Nothing is queued if any of them is
+        invalid.
+
+        :param messages: An iterable of (command, args) tuples.
+        """
+        self._outgoing.extend([
+            utopia.parsing.pack_message(
+                command, args, encoding=self._encoding_for(args)
+            )
+            for command, args in messages
+        ])
+
+    def send_raw(self, message, appendrn=True):
+        """
+        Queues a raw message.
+
+        :param message: The message to send.
+        :param appendrn: If True (default) adds \r\n if missing.
+        """
+        if isinstance(message, text_type):
+            message = message.encode(self.encoding)
+
+        if not message.endswith(b'\r\n') and appendrn:
+            message = message + b'\r\n'
+
+        self._outgoing.append(message)
+
+    def data_to_send(self):
+        """
+        Returns (and forgets) all bytes queued since the last call.
+        """
+        data = b''.join(self._outgoing)
+        del self._outgoing[:]
+        return data
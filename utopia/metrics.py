@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Per-client counters, gauges and histograms.
+
+Metrics are disabled by default. When disabled a client holds no
+:class:`ClientMetrics` instance at all and every instrumentation point
+is a single ``is not None`` check.
+"""
+import bisect
+import time
+from collections import defaultdict
+
+import gevent
+
+from utopia import signals
+
+
+#: Default upper bounds (in seconds) for the receive-to-dispatch
+#: latency histogram. Anything above the last bound lands in the
+#: overflow bucket.
+DEFAULT_LATENCY_BOUNDS = (
+    0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0
+)
+
+
+class Histogram(object):
+    """
+    A fixed-bucket histogram. Observations cost a single bisect over the
+    bucket bounds.
+
+    :param bounds: A sorted iterable of inclusive bucket upper bounds.
+    """
+    def __init__(self, bounds=DEFAULT_LATENCY_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        return {
+            'bounds': self.bounds,
+            'counts': tuple(self.counts),
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max
+        }
+
+
+class ClientMetrics(object):
+    def __init__(self, latency_bounds=DEFAULT_LATENCY_BOUNDS):
+        """
+        Counters and gauges for a single client.
+
+        :param latency_bounds: Bucket bounds for the receive-to-dispatch
+                               latency histogram.
+        """
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lines_in = 0
+        self.lines_out = 0
+        self.commands_in = defaultdict(int)
+        self.commands_out = defaultdict(int)
+        # Messages read off the socket whose dispatch greenlet has not
+        # started yet.
+        self.pending_dispatch = 0
+        # Total seconds spent inside sendall().
+        self.send_blocked = 0.0
+        self.dispatch_latency = Histogram(latency_bounds)
+        # Seconds taken by the TLS handshake, and whether a session was
+        # resumed, for ssl connections.
+        self.tls_handshake = None
+        self.tls_resumed = None
+        self.created = time.time()
+
+    def snapshot(self, client=None):
+        """
+        Returns a plain dict copy of all current values. If `client` is
+        given, its outbound queue depth and number of lines decoded with
+        the fallback encoding are included as well.
+        """
+        snapshot = {
+            'uptime': time.time() - self.created,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'lines_in': self.lines_in,
+            'lines_out': self.lines_out,
+            'commands_in': dict(self.commands_in),
+            'commands_out': dict(self.commands_out),
+            'inbound_queue': self.pending_dispatch,
+            'send_blocked': self.send_blocked,
+            'dispatch_latency': self.dispatch_latency.snapshot(),
+            'tls_handshake': self.tls_handshake,
+            'tls_resumed': self.tls_resumed
+        }
+
+        if client is not None:
+            snapshot['outbound_queue'] = client._message_queue.qsize()
+            snapshot['decode_fallbacks'] = client.protocol.decode_fallbacks
+            snapshot['lines_skipped'] = client.protocol.lines_skipped
+
+        return snapshot
+
+
+def stats_loop(client, interval):
+    """
+    Periodically fires :data:`utopia.signals.on_stats` with a snapshot
+    of `client`'s metrics. Runs until killed.
+    """
+    while True:
+        gevent.sleep(interval)
+        signals.on_stats.send(client, stats=client.metrics_snapshot())
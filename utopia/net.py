@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Connection helpers: a shared, caching resolver and a "happy eyeballs"
+(RFC 8305) connect that races addresses instead of trying them one at a
+time.
+"""
+import socket
+import time
+
+import gevent
+import gevent.event
+import gevent.pool
+import gevent.socket
+
+
+class _Interrupted(Exception):
+    """
+    Raised to the waiters of a lookup that was killed.
+    """
+
+
+def getaddrinfo(host, port):
+    return gevent.socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+
+
+class Resolver(object):
+    def __init__(self, ttl=300, negative_ttl=10, maxsize=1024, lookup=None):
+        """
+        Resolves hostnames, caching results so that many clients
+        (re)connecting to the same server only resolve it once.
+        Concurrent lookups for the same host share one query.
+
+        :param ttl: Seconds to cache successful lookups for.
+        :param negative_ttl: Seconds to cache failed lookups for.
+        :param maxsize: Maximum number of cached hosts.
+        :param lookup: A callable taking (host, port) and returning a list
+                       of `getaddrinfo` tuples. Replace it to avoid real
+                       DNS, such as in tests.
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        self.lookup = lookup or getaddrinfo
+
+        # Maps (host, port) to (expires, result, exception).
+        self._cache = {}
+        # Lookups in progress, (host, port) -> AsyncResult.
+        self._inflight = {}
+
+    def resolve(self, host, port):
+        """
+        Returns a list of `getaddrinfo` tuples for `host` and `port`.
+        """
+        key = (host, port)
+
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > time.time():
+            if cached[2] is not None:
+                raise cached[2]
+            return cached[1]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            try:
+                return inflight.get()
+            except _Interrupted:
+                # The greenlet doing the lookup was killed, try again.
+                return self.resolve(host, port)
+
+        inflight = self._inflight[key] = gevent.event.AsyncResult()
+        try:
+            result = self.lookup(host, port)
+        except Exception as e:
+            if isinstance(e, socket.error):
+                self._store(key, self.negative_ttl, None, e)
+            inflight.set_exception(e)
+            raise
+        else:
+            self._store(key, self.ttl, result, None)
+            inflight.set(result)
+            return result
+        finally:
+            del self._inflight[key]
+            if not inflight.ready():
+                # Killed, don't leave the waiters blocked.
+                inflight.set_exception(_Interrupted())
+
+    def _store(self, key, ttl, result, exception):
+        if len(self._cache) >= self.maxsize:
+            now = time.time()
+            for k, v in list(self._cache.items()):
+                if v[0] <= now:
+                    del self._cache[k]
+            if len(self._cache) >= self.maxsize:
+                self._cache.clear()
+
+        self._cache[key] = (time.time() + ttl, result, exception)
+
+    def invalidate(self, host=None):
+        """
+        Forgets cached results for `host`, or for every host if None.
+        """
+        if host is None:
+            self._cache.clear()
+            return
+
+        for key in list(self._cache):
+            if key[0] == host:
+                del self._cache[key]
+
+
+#: The resolver shared by all clients by default.
+default_resolver = Resolver()
+
+
+def interleave(addresses):
+    """
+    Reorders `getaddrinfo` results so address families alternate,
+    starting with the family of the first result (RFC 8305, section 4).
+    """
+    if not addresses:
+        return []
+
+    first = addresses[0][0]
+    preferred = [a for a in addresses if a[0] == first]
+    others = [a for a in addresses if a[0] != first]
+
+    ordered = []
+    for i in range(max(len(preferred), len(others))):
+        ordered.extend(preferred[i:i + 1])
+        ordered.extend(others[i:i + 1])
+    return ordered
+
+
+def create_connection(address, timeout=None, source_address=None,
+                      resolver=None, delay=0.25):
+    """
+    Connects to `address`, racing its resolved addresses. Each attempt
+    gets a `delay` second head start before the next one is started, or
+    less if it fails first. The first socket to connect wins and the
+    remaining attempts are cancelled.
+
+    :param address: A (host, port) tuple.
+    :param timeout: Timeout applied to each attempt, kept on the
+                    returned socket.
+    :param source_address: The source address to bind to.
+    :param resolver: The `Resolver` to use, defaults to
+                     `default_resolver`.
+    :param delay: Seconds to wait before starting the next attempt.
+    :rtype: gevent.socket.socket
+    """
+    host, port = address
+    resolver = resolver or default_resolver
+
+    addresses = interleave(resolver.resolve(host, port))
+    if not addresses:
+        raise socket.error('getaddrinfo returned an empty list')
+
+    winner = gevent.event.AsyncResult()
+    attempts = gevent.pool.Group()
+    errors = []
+
+    def attempt(info, failed):
+        family, socktype, proto, _, sockaddr = info
+        sock = None
+        try:
+            sock = gevent.socket.socket(family, socktype, proto)
+            sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+        except gevent.GreenletExit:
+            if sock is not None:
+                sock.close()
+            raise
+        except Exception as e:
+            if sock is not None:
+                sock.close()
+            errors.append(e)
+            failed.set()
+            return
+
+        if winner.ready():
+            sock.close()
+        else:
+            winner.set(sock)
+
+    try:
+        for info in addresses:
+            failed = gevent.event.Event()
+            attempts.spawn(attempt, info, failed)
+            gevent.wait([winner, failed], timeout=delay, count=1)
+            if winner.ready():
+                break
+
+        def all_failed():
+            try:
+                attempts.join()
+            finally:
+                if not winner.ready():
+                    winner.set_exception(errors[-1] if errors else
+                                         socket.error('No attempt finished'))
+
+        watcher = gevent.spawn(all_failed)
+        try:
+            return winner.get()
+        except socket.error:
+            # Some of the cached addresses may be stale.
+            resolver.invalidate(host)
+            raise
+        finally:
+            watcher.kill(block=False)
+    finally:
+        attempts.kill(block=False)
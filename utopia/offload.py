@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Runs CPU heavy receivers off the hub.
+
+Receivers normally run in greenlets, so a receiver that spends a second
+resizing an image stalls every client in the process for that second.
+An offloaded receiver is run on a thread pool (or a process pool) while
+the greenlet that dispatched the signal waits, and its result is handed
+back on the hub.
+"""
+import importlib
+import sys
+from functools import wraps
+
+import gevent.lock
+import gevent.threadpool
+
+
+def _call_offloaded(module, name, args, kwargs):
+    """
+    Calls the function behind the offloaded receiver `name` in `module`.
+    Used in worker processes, as the decorated function can't be pickled
+    by reference once the receiver took its name.
+    """
+    receiver = getattr(importlib.import_module(module), name)
+    # A worker that imported the module itself may not have decorated it.
+    func = getattr(receiver, 'offloaded', receiver)
+    return func(*args, **kwargs)
+
+
+def _receiver_of(func):
+    """
+    Returns the (module, name) of the offloaded receiver that replaced
+    `func` in its module, or None.
+    """
+    module = sys.modules.get(getattr(func, '__module__', None))
+    receiver = getattr(module, getattr(func, '__name__', ''), None)
+    if receiver is not func and \
+            getattr(receiver, 'offloaded', None) is func:
+        return func.__module__, func.__name__
+    return None
+
+
+class Offloader(object):
+    def __init__(self, threads=4, processes=None, limit=None):
+        """
+        :param threads: The size of the thread pool.
+        :param processes: If given, receivers are run in a
+                          `concurrent.futures.ProcessPoolExecutor` of
+                          this size instead, so pure Python work isn't
+                          held back by the GIL. They must then be module
+                          level functions (decorated with `offload` or
+                          not), and their arguments and results must be
+                          picklable. Requires the `futures` backport on
+                          Python 2.
+        :param limit: Maximum number of receivers running at once. Further
+                      calls wait on the hub. Defaults to the pool size.
+        """
+        self._threads = gevent.threadpool.ThreadPool(threads)
+        self._processes = None
+        if processes is not None:
+            from concurrent.futures import ProcessPoolExecutor
+            self._processes = ProcessPoolExecutor(processes)
+
+        self._limit = gevent.lock.BoundedSemaphore(
+            limit or processes or threads
+        )
+
+    def run(self, func, *args, **kwargs):
+        """
+        Runs `func` in the pool, blocking the calling greenlet (but not
+        the hub) until it returns. Exceptions are raised here.
+        """
+        with self._limit:
+            if self._processes is None:
+                return self._threads.spawn(func, *args, **kwargs).get()
+
+            receiver = _receiver_of(func)
+            if receiver is None:
+                future = self._processes.submit(func, *args, **kwargs)
+            else:
+                future = self._processes.submit(
+                    _call_offloaded, receiver[0], receiver[1], args, kwargs
+                )
+
+            # Only the wait for the result uses a thread; gevent delivers
+            # it back to the hub safely.
+            return self._threads.spawn(future.result).get()
+
+    def offload(self, callback=None):
+        """
+        A decorator turning `func` into an offloaded receiver.
+
+        The pool can't safely touch the client, so `func` is only called
+        with the signal's keyword arguments (such as `prefix` and
+        `args`). If given, `callback(sender, result)` is called on the
+        hub with whatever `func` returned, where it can use the client.
+
+        Only connect offloaded receivers to signals that are sent from
+        their own greenlet, such as `on_raw_message` and the `signals.m`
+        events, not to `on_raw_line` or `on_message`.
+        """
+        def decorator(func):
+            @wraps(func)
+            def receiver(sender, **kwargs):
+                result = self.run(func, **kwargs)
+                if callback is not None:
+                    callback(sender, result)
+                return result
+            receiver.offloaded = func
+            return receiver
+        return decorator
+
+    def connect(self, signal, func, sender, callback=None):
+        """
+        Connects an offloaded `func` to `signal` for `sender`. See
+        `offload`. The receiver is held strongly and returned so it can
+        be disconnected.
+        """
+        receiver = self.offload(callback)(func)
+        signal.connect(receiver, sender=sender, weak=False)
+        return receiver
+
+    def close(self):
+        self._threads.kill()
+        if self._processes is not None:
+            self._processes.shutdown()
+
+
+_default_offloader = None
+
+
+def default_offloader():
+    """
+    Returns the process wide `Offloader`, creating it on first use.
+    """
+    global _default_offloader
+    if _default_offloader is None:
+        _default_offloader = Offloader()
+    return _default_offloader
+
+
+def offload(callback=None):
+    """
+    Shortcut for ``default_offloader().offload(callback)``.
+    """
+    return default_offloader().offload(callback)
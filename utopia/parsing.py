@@ -1,6 +1,13 @@
+import re
 import textwrap
 from collections import namedtuple
 
+try:
+    text_type = unicode
+    string_types = basestring
+except NameError:
+    text_type = string_types = str
+
 # TODO proper documentation
 
 
@@ -20,8 +27,15 @@ def unpack_message(line):
     prefix = None
     trailing = []
 
-    line = line.rstrip()
+    line = line.rstrip('\r\n')
+    if not line:
+        return None
 
+    if line[0] == '@':
+        # IRCv3 message tags, see unpack_tagged_message.
+        line = line.partition(' ')[2].lstrip(' ')
+        if not line:
+            return None
     if line[0] == ':':
         prefix, line = line[1:].split(' ', 1)
         prefix = unpack_prefix(prefix)
@@ -40,6 +54,173 @@ def unpack_message(line):
     return prefix, command.upper(), args
 
 
+def unpack_tagged_message(line):
+    """
+    Like `unpack_message`, but also returns the IRCv3 message tags (if
+    any) as a dict, returning (tags, prefix, command, parameters).
+
+    :param line: An RFC compliant IRC message, optionally with tags.
+    """
+    if not line:
+        return None
+
+    tags = None
+    if line[0] == '@':
+        tags, _, line = line[1:].partition(' ')
+        tags = unpack_tags(tags)
+
+    message = unpack_message(line)
+    if message is None:
+        return None
+
+    return (tags,) + message
+
+
+# IRCv3 tag value escaping.
+TAG_ESCAPES = (
+    ('\\', '\\\\'),
+    (';', '\\:'),
+    (' ', '\\s'),
+    ('\r', '\\r'),
+    ('\n', '\\n')
+)
+TAG_UNESCAPES = dict((v[1], k) for k, v in TAG_ESCAPES)
+
+
+def unpack_tags(tags):
+    """
+    Unpacks an IRCv3 tag string (without the leading '@') into a dict.
+    Tags without a value are mapped to None.
+    """
+    unpacked = {}
+    for tag in tags.split(';'):
+        if not tag:
+            continue
+
+        key, _, value = tag.partition('=')
+        if '\\' in value:
+            value = re.sub(
+                r'\\(.?)',
+                lambda m: TAG_UNESCAPES.get(m.group(1), m.group(1)),
+                value
+            )
+
+        unpacked[key] = value or None
+    return unpacked
+
+
+def pack_tags(tags):
+    """
+    Packs a dict (or iterable of key, value pairs) into an IRCv3 tag
+    string, including the leading '@'. The inverse of `unpack_tags`.
+    """
+    if isinstance(tags, dict):
+        tags = tags.items()
+
+    packed = []
+    for key, value in tags:
+        if value:
+            for c, escaped in TAG_ESCAPES:
+                value = value.replace(c, escaped)
+            packed.append(u'{0}={1}'.format(key, value))
+        else:
+            packed.append(key)
+    return u'@' + u';'.join(packed)
+
+
+def pack_prefix(prefix):
+    """
+    Packs a `Prefix` back into its nick!user@host form. The inverse of
+    `unpack_prefix`.
+    """
+    if isinstance(prefix, string_types):
+        return prefix
+
+    nick, user, host = prefix
+    if user is not None:
+        nick = u'{0}!{1}'.format(nick, user)
+    if host is not None:
+        nick = u'{0}@{1}'.format(nick, host)
+    return nick
+
+
+_INVALID_COMMAND = re.compile(u'[^A-Za-z0-9]')
+_INVALID_PARAMETERS = re.compile(u'[\r\n\0]')
+# Maps (command, encoding) to the encoded command and a trailing space.
+_COMMAND_CACHE = {}
+
+
+def _pack_command(command, encoding):
+    try:
+        return _COMMAND_CACHE[(command, encoding)]
+    except KeyError:
+        pass
+
+    if not command or _INVALID_COMMAND.search(command):
+        raise ValueError('Invalid command {0!r}.'.format(command))
+
+    if len(_COMMAND_CACHE) > 1024:
+        _COMMAND_CACHE.clear()
+
+    packed = _COMMAND_CACHE[(command, encoding)] = \
+        command.encode(encoding) + b' '
+    return packed
+
+
+def pack_message(command, params=(), tags=None, prefix=None,
+                 encoding='utf-8'):
+    """
+    Packs a message into encoded bytes ready to be written to a socket,
+    including the trailing CRLF. The inverse of `unpack_message`.
+
+    The last parameter is prefixed with ':' only when required.
+
+    :param command: The command to send (ex: PRIVMSG).
+    :param params: A sequence of parameters. Anything other than a
+                   string (such as an int) is converted to one.
+    :param tags: Optional IRCv3 message tags, see `pack_tags`.
+    :param prefix: Optional message prefix, a `Prefix` or string.
+    :param encoding: The encoding to use.
+    :raises ValueError: If the command is invalid, a parameter other than
+                        the last is empty, contains a space or starts
+                        with ':', or any parameter contains CR, LF or NUL.
+    """
+    message = _pack_command(command, encoding)
+
+    if params:
+        params = [
+            p if isinstance(p, string_types) else text_type(p)
+            for p in params
+        ]
+        for param in params[:-1]:
+            if not param or ' ' in param or param[0] == ':':
+                raise ValueError(
+                    'Invalid middle parameter {0!r}.'.format(param)
+                )
+
+        trailing = params[-1]
+        if not trailing or ' ' in trailing or trailing[0] == ':':
+            params[-1] = u':' + trailing
+
+        params = u' '.join(params)
+        if _INVALID_PARAMETERS.search(params):
+            raise ValueError('Parameters may not contain CR, LF or NUL.')
+
+        message = message + params.encode(encoding) + b'\r\n'
+    else:
+        message = message[:-1] + b'\r\n'
+
+    if prefix is not None:
+        message = b''.join((
+            b':', pack_prefix(prefix).encode(encoding), b' ', message
+        ))
+
+    if tags:
+        message = pack_tags(tags).encode(encoding) + b' ' + message
+
+    return message
+
+
 def _005_prefix(v):
     v = list(v.replace('(', '').replace(')', ''))
     hlv = int(len(v) / 2)
@@ -226,6 +407,34 @@ def is_channel(target, channel_prefixes='!&#+'):
     return len(target) > 1 and target[0] in channel_prefixes
 
 
+def _casemapping(upper, lower):
+    upper = u'ABCDEFGHIJKLMNOPQRSTUVWXYZ' + upper
+    lower = u'abcdefghijklmnopqrstuvwxyz' + lower
+    return dict(zip(map(ord, upper), map(ord, lower)))
+
+_CASEMAPPINGS = {
+    'ascii': _casemapping(u'', u''),
+    'rfc1459': _casemapping(u'[]\\~', u'{}|^'),
+    'strict-rfc1459': _casemapping(u'[]\\', u'{}|')
+}
+
+
+def irc_lower(s, casemapping='rfc1459'):
+    """
+    Lower cases `s` according to an ISUPPORT CASEMAPPING. Only ASCII
+    letters are folded, and under rfc1459 '[', ']', '\\' and '~' are the
+    upper case forms of '{', '}', '|' and '^'. Unknown casemappings
+    (such as rfc7613) fall back to unicode lower casing.
+    """
+    table = _CASEMAPPINGS.get(casemapping)
+    if table is None:
+        return s.lower()
+
+    if not isinstance(s, text_type):
+        s = s.decode('utf-8')
+    return s.translate(table)
+
+
 def unpack_prefix(prefix):
     """
     Unpacks an IRC message prefix.
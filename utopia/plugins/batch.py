@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Groups related lines into single events.
+
+With the IRCv3 `batch` capability the server marks lines that belong
+together, such as the QUITs of a netsplit. Without it, netsplits are
+recognised by their QUIT messages ("server1 server2") and the QUITs, as
+well as the JOINs once the servers relink, are coalesced client side.
+Either way, a netsplit costs one event rather than one per user.
+"""
+import re
+import time
+from collections import OrderedDict
+
+from utopia import signals
+
+# The QUIT message servers use for users lost in a netsplit.
+_SPLIT = re.compile(r'^([\w.-]+\.[\w.-]+) ([\w.-]+\.[\w.-]+)$', re.UNICODE)
+
+
+class Batch(object):
+    __slots__ = ('ref', 'type', 'params', 'messages')
+
+    def __init__(self, ref, type, params):
+        self.ref = ref
+        self.type = type
+        self.params = params
+        #: The `utopia.core.Message`s in the batch, in order.
+        self.messages = []
+
+
+class BatchPlugin(object):
+    commands = ('001', 'CAP', 'BATCH', 'QUIT', 'JOIN')
+
+    def __init__(self, coalesce=('netsplit', 'netjoin'), netsplits=True,
+                 window=2.0, rejoin=3600):
+        """
+        A plugin requesting the `batch` capability and firing `on_batch`
+        for every batch received. Batches of the types in `coalesce` are
+        only dispatched as a whole; netsplit and netjoin batches also fire
+        `on_netsplit` and `on_netjoin`. Lines in other batches are
+        dispatched as usual as well.
+
+        :param coalesce: Batch types whose lines aren't dispatched one by
+                         one.
+        :param netsplits: If True, netsplits are also detected from QUIT
+                          messages, for servers that don't batch them.
+                          Needs a client with `timers`.
+        :param window: Seconds without further QUITs (or JOINs) before a
+                       detected netsplit (or netjoin) is considered
+                       complete.
+        :param rejoin: Seconds a user lost in a netsplit is remembered,
+                       for recognising the netjoin.
+        """
+        self.coalesce = frozenset(coalesce)
+        self.netsplits = netsplits
+        self.window = window
+        self.rejoin = rejoin
+
+        #: True once the server acknowledged the `batch` capability.
+        self.enabled = False
+        # True from connecting until CAP END was sent.
+        self._registering = False
+
+        # Open batches by reference.
+        self._batches = {}
+
+        # Detected splits and joins not fired yet, by the servers
+        # involved, and when the last line for them arrived.
+        self._quits = OrderedDict()
+        self._joins = OrderedDict()
+        self._last = None
+        self._timer = None
+        # Lower cased nicks lost in a split, to the servers and when.
+        self._split = OrderedDict()
+
+    def bind(self, client):
+        signals.on_connect.connect(self.have_connected, sender=client)
+        signals.on_disconnect.connect(self.have_disconnected, sender=client)
+        signals.on_message.connect(self.have_message, sender=client)
+
+        return self
+
+    def have_connected(self, client):
+        self.enabled = False
+        self._registering = True
+        self._batches.clear()
+        # Servers hold registration until CAP END once CAP is used.
+        client.send('CAP', 'REQ', 'batch')
+
+    def have_disconnected(self, client):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._flush(client)
+        self._split.clear()
+
+    def have_message(self, client, message):
+        outer = None
+        if message.tags and 'batch' in message.tags:
+            outer = self._batches.get(message.tags['batch'])
+            if outer is not None:
+                outer.messages.append(message)
+
+        if message.command == 'BATCH':
+            # Batches may be nested, opening one takes a batch tag too.
+            coalesced = self._on_BATCH(client, message)
+            return coalesced or (
+                outer is not None and outer.type in self.coalesce
+            )
+        elif outer is not None:
+            return outer.type in self.coalesce or None
+
+        handler = getattr(self, '_on_' + message.command, None)
+        if handler is not None:
+            return handler(client, message)
+
+    def _on_CAP(self, client, message):
+        args = message.args
+        if len(args) < 3 or args[1] not in ('ACK', 'NAK'):
+            return
+
+        if args[1] == 'ACK' and 'batch' in args[2].split():
+            self.enabled = True
+        if self._registering:
+            self._registering = False
+            client.send('CAP', 'END')
+
+    def _on_001(self, client, message):
+        self._registering = False
+
+    def _on_BATCH(self, client, message):
+        if not message.args:
+            return
+
+        ref = message.args[0]
+        if ref[:1] == '+' and len(message.args) > 1:
+            batch = Batch(ref[1:], message.args[1], message.args[2:])
+            self._batches[batch.ref] = batch
+        elif ref[:1] == '-':
+            batch = self._batches.pop(ref[1:], None)
+            if batch is None:
+                return
+            self._fire(client, batch)
+        else:
+            return
+
+        return batch.type in self.coalesce
+
+    def _fire(self, client, batch):
+        signals.on_batch.send(client, batch=batch)
+
+        servers = tuple(batch.params[:2])
+        if batch.type == 'netsplit':
+            signals.on_netsplit.send(
+                client,
+                servers=servers,
+                prefixes=[m.prefix for m in batch.messages
+                          if m.command == 'QUIT']
+            )
+        elif batch.type == 'netjoin':
+            signals.on_netjoin.send(
+                client,
+                servers=servers,
+                joins=[(m.prefix, m.args[0]) for m in batch.messages
+                       if m.command == 'JOIN']
+            )
+
+    def _on_QUIT(self, client, message):
+        if not self.netsplits or message.prefix is None or \
+                not message.args:
+            return
+
+        match = _SPLIT.match(message.args[-1])
+        if match is None:
+            return
+
+        servers = match.groups()
+        self._quits.setdefault(servers, []).append(message.prefix)
+        nick = message.prefix.nick.lower()
+        # Keep the oldest first, see `_flush`.
+        self._split.pop(nick, None)
+        self._split[nick] = (servers, time.time())
+        return self._pending(client)
+
+    def _on_JOIN(self, client, message):
+        if not self._split or message.prefix is None:
+            return
+
+        lost = self._split.get(message.prefix.nick.lower())
+        if lost is None or lost[1] < time.time() - self.rejoin:
+            return
+
+        self._joins.setdefault(lost[0], []).append(
+            (message.prefix, message.args[0])
+        )
+        return self._pending(client)
+
+    def _pending(self, client):
+        """
+        Notes that a line was coalesced, returning True if it will be
+        part of an event.
+        """
+        timers = getattr(client, 'timers', None)
+        if timers is None:
+            # No way to tell when the burst is over.
+            self._quits.clear()
+            self._joins.clear()
+            return
+
+        self._last = time.time()
+        if self._timer is None:
+            self._timer = timers.call_later(self.window, self._expire, client)
+        return True
+
+    def _expire(self, client):
+        self._timer = None
+        remaining = self._last + self.window - time.time()
+        if remaining > 0:
+            # Lines kept coming, wait for the burst to end.
+            self._timer = client.timers.call_later(
+                remaining,
+                self._expire,
+                client
+            )
+            return
+
+        self._flush(client)
+
+    def _flush(self, client):
+        quits, self._quits = self._quits, OrderedDict()
+        joins, self._joins = self._joins, OrderedDict()
+
+        for servers, prefixes in quits.items():
+            signals.on_netsplit.send(
+                client,
+                servers=servers,
+                prefixes=prefixes
+            )
+
+        for servers, joined in joins.items():
+            for prefix, _ in joined:
+                self._split.pop(prefix.nick.lower(), None)
+            signals.on_netjoin.send(client, servers=servers, joins=joined)
+
+        # Forget users that never came back.
+        expired = time.time() - self.rejoin
+        while self._split:
+            nick = next(iter(self._split))
+            if self._split[nick][1] >= expired:
+                break
+            del self._split[nick]
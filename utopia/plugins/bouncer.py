@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Shares one upstream connection between many consumers.
+
+Every line received from the server is parsed once and the resulting
+`utopia.core.Message` is handed to each subscriber, either in-process
+(`BouncerPlugin.subscribe`) or over a local TCP socket speaking IRC.
+Everything the consumers send goes through the client's own, flood
+controlled, outgoing queue.
+"""
+from collections import deque
+
+import gevent
+import gevent.queue
+import gevent.server
+import gevent.socket
+
+import utopia.parsing
+from utopia import signals
+from utopia.core import Closed, Connection
+
+# Registration replies replayed to TCP consumers when they attach.
+_WELCOME = ('001', '002', '003', '004', '005')
+# Registration commands from TCP consumers, which aren't passed on so
+# no consumer can change the shared connection's state (such as its
+# nick).
+_REGISTRATION = ('CAP', 'NICK', 'PASS', 'USER')
+
+
+class Subscription(object):
+    def __init__(self, bouncer, maxsize=None):
+        """
+        An in-process consumer of a `BouncerPlugin`. Use `get()` or
+        iterate over it to receive messages.
+
+        A subscription that falls more than `maxsize` messages behind is
+        closed with `overflowed` set, so a stalled consumer can never hold
+        up the others.
+        """
+        self.bouncer = bouncer
+        self.overflowed = False
+        self.closed = False
+        self._queue = gevent.queue.Queue(maxsize)
+
+    def _put(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except gevent.queue.Full:
+            self.overflowed = True
+            self.close()
+
+    def get(self, block=True, timeout=None):
+        """
+        Returns the next `utopia.core.Message`, or None once the
+        subscription has been closed.
+
+        :raises gevent.queue.Empty: If `block` is False or `timeout` was
+                                    given and no message arrived.
+        """
+        return self._queue.get(block=block, timeout=timeout)
+
+    def __iter__(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            yield message
+
+    def send(self, command, *args):
+        """
+        Sends an IRC message upstream. See `CoreClient.send`.
+        """
+        self.bouncer.send(self, utopia.parsing.pack_message(
+            command, args, encoding=self.bouncer.client.protocol.encoding
+        ))
+
+    def sendraw(self, message):
+        """
+        Sends a raw IRC message upstream. See `CoreClient.sendraw`.
+        """
+        self.bouncer.send(self, message)
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        self.bouncer._subscriptions.discard(self)
+        # Drop whatever is still queued and wake up the consumer.
+        self._queue.queue.clear()
+        self._queue.maxsize = None
+        self._queue.put(None)
+
+
+class BouncerPlugin(object):
+    def __init__(self, history=200, maxsize=1000, listen=None,
+                 password=None, ignore=('PING', 'PONG')):
+        """
+        A plugin that lets many consumers share the client's connection,
+        so N services reading the same channels need one connection
+        instead of N.
+
+        :param history: Number of recent messages replayed to new
+                        subscribers.
+        :param maxsize: Maximum number of messages queued for a single
+                        subscriber before it is dropped, or None for no
+                        limit.
+        :param listen: An optional (host, port) to accept IRC clients on.
+                       They skip registration with the server and are
+                       attached to the existing connection.
+        :param password: If set, TCP consumers must send it with PASS.
+        :param ignore: Commands that are not passed on. PINGs are already
+                       answered upstream.
+        """
+        self.history = deque(maxlen=history)
+        self.maxsize = maxsize
+        self.listen = listen
+        self.password = password
+        self.ignore = frozenset(ignore)
+
+        self.client = None
+        #: Channels the upstream connection is currently in.
+        self.channels = set()
+
+        self._subscriptions = set()
+        self._welcome = []
+        self._server = None
+
+    def bind(self, client):
+        assert self.client is None, 'a bouncer serves a single client'
+        self.client = client
+
+        signals.on_message.connect(self.on_message, sender=client)
+
+        if self.listen is not None:
+            self._server = gevent.server.StreamServer(
+                self.listen, self._handle
+            )
+            self._server.start()
+
+        return self
+
+    @property
+    def address(self):
+        """
+        The address TCP consumers can connect to, or None.
+        """
+        if self._server is None:
+            return None
+        return self._server.address
+
+    @property
+    def subscribers(self):
+        return len(self._subscriptions)
+
+    def subscribe(self, replay=True):
+        """
+        Returns a new `Subscription`, queued with recent history if
+        `replay` is True.
+        """
+        subscription = Subscription(self, self.maxsize)
+        if replay:
+            for message in self.history:
+                subscription._put(message)
+
+        if not subscription.closed:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def on_message(self, client, message):
+        command = message.command
+        if command in self.ignore:
+            return
+
+        if command == '001':
+            # A new registration, the old burst and channels are gone.
+            del self._welcome[:]
+            self.channels.clear()
+
+        if command in _WELCOME:
+            self._welcome.append(message)
+        elif command in ('JOIN', 'PART', 'KICK'):
+            self._track(message)
+
+        self._publish(message)
+
+    def _track(self, message):
+        nick = self.client.identity.nick
+        command, args = message.command, message.args
+
+        if command == 'KICK':
+            if len(args) > 1 and args[1] == nick:
+                self.channels.discard(args[0])
+        elif message.prefix is not None and message.prefix[0] == nick:
+            if command == 'JOIN':
+                self.channels.add(args[0])
+            else:
+                self.channels.discard(args[0])
+
+    def _publish(self, message, origin=None):
+        self.history.append(message)
+        for subscription in list(self._subscriptions):
+            if subscription is not origin:
+                subscription._put(message)
+
+    def send(self, origin, message):
+        """
+        Queues a raw message from the consumer `origin` on the upstream
+        connection. Messages and notices are echoed to the other
+        consumers, since the server won't send them back.
+        """
+        protocol = self.client.protocol
+        if not isinstance(message, bytes):
+            message = message.encode(protocol.encoding)
+        message = message.rstrip(b'\r\n')
+
+        self.client.sendraw(message)
+
+        command = message.split(b' ', 1)[0].upper()
+        if command in (b'PRIVMSG', b'NOTICE'):
+            echo = protocol.parse_line(u':{0} {1}'.format(
+                self.client.identity.nick,
+                protocol.decode(message)
+            ))
+            if echo is not None:
+                self._publish(echo, origin)
+
+    def close(self):
+        """
+        Stops accepting TCP consumers and closes every subscription.
+        """
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
+
+        for subscription in list(self._subscriptions):
+            subscription.close()
+
+    def _handle(self, sock, address):
+        """
+        Serves a single TCP consumer.
+        """
+        downstream = Connection(encoding=self.client.protocol.encoding)
+        password = None
+        subscription = None
+        writer = None
+
+        try:
+            while True:
+                events = downstream.receive_data(sock.recv(4096))
+                for message in events:
+                    if isinstance(message, Closed):
+                        return
+
+                    command = message.command
+                    if command == 'QUIT':
+                        return
+                    elif command == 'PING':
+                        sock.sendall(utopia.parsing.pack_message(
+                            'PONG', message.args[:1],
+                            encoding=downstream.encoding
+                        ))
+                    elif subscription is None:
+                        if command == 'PASS' and message.args:
+                            password = message.args[0]
+                        elif command == 'USER':
+                            if self.password not in (None, password):
+                                sock.sendall(
+                                    b'ERROR :Bad password\r\n'
+                                )
+                                return
+                            subscription = self._attach(sock, downstream)
+                            writer = gevent.spawn(
+                                self._write, sock, downstream, subscription
+                            )
+                    elif command not in _REGISTRATION:
+                        self.send(subscription, message.line)
+        except gevent.socket.error:
+            pass
+        finally:
+            if subscription is not None:
+                subscription.close()
+            if writer is not None:
+                writer.kill()
+            sock.close()
+
+    def _attach(self, sock, downstream):
+        """
+        Brings a newly registered TCP consumer up to date and subscribes
+        it.
+        """
+        nick = self.client.identity.nick
+        lines = [m.line for m in self._welcome]
+        if not lines:
+            lines.append(u':{0} 001 {1} :Welcome'.format(
+                self.client.host, nick
+            ))
+
+        for channel in sorted(self.channels):
+            lines.append(u':{0} JOIN {1}'.format(nick, channel))
+
+        sock.sendall(b''.join(
+            line.encode(downstream.encoding) + b'\r\n' for line in lines
+        ))
+        return self.subscribe()
+
+    def _write(self, sock, downstream, subscription):
+        encoding = downstream.encoding
+        while True:
+            message = subscription.get()
+            if message is None:
+                break
+
+            # Coalesce whatever else is already queued into one write.
+            batch = [message.line]
+            while len(batch) < 64:
+                try:
+                    message = subscription.get(block=False)
+                except gevent.queue.Empty:
+                    break
+                if message is None:
+                    break
+                batch.append(message.line)
+
+            try:
+                sock.sendall(b''.join(
+                    line.encode(encoding) + b'\r\n' for line in batch
+                ))
+            except gevent.socket.error:
+                # The consumer is gone, stop queueing for it.
+                subscription.close()
+                break
+
+            if message is None:
+                break
+
+        sock.close()
@@ -0,0 +1,513 @@
+# -*- coding: utf-8 -*-
+"""
+DCC SEND file transfers, including resume (DCC RESUME/ACCEPT) and
+passive (reverse) DCC.
+
+Outgoing files are written with sendfile() where the platform supports
+it and incoming files are received straight into a pre-sized, memory
+mapped file. Every transfer runs in its own greenlet.
+
+Requires a plugin that fires CTCP events, such as `EasyProtocolPlugin`.
+"""
+import errno
+import itertools
+import mmap
+import os
+import socket
+import struct
+import time
+from collections import namedtuple
+
+import gevent
+import gevent.event
+import gevent.pool
+import gevent.socket
+
+from utopia import signals
+from utopia.ratelimit import TokenBucket
+
+# Receivers acknowledge data by sending the total number of bytes
+# received so far as a 32-bit, network order integer.
+_ACK = struct.Struct('!I')
+
+
+class DCCError(Exception):
+    pass
+
+
+#: An incoming DCC SEND offer. A `port` of 0 means the sender asked for a
+#: passive (reverse) transfer.
+Offer = namedtuple('Offer', ['nick', 'filename', 'host', 'port', 'size',
+                             'token'])
+
+
+def pack_address(host):
+    """
+    Packs an IP address the way DCC expects it; IPv4 addresses are sent
+    as a single integer.
+    """
+    try:
+        return str(struct.unpack('!I', socket.inet_aton(host))[0])
+    except socket.error:
+        return host
+
+
+def unpack_address(value):
+    """
+    The inverse of `pack_address`.
+
+    :raises ValueError: If an integer address is out of range.
+    """
+    if value.isdigit():
+        address = int(value)
+        if address > 0xFFFFFFFF:
+            raise ValueError('Invalid address {0!r}.'.format(value))
+        return socket.inet_ntoa(struct.pack('!I', address))
+    return value
+
+
+def unpack_dcc(data):
+    """
+    Splits the arguments of a DCC CTCP, honouring a quoted filename.
+    """
+    kind, _, rest = data.strip().partition(' ')
+    rest = rest.strip()
+    if rest.startswith('"') and '"' in rest[1:]:
+        filename, _, rest = rest[1:].partition('"')
+        return [kind.upper(), filename] + rest.split()
+    return [kind.upper()] + rest.split()
+
+
+def _quote(filename):
+    if ' ' in filename:
+        return '"{0}"'.format(filename)
+    return filename
+
+
+def _sendfile(sock, fileobj, offset, count):
+    """
+    Sends up to `count` bytes of `fileobj` starting at `offset`, without
+    copying them through Python if os.sendfile is available. Returns the
+    number of bytes sent.
+    """
+    if hasattr(os, 'sendfile'):
+        try:
+            return os.sendfile(sock.fileno(), fileobj.fileno(), offset, count)
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            gevent.socket.wait_write(sock.fileno())
+            return 0
+
+    fileobj.seek(offset)
+    data = fileobj.read(count)
+    sock.sendall(data)
+    return len(data)
+
+
+class Transfer(object):
+    def __init__(self, client, nick, filename, path, size, outgoing,
+                 token=None):
+        """
+        A single DCC file transfer, in either direction.
+        """
+        self.client = client
+        self.nick = nick
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.outgoing = outgoing
+        self.token = token
+
+        #: The offset the transfer started (or resumed) at.
+        self.position = 0
+        #: Bytes moved since `position`.
+        self.transferred = 0
+        self.started = None
+        self.finished = None
+        self.greenlet = None
+
+        # Set once the peer has answered a passive offer or resume
+        # request.
+        self._ready = gevent.event.Event()
+        self._peer = None
+
+    @property
+    def completed(self):
+        return self.position + self.transferred
+
+    @property
+    def rate(self):
+        """
+        Average bytes per second since the transfer started.
+        """
+        if self.started is None:
+            return 0.0
+        elapsed = (self.finished or time.time()) - self.started
+        return self.transferred / elapsed if elapsed > 0 else 0.0
+
+
+class DCCPlugin(object):
+    # DCC requests arrive as CTCPs.
+    commands = ('PRIVMSG',)
+
+    def __init__(self, host=None, rate=None, transfer_rate=None,
+                 chunk_size=65536, timeout=120):
+        """
+        A plugin handling DCC SEND in both directions. Incoming offers
+        fire `on_dcc_offer` and are only received once passed to
+        `accept()`.
+
+        :param host: The address advertised to peers. Defaults to the
+                     local address of the IRC connection.
+        :param rate: Global bandwidth cap, in bytes per second, shared by
+                     all transfers of this plugin.
+        :param transfer_rate: Bandwidth cap for each transfer, in bytes
+                              per second.
+        :param chunk_size: Maximum bytes moved per send or receive.
+        :param timeout: Seconds to wait for peers to connect, answer or
+                        send more data.
+        """
+        self.host = host
+        self.rate = TokenBucket(rate) if rate else None
+        self.transfer_rate = transfer_rate
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+        self.transfers = gevent.pool.Group()
+        # Transfers waiting on the peer, keyed by (nick, port or token).
+        self._pending = {}
+        self._tokens = itertools.count(1)
+
+    def bind(self, client):
+        signals.m.on_CTCP_DCC.connect(self.on_dcc, sender=client)
+        return self
+
+    def on_dcc(self, client, prefix, target, tag, args):
+        params = unpack_dcc(args or '')
+        if len(params) < 4:
+            return
+
+        kind, filename = params[0], params[1]
+        try:
+            if kind == 'SEND' and len(params) >= 5:
+                self._have_send(client, prefix.nick, filename, params[2:])
+            elif kind == 'RESUME':
+                self._have_resume(client, prefix.nick, filename, params[2:])
+            elif kind == 'ACCEPT':
+                self._have_accept(prefix.nick, params[2:])
+        except ValueError:
+            # Malformed numbers, ignore the request.
+            pass
+
+    def _have_send(self, client, nick, filename, params):
+        host = unpack_address(params[0])
+        port, size = int(params[1]), int(params[2])
+        token = params[3] if len(params) > 3 else None
+
+        if token is not None and port:
+            # The answer to one of our passive offers.
+            transfer = self._pending.pop((nick, token), None)
+            if transfer is not None:
+                transfer._peer = (host, port)
+                transfer._ready.set()
+                return
+
+        signals.on_dcc_offer.send(
+            client,
+            offer=Offer(nick, filename, host, port, size, token)
+        )
+
+    def _have_resume(self, client, nick, filename, params):
+        port, position = int(params[0]), int(params[1])
+        token = params[2] if len(params) > 2 else None
+
+        transfer = self._pending.get((nick, port or token))
+        if transfer is None or not transfer.outgoing:
+            return
+        if not 0 <= position < transfer.size:
+            return
+
+        transfer.position = position
+        self._ctcp(client, nick, 'ACCEPT', filename, port, position, token)
+
+    def _have_accept(self, nick, params):
+        port, position = int(params[0]), int(params[1])
+        token = params[2] if len(params) > 2 else None
+
+        transfer = self._pending.pop((nick, port or token), None)
+        if transfer is None or transfer.outgoing:
+            return
+
+        transfer.position = position
+        transfer._ready.set()
+
+    def _ctcp(self, client, nick, kind, filename, *params):
+        params = [str(p) for p in params if p is not None]
+        client.ctcp(nick, [(
+            'DCC', ' '.join([kind, _quote(filename)] + params)
+        )])
+
+    def _address(self, client):
+        return self.host or client.socket.getsockname()[0]
+
+    def _listen(self):
+        listener = gevent.socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('', 0))
+        listener.listen(1)
+        return listener
+
+    def _spawn(self, transfer, func, *args):
+        transfer.greenlet = self.transfers.spawn(
+            self._run, transfer, func, *args
+        )
+        return transfer
+
+    def _run(self, transfer, func, *args):
+        try:
+            func(transfer, *args)
+        except (Exception, gevent.Timeout) as e:
+            for key, pending in list(self._pending.items()):
+                if pending is transfer:
+                    del self._pending[key]
+            signals.on_dcc_failed.send(
+                transfer.client,
+                transfer=transfer,
+                error=e
+            )
+        else:
+            signals.on_dcc_complete.send(transfer.client, transfer=transfer)
+
+    def _throttle(self, bucket, amount):
+        if bucket is not None:
+            bucket.wait(amount)
+        if self.rate is not None:
+            self.rate.wait(amount)
+
+    # Outgoing transfers.
+
+    def send_file(self, client, nick, path, filename=None, passive=False):
+        """
+        Offers a file to `nick` and sends it once they connect.
+
+        :param client: The client to send the offer through.
+        :param nick: The nick to send the file to.
+        :param path: The local file to send.
+        :param filename: The name to offer the file as. Defaults to the
+                         basename of `path`.
+        :param passive: If True, ask the peer to listen and connect to
+                        them instead (for when we can't accept
+                        connections).
+        :rtype: Transfer
+        """
+        filename = filename or os.path.basename(path)
+        transfer = Transfer(
+            client, nick, filename, path, os.path.getsize(path), True
+        )
+        address = pack_address(self._address(client))
+
+        if passive:
+            transfer.token = str(next(self._tokens))
+            self._pending[(nick, transfer.token)] = transfer
+            self._ctcp(client, nick, 'SEND', filename, address, 0,
+                       transfer.size, transfer.token)
+            return self._spawn(transfer, self._send_passive)
+
+        listener = self._listen()
+        port = listener.getsockname()[1]
+        self._pending[(nick, port)] = transfer
+        self._ctcp(client, nick, 'SEND', filename, address, port,
+                   transfer.size)
+        return self._spawn(transfer, self._send_active, listener, port)
+
+    def _send_active(self, transfer, listener, port):
+        try:
+            with gevent.Timeout(self.timeout):
+                sock, _ = listener.accept()
+        finally:
+            listener.close()
+            self._pending.pop((transfer.nick, port), None)
+
+        self._send(transfer, sock)
+
+    def _send_passive(self, transfer):
+        if not transfer._ready.wait(self.timeout):
+            raise DCCError('No answer to passive offer.')
+
+        sock = gevent.socket.create_connection(
+            transfer._peer,
+            timeout=self.timeout
+        )
+        self._send(transfer, sock)
+
+    def _send(self, transfer, sock):
+        bucket = None
+        if self.transfer_rate:
+            bucket = TokenBucket(self.transfer_rate)
+
+        # Acknowledgements have to be read as they arrive, otherwise a
+        # peer blocking on sending them would stop reading our data.
+        acks = gevent.spawn(self._read_acks, sock, transfer.size)
+
+        transfer.started = time.time()
+        try:
+            with open(transfer.path, 'rb') as fin:
+                offset = transfer.position
+                while offset < transfer.size:
+                    count = min(self.chunk_size, transfer.size - offset)
+                    self._throttle(bucket, count)
+                    with gevent.Timeout(self.timeout):
+                        sent = _sendfile(sock, fin, offset, count)
+                    offset += sent
+                    transfer.transferred += sent
+
+            # Wait for the final acknowledgement, or the peer hanging up.
+            acks.join(timeout=self.timeout)
+        finally:
+            acks.kill()
+            sock.close()
+            transfer.finished = time.time()
+
+    def _read_acks(self, sock, size):
+        final = size & 0xFFFFFFFF
+        data = b''
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return
+            data = (data + chunk)[-_ACK.size:]
+            if len(data) == _ACK.size and _ACK.unpack(data)[0] == final:
+                return
+
+    # Incoming transfers.
+
+    def accept(self, client, offer, path, resume=False):
+        """
+        Accepts an incoming offer, receiving it into `path`.
+
+        :param client: The client the offer arrived on.
+        :param offer: The `Offer` from `on_dcc_offer`.
+        :param path: Where to save the file.
+        :param resume: If True and `path` already holds part of the
+                       file, ask the sender to resume from there.
+        :rtype: Transfer
+        """
+        transfer = Transfer(
+            client, offer.nick, offer.filename, path, offer.size, False,
+            token=offer.token
+        )
+
+        resuming = False
+        if resume and os.path.exists(path):
+            position = os.path.getsize(path)
+            if 0 < position < offer.size:
+                resuming = True
+                transfer.position = position
+                self._pending[(offer.nick, offer.port or offer.token)] = \
+                    transfer
+                self._ctcp(client, offer.nick, 'RESUME', offer.filename,
+                           offer.port, position, offer.token)
+
+        if offer.port:
+            return self._spawn(
+                transfer,
+                self._receive_active,
+                (offer.host, offer.port),
+                resuming
+            )
+        return self._spawn(transfer, self._receive_passive, resuming)
+
+    def _wait_accept(self, transfer):
+        if not transfer._ready.wait(self.timeout):
+            raise DCCError('Resume request was not accepted.')
+
+    def _receive_active(self, transfer, address, resuming):
+        if resuming:
+            self._wait_accept(transfer)
+
+        sock = gevent.socket.create_connection(address, timeout=self.timeout)
+        self._receive(transfer, sock)
+
+    def _receive_passive(self, transfer, resuming):
+        if resuming:
+            self._wait_accept(transfer)
+
+        listener = self._listen()
+        try:
+            self._ctcp(
+                transfer.client,
+                transfer.nick,
+                'SEND',
+                transfer.filename,
+                pack_address(self._address(transfer.client)),
+                listener.getsockname()[1],
+                transfer.size,
+                transfer.token
+            )
+            with gevent.Timeout(self.timeout):
+                sock, _ = listener.accept()
+        finally:
+            listener.close()
+
+        self._receive(transfer, sock)
+
+    def _receive(self, transfer, sock):
+        bucket = None
+        if self.transfer_rate:
+            bucket = TokenBucket(self.transfer_rate)
+
+        transfer.started = time.time()
+        try:
+            mode = 'r+b' if os.path.exists(transfer.path) else 'w+b'
+            with open(transfer.path, mode) as fout:
+                fout.truncate(transfer.size)
+                if transfer.size:
+                    mapped = mmap.mmap(fout.fileno(), transfer.size)
+                    try:
+                        self._receive_into(transfer, sock, mapped, bucket)
+                    finally:
+                        mapped.close()
+        finally:
+            sock.close()
+            transfer.finished = time.time()
+
+    def _receive_into(self, transfer, sock, mapped, bucket):
+        try:
+            view = memoryview(mapped)
+        except TypeError:
+            # Python 2's mmap doesn't support the new buffer protocol.
+            view = None
+
+        try:
+            offset = transfer.position
+            while offset < transfer.size:
+                count = min(self.chunk_size, transfer.size - offset)
+
+                with gevent.Timeout(self.timeout):
+                    if view is not None:
+                        received = sock.recv_into(
+                            view[offset:offset + count],
+                            count
+                        )
+                    else:
+                        data = sock.recv(count)
+                        received = len(data)
+                        mapped[offset:offset + received] = data
+
+                if not received:
+                    raise DCCError(
+                        'Connection closed after {0} of {1} bytes.'.format(
+                            offset, transfer.size
+                        )
+                    )
+
+                # Charged after the fact, reads are often short.
+                self._throttle(bucket, received)
+                offset += received
+                transfer.transferred += received
+                sock.sendall(_ACK.pack(offset & 0xFFFFFFFF))
+
+            mapped.flush()
+        finally:
+            if view is not None:
+                view.release()
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Detects floods as they happen, with memory that doesn't grow with the
+number of senders.
+
+Counts are kept in a count-min sketch split into time buckets; the
+oldest bucket is cleared as time moves on, so each count covers a
+sliding window. Estimates can only be too high, never too low, and the
+sketch size bounds how often that happens.
+"""
+import re
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+
+import utopia.parsing
+from utopia import signals
+
+_NOISE = re.compile(r'[\W\d_]+', re.UNICODE)
+_SEPARATORS = re.compile(r'[\s,:;]+', re.UNICODE)
+
+
+def fingerprint(text):
+    """
+    Returns a hash of `text` ignoring case, digits, punctuation and
+    spacing, so lines that only differ by a counter or random suffix of
+    digits are considered the same. Returns None if nothing is left.
+    """
+    normalized = _NOISE.sub(u'', text.lower())
+    if not normalized:
+        return None
+    if not isinstance(normalized, bytes):
+        normalized = normalized.encode('utf-8')
+    return zlib.crc32(normalized) & 0xffffffff
+
+
+class SlidingSketch(object):
+    def __init__(self, window=10, buckets=5, width=4096, depth=4):
+        """
+        A count-min sketch counting how often keys were added within the
+        last `window` seconds. Uses ``buckets * width * depth`` counters
+        regardless of the number of keys.
+
+        :param window: The sliding window, in seconds.
+        :param buckets: How many parts the window is split into. Counts
+                        expire a part at a time.
+        :param width: Counters per row. Wider sketches overestimate less.
+        :param depth: Rows, each using a different hash.
+        """
+        self.window = window
+        self.buckets = buckets
+        self.width = width
+        self.depth = depth
+
+        self._span = float(window) / buckets
+        self._counts = array('L', [0]) * (buckets * depth * width)
+        self._epoch = None
+
+    def _advance(self, now):
+        epoch = int(now / self._span)
+        if self._epoch is None:
+            self._epoch = epoch
+        elapsed = epoch - self._epoch
+        if elapsed <= 0:
+            return
+
+        size = self.depth * self.width
+        if elapsed >= self.buckets:
+            self._counts = array('L', [0]) * len(self._counts)
+        else:
+            zero = array('L', [0]) * size
+            for e in range(self._epoch + 1, epoch + 1):
+                start = (e % self.buckets) * size
+                self._counts[start:start + size] = zero
+        self._epoch = epoch
+
+    def _columns(self, key):
+        h = hash(key)
+        # Derive all rows from two halves of one hash.
+        h1, h2 = h & 0xffffffff, ((h >> 32) & 0xffffffff) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key, now=None):
+        """
+        Counts `key` once and returns its estimated count in the window.
+        """
+        self._advance(now or time.time())
+
+        counts, width = self._counts, self.width
+        size = self.depth * width
+        base = (self._epoch % self.buckets) * size
+
+        estimate = None
+        for row, column in enumerate(self._columns(key)):
+            offset = row * width + column
+            counts[base + offset] += 1
+            total = sum(counts[b * size + offset]
+                        for b in range(self.buckets))
+            if estimate is None or total < estimate:
+                estimate = total
+        return estimate
+
+    def count(self, key, now=None):
+        """
+        Returns the estimated count of `key` in the window.
+        """
+        self._advance(now or time.time())
+
+        counts, width = self._counts, self.width
+        size = self.depth * width
+        return min(
+            sum(counts[b * size + row * width + column]
+                for b in range(self.buckets))
+            for row, column in enumerate(self._columns(key))
+        )
+
+
+class FloodPlugin(object):
+    commands = ('PRIVMSG', 'NOTICE', 'JOIN', 'PART', 'KICK', 'QUIT', 'NICK',
+                '005', '353')
+
+    #: The default limits, per `window` seconds.
+    LIMITS = {
+        # Messages from one host.
+        'messages': 10,
+        # The same line (see `fingerprint`) in a channel, from anyone.
+        'repeats': 4,
+        # JOINs and PARTs from one host.
+        'joins': 6,
+        # Channel members highlighted in a single message.
+        'highlights': 6
+    }
+
+    def __init__(self, window=10, limits=None, width=4096, depth=4,
+                 remember=1024):
+        """
+        A plugin firing `on_flood` when a sender or channel goes over one
+        of its `limits` within `window` seconds. Senders are keyed by the
+        host in their prefix (falling back to the nick), so changing nicks
+        doesn't escape detection.
+
+        Each kind of flood is fired once when its limit is exceeded, and
+        again only after its count dropped back below the limit (or it
+        was forgotten, see `remember`).
+
+        :param window: The sliding window, in seconds.
+        :param limits: Overrides for `LIMITS`. A limit of None disables
+                       that check.
+        :param width: See `SlidingSketch`.
+        :param depth: See `SlidingSketch`.
+        :param remember: The number of senders and channels over a limit
+                         to remember, so they are only fired once. The
+                         least recently seen are forgotten first.
+        """
+        self.limits = dict(self.LIMITS)
+        self.limits.update(limits or {})
+        self.chantypes = '!&#+'
+
+        self.window = window
+        self.remember = remember
+
+        self._sketch = SlidingSketch(window, width=width, depth=depth)
+        # Keys over their limit that were fired, to when they were last
+        # seen over it, least recently seen first.
+        self._fired = OrderedDict()
+        # Lower cased nicks per channel, for counting highlights.
+        self._members = {}
+
+    def bind(self, client):
+        signals.on_message.connect(self.have_message, sender=client)
+
+        return self
+
+    def have_message(self, client, message):
+        handler = getattr(self, '_on_' + message.command, None)
+        if handler is not None and message.prefix is not None:
+            handler(client, message.prefix, message.args)
+
+    def _check(self, client, kind, key, prefix, channel):
+        limit = self.limits.get(kind)
+        if limit is None:
+            return
+
+        now = time.time()
+        key = (kind,) + key
+        count = self._sketch.add(key, now)
+
+        fired = self._fired
+        if count <= limit:
+            # Back under the limit, fire again next time.
+            fired.pop(key, None)
+            return
+
+        # Forget keys that haven't been over their limit for a window.
+        expired = now - self.window
+        while fired:
+            oldest = next(iter(fired))
+            if fired[oldest] >= expired:
+                break
+            del fired[oldest]
+
+        # Colliding keys raise the estimate between adds, so it can skip
+        # past limit + 1. Remembering what was fired catches that.
+        known = fired.pop(key, None) is not None
+        fired[key] = now
+        while len(fired) > self.remember:
+            fired.popitem(last=False)
+
+        if not known:
+            signals.on_flood.send(
+                client,
+                kind=kind,
+                prefix=prefix,
+                channel=channel,
+                count=count
+            )
+
+    def _on_PRIVMSG(self, client, prefix, args):
+        if len(args) < 2:
+            return
+
+        target, text = args[0], args[-1]
+        channel = None
+        if utopia.parsing.is_channel(target, self.chantypes):
+            channel = target
+
+        self._check(client, 'messages', (prefix.host or prefix.nick,),
+                    prefix, channel)
+        if channel is None:
+            return
+
+        key = channel.lower()
+        line = fingerprint(text)
+        if line is not None:
+            self._check(client, 'repeats', (key, line), prefix, channel)
+
+        limit = self.limits.get('highlights')
+        members = self._members.get(key)
+        if limit is None or not members:
+            return
+
+        words = set(_SEPARATORS.split(text.lower())) & members
+        words.discard(prefix.nick.lower())
+        if len(words) > limit:
+            signals.on_flood.send(
+                client,
+                kind='highlights',
+                prefix=prefix,
+                channel=channel,
+                count=len(words)
+            )
+
+    _on_NOTICE = _on_PRIVMSG
+
+    def _on_JOIN(self, client, prefix, args):
+        self._members.setdefault(args[0].lower(), set()).add(
+            prefix.nick.lower())
+        self._check(client, 'joins', (prefix.host or prefix.nick,),
+                    prefix, args[0])
+
+    def _on_PART(self, client, prefix, args):
+        if prefix.nick == client.identity.nick:
+            self._members.pop(args[0].lower(), None)
+            return
+
+        members = self._members.get(args[0].lower())
+        if members is not None:
+            members.discard(prefix.nick.lower())
+        self._check(client, 'joins', (prefix.host or prefix.nick,),
+                    prefix, args[0])
+
+    def _on_KICK(self, client, prefix, args):
+        if args[1] == client.identity.nick:
+            self._members.pop(args[0].lower(), None)
+            return
+
+        members = self._members.get(args[0].lower())
+        if members is not None:
+            members.discard(args[1].lower())
+
+    def _on_QUIT(self, client, prefix, args):
+        nick = prefix.nick.lower()
+        for members in self._members.values():
+            members.discard(nick)
+
+    def _on_NICK(self, client, prefix, args):
+        nick = prefix.nick.lower()
+        for members in self._members.values():
+            if nick in members:
+                members.discard(nick)
+                members.add(args[0].lower())
+
+    def _on_005(self, client, prefix, args):
+        chantypes = utopia.parsing.unpack_005(args)[1].get('CHANTYPES')
+        if chantypes:
+            self.chantypes = ''.join(chantypes)
+
+    def _on_353(self, client, prefix, args):
+        members = self._members.setdefault(args[2].lower(), set())
+        for nick in args[3].split():
+            members.add(nick.lstrip('~&@%+').lower())
@@ -3,6 +3,9 @@ from utopia import signals
 
 
 class HandshakePlugin(object):
+    # Doesn't need any received messages.
+    commands = ()
+
     @classmethod
     def bind(cls, client):
         signals.on_connect.connect(
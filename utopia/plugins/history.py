@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+A searchable history of channel and private messages.
+
+Messages are appended to per-channel segments. Once a segment is full it
+is compressed and only decompressed again when a query needs it. Words
+and nicks are indexed with compact integer arrays of line numbers, so
+millions of lines cost a few bytes each plus their compressed text.
+"""
+import json
+import re
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+
+import utopia.parsing
+from utopia import signals
+
+#: A single stored message.
+Entry = namedtuple('Entry', ['time', 'channel', 'nick', 'text'])
+
+_WORDS = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Returns the set of lower cased words in `text`.
+    """
+    return set(_WORDS.findall(text.lower()))
+
+
+def _countdown(start, stop):
+    while start >= stop:
+        yield start
+        start -= 1
+
+
+def _within(postings, start, stop):
+    """
+    Yields the line numbers in `postings` from `start` up to `stop`,
+    newest first.
+    """
+    return reversed(postings[
+        bisect_left(postings, start):bisect_left(postings, stop)
+    ])
+
+
+class _Log(object):
+    """
+    The history of a single channel or private conversation.
+    """
+    def __init__(self, name, segment_size):
+        self.name = name
+        self.segment_size = segment_size
+
+        # Sealed segments as (first time, last time, compressed records).
+        self.segments = []
+        # The last time of each sealed segment, for finding the segment
+        # a time falls in.
+        self.times = array('d')
+        # Number of segments removed by compaction.
+        self.dropped = 0
+        # Records of the segment being filled, as (time, nick, text).
+        self.active = []
+
+        # Maps lower cased words and nicks to sorted line numbers.
+        self.words = {}
+        self.nicks = {}
+
+    @property
+    def first(self):
+        """
+        The number of the oldest line still stored.
+        """
+        return self.dropped * self.segment_size
+
+    def __len__(self):
+        return (self.dropped + len(self.segments)) * self.segment_size + \
+            len(self.active)
+
+    def append(self, timestamp, nick, text):
+        n = len(self)
+        self.active.append((timestamp, nick, text))
+
+        for word in tokenize(text):
+            postings = self.words.get(word)
+            if postings is None:
+                postings = self.words[word] = array('L')
+            postings.append(n)
+
+        postings = self.nicks.get(nick.lower())
+        if postings is None:
+            postings = self.nicks[nick.lower()] = array('L')
+        postings.append(n)
+
+        if len(self.active) >= self.segment_size:
+            self.segments.append((
+                self.active[0][0],
+                self.active[-1][0],
+                zlib.compress(json.dumps(self.active).encode('utf-8'))
+            ))
+            self.times.append(self.active[-1][0])
+            self.active = []
+
+    def compact(self, before):
+        """
+        Drops sealed segments that only hold lines older than `before`.
+        """
+        count = bisect_left(self.times, before)
+        if not count:
+            return
+
+        del self.segments[:count]
+        del self.times[:count]
+        self.dropped += count
+
+        first = self.first
+        for index in (self.words, self.nicks):
+            for key, postings in list(index.items()):
+                del postings[:bisect_left(postings, first)]
+                if not postings:
+                    del index[key]
+
+
+class HistoryPlugin(object):
+    commands = ('PRIVMSG', '005')
+
+    def __init__(self, segment_size=1024, retention=None, cache=8):
+        """
+        A plugin storing PRIVMSGs, keyed by channel or, for private
+        messages, by the other nick. Works with `ProtocolPlugin` and
+        `EasyProtocolPlugin` alike.
+
+        :param segment_size: Lines per compressed segment.
+        :param retention: If set, lines older than this many seconds are
+                          dropped, a segment at a time.
+        :param cache: Number of decompressed segments kept around for
+                      queries.
+        """
+        self.segment_size = segment_size
+        self.retention = retention
+        self.chantypes = '!&#+'
+
+        self._logs = {}
+        self._cache = OrderedDict()
+        self._cache_size = cache
+
+    def bind(self, client):
+        signals.m.on_PRIVMSG.connect(self.on_privmsg, sender=client)
+        signals.m.on_PUBMSG.connect(self.on_privmsg, sender=client)
+        signals.m.on_005.connect(self.on_005, sender=client)
+
+        return self
+
+    def on_005(self, client, prefix, target, args):
+        chantypes = utopia.parsing.unpack_005(args)[1].get('CHANTYPES')
+        if chantypes:
+            self.chantypes = ''.join(chantypes)
+
+    def on_privmsg(self, client, prefix, target, args):
+        if prefix is None or not args:
+            return
+
+        if utopia.parsing.is_channel(target, self.chantypes):
+            channel = target
+        else:
+            channel = prefix.nick
+
+        self.add(channel, prefix.nick, args[-1])
+
+    def add(self, channel, nick, text, timestamp=None):
+        """
+        Stores a message. Called for every PRIVMSG received, but can also
+        be used to record messages sent by the client itself.
+        """
+        key = channel.lower()
+        log = self._logs.get(key)
+        if log is None:
+            log = self._logs[key] = _Log(channel, self.segment_size)
+
+        sealed = len(log.segments)
+        log.append(timestamp or time.time(), nick, text)
+
+        if self.retention is not None and len(log.segments) != sealed:
+            log.compact(time.time() - self.retention)
+
+    def compact(self):
+        """
+        Drops expired lines from every channel. Happens automatically as
+        segments fill up; call this to expire quiet channels as well.
+        """
+        if self.retention is None:
+            return
+
+        before = time.time() - self.retention
+        for log in self._logs.values():
+            log.compact(before)
+
+    @property
+    def channels(self):
+        return [log.name for log in self._logs.values()]
+
+    def count(self, channel):
+        """
+        Returns the number of lines stored for `channel`.
+        """
+        log = self._logs.get(channel.lower())
+        if log is None:
+            return 0
+        return len(log) - log.first
+
+    def _segment(self, log, number):
+        key = (id(log), number)
+        records = self._cache.pop(key, None)
+        if records is None:
+            data = log.segments[number - log.dropped][2]
+            records = json.loads(zlib.decompress(data).decode('utf-8'))
+        self._cache[key] = records
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return records
+
+    def _line(self, log, n):
+        number, offset = divmod(n, log.segment_size)
+        if number - log.dropped == len(log.segments):
+            record = log.active[offset]
+        else:
+            record = self._segment(log, number)[offset]
+        return Entry(record[0], log.name, record[1], record[2])
+
+    def _find(self, log, when):
+        """
+        Returns the number of the first line at or after `when`. Only the
+        segment `when` falls in is decompressed.
+        """
+        i = bisect_left(log.times, when)
+        if i < len(log.segments):
+            number = log.dropped + i
+            records = self._segment(log, number)
+        else:
+            number = log.dropped + len(log.segments)
+            records = log.active
+
+        times = [record[0] for record in records]
+        return number * log.segment_size + bisect_left(times, when)
+
+    def _range(self, log, since, until):
+        """
+        Returns the line numbers from `since` up to `until`, as the
+        `start` and `stop` of a range.
+        """
+        start = log.first if since is None else self._find(log, since)
+        stop = len(log) if until is None else self._find(log, until)
+        return start, max(start, stop)
+
+    def _lines(self, log, numbers):
+        """
+        Yields entries for `numbers`, newest first.
+        """
+        for n in numbers:
+            yield self._line(log, n)
+
+    def last(self, channel, nick=None, since=None, until=None):
+        """
+        Yields the messages in `channel` (by `nick`, if given), newest
+        first.
+        """
+        log = self._logs.get(channel.lower())
+        if log is None:
+            return iter(())
+
+        start, stop = self._range(log, since, until)
+        if nick is None:
+            numbers = _countdown(stop - 1, start)
+        else:
+            numbers = _within(log.nicks.get(nick.lower(), ()), start, stop)
+
+        return self._lines(log, numbers)
+
+    def search(self, channel, words, nick=None, since=None, until=None):
+        """
+        Yields the messages in `channel` containing every word in `words`
+        (and sent by `nick`, if given), newest first.
+
+        :param words: A string, split into words the same way messages
+                      are indexed.
+        """
+        log = self._logs.get(channel.lower())
+        if log is None:
+            return iter(())
+
+        postings = [log.words.get(word) for word in tokenize(words)]
+        if nick is not None:
+            postings.append(log.nicks.get(nick.lower()))
+        if not postings or not all(postings):
+            return iter(())
+
+        # Walk the shortest list, checking the others with a binary
+        # search.
+        postings.sort(key=len)
+        shortest, others = postings[0], postings[1:]
+        start, stop = self._range(log, since, until)
+
+        def matches():
+            for n in _within(shortest, start, stop):
+                for other in others:
+                    i = bisect_left(other, n)
+                    if i == len(other) or other[i] != n:
+                        break
+                else:
+                    yield n
+
+        return self._lines(log, matches())
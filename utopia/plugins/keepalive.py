@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import logging
+import socket
+import time
+
+from utopia import signals
+
+logger = logging.getLogger('utopia.keepalive')
+
+# Prefix of the tokens sent in our PINGs, followed by the send time.
+_TOKEN = 'utopia-'
+
+
+class KeepalivePlugin(object):
+    # Anything received counts as a sign of life, but only PONGs are
+    # needed for that.
+    commands = ('PONG',)
+
+    def __init__(self, interval=30, timeout=120, tcp_keepalive=True,
+                 user_timeout=None):
+        """
+        A plugin that PINGs the server every `interval` seconds,
+        measuring the round trip time from the PONGs (see `lag` and
+        `on_lag`). If nothing is received for `timeout` seconds the
+        connection is considered dead, `on_timeout` is fired and the
+        client is terminated.
+
+        :param interval: Seconds between PINGs.
+        :param timeout: Seconds of silence before giving up.
+        :param tcp_keepalive: If True, also enable TCP keepalive probes
+                              on the socket, where supported.
+        :param user_timeout: If set, the number of seconds sent data may
+                             remain unacknowledged before the kernel
+                             drops the connection (TCP_USER_TIMEOUT,
+                             Linux only).
+        """
+        self.interval = interval
+        self.timeout = timeout
+        self.tcp_keepalive = tcp_keepalive
+        self.user_timeout = user_timeout
+
+        #: The last measured round trip time in seconds, or None.
+        self.lag = None
+        #: When anything was last received.
+        self.last_received = None
+
+        # The repeating timer sending PINGs.
+        self._pinger = None
+
+    def bind(self, client):
+        signals.on_connect.connect(self.have_connected, sender=client)
+        signals.on_disconnect.connect(self.have_disconnected, sender=client)
+        signals.on_raw_line.connect(self.have_raw_line, sender=client)
+        signals.on_raw_message.connect(self.have_raw_message, sender=client)
+
+        return self
+
+    def have_connected(self, client):
+        self.last_received = time.time()
+        self._configure(client.socket)
+        self._pinger = client.timers.call_every(
+            self.interval,
+            self._ping,
+            client
+        )
+
+    def have_disconnected(self, client):
+        if self._pinger is not None:
+            self._pinger.cancel()
+            self._pinger = None
+
+    def have_raw_line(self, client, line):
+        self.last_received = time.time()
+
+    def have_raw_message(self, client, prefix, command, args):
+        if command == 'PONG' and args and args[-1].startswith(_TOKEN):
+            try:
+                sent = float(args[-1][len(_TOKEN):])
+            except ValueError:
+                return
+
+            self.lag = time.time() - sent
+            signals.on_lag.send(client, lag=self.lag)
+
+    def _configure(self, sock):
+        if self.tcp_keepalive:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            # Start probing well before the application level timeout.
+            for name, value in (
+                    ('TCP_KEEPIDLE', max(1, int(self.interval))),
+                    ('TCP_KEEPINTVL', max(1, int(self.interval) // 3)),
+                    ('TCP_KEEPCNT', 3)):
+                option = getattr(socket, name, None)
+                if option is not None:
+                    sock.setsockopt(socket.IPPROTO_TCP, option, value)
+
+        if self.user_timeout is not None:
+            # Not exposed by the socket module before Python 3.6.
+            option = getattr(socket, 'TCP_USER_TIMEOUT', 18)
+            try:
+                sock.setsockopt(
+                    socket.IPPROTO_TCP,
+                    option,
+                    int(self.user_timeout * 1000)
+                )
+            except (OSError, socket.error):
+                logger.debug('TCP_USER_TIMEOUT is not supported.')
+
+    def _ping(self, client):
+        silence = time.time() - self.last_received
+        if silence >= self.timeout:
+            logger.warning(
+                '%s: nothing received for %.0f seconds, disconnecting.',
+                client.host,
+                silence
+            )
+            self._pinger.cancel()
+            self._pinger = None
+            signals.on_timeout.send(client, silence=silence)
+            # Don't hold up the other timers on the wheel.
+            client.terminate(block=False)
+            return
+
+        client.send('PING', '{0}{1:.6f}'.format(_TOKEN, time.time()))
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Matches messages against many keywords at once.
+
+The keywords are compiled into an Aho-Corasick automaton, so checking a
+message costs the same whether there are ten keywords or ten thousand.
+"""
+from collections import deque
+
+import utopia.parsing
+from utopia import signals
+
+
+class AhoCorasick(object):
+    def __init__(self, keywords=None):
+        """
+        A multi-pattern string matcher. Keywords can be added and removed
+        at any time, the automaton is rebuilt on the next search.
+
+        :param keywords: An optional dict of keywords to keys (what is
+                         reported when the keyword matches).
+        """
+        self._keywords = {}
+        self._built = False
+
+        # The automaton; transitions, failure links and, for each state,
+        # the keywords ending there.
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+
+        for keyword, key in (keywords or {}).items():
+            self.add(keyword, key)
+
+    def __len__(self):
+        return len(self._keywords)
+
+    def __contains__(self, keyword):
+        return keyword in self._keywords
+
+    def add(self, keyword, key=None):
+        """
+        Adds `keyword`, reporting `key` (defaults to the keyword) when it
+        matches.
+        """
+        if not keyword:
+            raise ValueError('Keywords may not be empty.')
+
+        self._keywords[keyword] = keyword if key is None else key
+        self._built = False
+
+    def remove(self, keyword):
+        del self._keywords[keyword]
+        self._built = False
+
+    def _build(self):
+        goto, out = [{}], [[]]
+        for keyword in self._keywords:
+            state = 0
+            for char in keyword:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = goto[state][char] = len(goto)
+                    goto.append({})
+                    out.append([])
+                state = next_state
+            out[state].append(keyword)
+
+        # Breadth first, so failure links always point at states that
+        # are already complete.
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+
+                f = fail[state]
+                while f and char not in goto[f]:
+                    f = fail[f]
+                fail[next_state] = goto[f].get(char, 0)
+                if fail[next_state] == next_state:
+                    fail[next_state] = 0
+                out[next_state].extend(out[fail[next_state]])
+
+        self._goto = goto
+        self._fail = fail
+        self._out = [tuple(o) for o in out]
+        self._built = True
+
+    def finditer(self, text):
+        """
+        Yields (start, end, keyword, key) for every occurrence of every
+        keyword in `text`, including overlapping ones.
+        """
+        if not self._built:
+            self._build()
+
+        goto, fail, out = self._goto, self._fail, self._out
+        keywords = self._keywords
+
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            for keyword in out[state]:
+                yield i + 1 - len(keyword), i + 1, keyword, keywords[keyword]
+
+
+def _is_word(char):
+    return char.isalnum() or char == '_'
+
+
+class MatcherPlugin(object):
+    commands = ('005', 'PRIVMSG')
+
+    def __init__(self, keywords=None, word_boundaries=True,
+                 casemapping='rfc1459', ignore_case=True):
+        """
+        A plugin firing `on_match` for messages containing any of
+        `keywords`. Works with `ProtocolPlugin` and `EasyProtocolPlugin`
+        alike.
+
+        :param keywords: An iterable of keywords, or a dict of keywords
+                         to the key reported when they match.
+        :param word_boundaries: If True, keywords only match whole words.
+        :param casemapping: The casemapping used to fold keywords and
+                            messages, updated from ISUPPORT. Other
+                            letters are lower cased as unicode.
+        :param ignore_case: If False, matching is case sensitive.
+        """
+        self.word_boundaries = word_boundaries
+        self.casemapping = casemapping
+        self.ignore_case = ignore_case
+
+        if not isinstance(keywords, dict):
+            keywords = dict((k, k) for k in keywords or ())
+        self._keywords = keywords
+        self._automaton = None
+        self._compile()
+
+    def bind(self, client):
+        signals.m.on_PRIVMSG.connect(self.on_message, sender=client)
+        signals.m.on_PUBMSG.connect(self.on_message, sender=client)
+        signals.m.on_005.connect(self.on_005, sender=client)
+
+        return self
+
+    def fold(self, text):
+        if not self.ignore_case:
+            return text
+        return utopia.parsing.irc_lower(text, self.casemapping).lower()
+
+    def _compile(self):
+        self._automaton = AhoCorasick()
+        # Several keywords can fold to the same pattern, so each pattern
+        # maps to the keywords (and their keys) it stands for.
+        self._patterns = {}
+        for keyword, key in self._keywords.items():
+            self._index(keyword, key)
+
+    def _index(self, keyword, key):
+        folded = self.fold(keyword)
+        if folded not in self._patterns:
+            self._patterns[folded] = {}
+            self._automaton.add(folded)
+        self._patterns[folded][keyword] = key
+
+    def add(self, keyword, key=None):
+        key = keyword if key is None else key
+        self._keywords[keyword] = key
+        self._index(keyword, key)
+
+    def remove(self, keyword):
+        del self._keywords[keyword]
+        folded = self.fold(keyword)
+        keywords = self._patterns[folded]
+        del keywords[keyword]
+        if not keywords:
+            del self._patterns[folded]
+            self._automaton.remove(folded)
+
+    def match(self, text):
+        """
+        Returns the set of keys whose keywords occur in `text`.
+        """
+        folded = self.fold(text)
+        matches = set()
+        for start, end, pattern, _ in self._automaton.finditer(folded):
+            if self.word_boundaries and (
+                    (start > 0 and _is_word(folded[start - 1])) or
+                    (end < len(folded) and _is_word(folded[end]))):
+                continue
+            matches.update(self._patterns[pattern].values())
+        return matches
+
+    def on_005(self, client, prefix, target, args):
+        casemapping = utopia.parsing.unpack_005(args)[1].get('CASEMAPPING')
+        if casemapping and casemapping != self.casemapping:
+            self.casemapping = casemapping
+            self._compile()
+
+    def on_message(self, client, prefix, target, args):
+        if not args or not self._keywords:
+            return
+
+        matches = self.match(args[-1])
+        if matches:
+            signals.on_match.send(
+                client,
+                prefix=prefix,
+                target=target,
+                text=args[-1],
+                matches=matches
+            )
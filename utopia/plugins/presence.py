@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Tracks whether nicks are online.
+
+Servers advertising MONITOR (or the older WATCH) in ISUPPORT notify the
+client whenever a nick on its list comes or goes, so nothing has to be
+polled at all. Nicks that don't fit the server's list, or all of them on
+servers without either, are polled with ISON, packing as many nicks as
+fit into each line.
+"""
+import time
+from collections import OrderedDict, deque
+
+import utopia.parsing
+from utopia import signals
+
+# The longest line a server accepts, without the CRLF.
+_LINE = 510
+
+
+def chunks(items, overhead, separator=u' '):
+    """
+    Yields lists of `items` whose joined length, plus `overhead`, fits
+    in a single IRC line.
+    """
+    chunk, size = [], overhead
+    for item in items:
+        length = len(item.encode('utf-8')) + len(separator)
+        if chunk and size + length > _LINE + len(separator):
+            yield chunk
+            chunk, size = [], overhead
+        chunk.append(item)
+        size += length
+    if chunk:
+        yield chunk
+
+
+def _limit(value):
+    """
+    Parses a MONITOR or WATCH limit, where an empty value means there is
+    none.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class PresencePlugin(object):
+    commands = ('005', '376', '422', '303', '730', '731', '734', '600',
+                '601', '604', '605', '512', 'QUIT', 'NICK')
+
+    def __init__(self, nicks=(), interval=60):
+        """
+        A plugin keeping track of whether `nicks` are online, firing
+        `on_presence` whenever that changes.
+
+        :param nicks: The nicks to track. More can be added at any time
+                      with `add`.
+        :param interval: Seconds between ISON polls, for nicks that can't
+                         be monitored. Needs a client with `timers`.
+        """
+        self.interval = interval
+        #: How nicks are folded, updated from ISUPPORT.
+        self.casemapping = 'rfc1459'
+
+        # Folded nicks to the nick as given.
+        self._nicks = OrderedDict()
+        #: Folded nicks to True (online), False (offline) or None (not
+        #: known yet).
+        self.status = {}
+
+        #: How nicks are tracked, 'monitor', 'watch' or 'ison'. None until
+        #: registration is complete.
+        self.mode = None
+        self._limit = None
+        # Folded nicks on the server's MONITOR or WATCH list.
+        self._monitored = set()
+        # When each ISON waiting for its reply was sent, and its nicks.
+        self._polls = deque()
+        self._poller = None
+
+        self._isupport = {}
+        self._client = None
+
+        self.add(*nicks)
+
+    def bind(self, client):
+        self._client = client
+        signals.on_message.connect(self.have_message, sender=client)
+        signals.on_disconnect.connect(self.have_disconnected, sender=client)
+
+        return self
+
+    def __contains__(self, nick):
+        return self.fold(nick) in self._nicks
+
+    def fold(self, nick):
+        return utopia.parsing.irc_lower(nick, self.casemapping)
+
+    def is_online(self, nick):
+        """
+        Returns True or False, or None if it isn't known yet.
+        """
+        return self.status.get(self.fold(nick))
+
+    @property
+    def online(self):
+        """
+        The online nicks.
+        """
+        return [self._nicks[key] for key, online in self.status.items()
+                if online]
+
+    @property
+    def polled(self):
+        """
+        The nicks that are polled with ISON.
+        """
+        return [n for n in self._nicks if n not in self._monitored]
+
+    def add(self, *nicks):
+        """
+        Starts tracking `nicks`.
+        """
+        new = []
+        for nick in nicks:
+            key = self.fold(nick)
+            if key not in self._nicks:
+                self._nicks[key] = nick
+                self.status[key] = None
+                new.append(key)
+
+        if new and self.mode is not None:
+            self._watch(new)
+
+    def remove(self, *nicks):
+        """
+        Stops tracking `nicks`.
+        """
+        removed = []
+        for nick in nicks:
+            key = self.fold(nick)
+            if self._nicks.pop(key, None) is not None:
+                self.status.pop(key, None)
+                if key in self._monitored:
+                    self._monitored.discard(key)
+                    removed.append(nick)
+
+        if not removed:
+            return
+        if self.mode == 'monitor':
+            for chunk in chunks(removed, len('MONITOR - '), u','):
+                self._client.send('MONITOR', '-', u','.join(chunk))
+        elif self.mode == 'watch':
+            watches = [u'-' + nick for nick in removed]
+            for chunk in chunks(watches, len('WATCH :')):
+                self._client.send('WATCH', u' '.join(chunk))
+
+    def _set(self, client, nick, online):
+        key = self.fold(nick)
+        if key not in self.status or self.status[key] is online:
+            return
+
+        self.status[key] = online
+        signals.on_presence.send(client, nick=self._nicks[key], online=online)
+
+    def _start(self, client):
+        if 'MONITOR' in self._isupport:
+            self.mode = 'monitor'
+        elif 'WATCH' in self._isupport:
+            self.mode = 'watch'
+        else:
+            self.mode = 'ison'
+
+        self._limit = None
+        if self.mode != 'ison':
+            self._limit = _limit(self._isupport[self.mode.upper()])
+
+        self._watch(list(self._nicks))
+
+        timers = getattr(client, 'timers', None)
+        if timers is not None:
+            self._poller = timers.call_every(self.interval, self._poll,
+                                             client)
+        self._poll(client)
+
+    def _watch(self, keys):
+        """
+        Adds as many of `keys` as the server allows to its list. The rest
+        are polled.
+        """
+        if self.mode == 'ison':
+            return
+
+        if self._limit is not None:
+            keys = keys[:max(0, self._limit - len(self._monitored))]
+        if not keys:
+            return
+
+        self._monitored.update(keys)
+        nicks = [self._nicks[key] for key in keys]
+        if self.mode == 'monitor':
+            for chunk in chunks(nicks, len('MONITOR + '), u','):
+                self._client.send('MONITOR', '+', u','.join(chunk))
+        else:
+            watches = [u'+' + nick for nick in nicks]
+            for chunk in chunks(watches, len('WATCH :')):
+                self._client.send('WATCH', u' '.join(chunk))
+
+    def _poll(self, client):
+        now = time.time()
+        # A reply that didn't come within an interval never will.
+        while self._polls and self._polls[0][0] + self.interval <= now:
+            self._polls.popleft()
+        if self._polls:
+            # The last poll hasn't been answered yet.
+            return
+
+        for chunk in chunks(
+                [self._nicks[key] for key in self.polled],
+                len('ISON :')):
+            self._polls.append((now, [self.fold(nick) for nick in chunk]))
+            client.send('ISON', u' '.join(chunk))
+
+    def have_disconnected(self, client):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+        self.mode = None
+        self._monitored.clear()
+        self._polls.clear()
+        self._isupport = {}
+        for key in self.status:
+            self.status[key] = None
+
+    def have_message(self, client, message):
+        handler = getattr(self, '_on_' + message.command, None)
+        if handler is not None:
+            handler(client, message.prefix, message.args)
+
+    def _on_005(self, client, prefix, args):
+        rest, params = utopia.parsing.unpack_005(args)
+        self._isupport.update(params)
+        casemapping = params.get('CASEMAPPING')
+        if casemapping and casemapping != self.casemapping:
+            self._refold(casemapping)
+        # Without a value, as in 'MONITOR', there is no limit.
+        for key in ('MONITOR', 'WATCH'):
+            if key in rest:
+                self._isupport[key] = None
+
+    def _refold(self, casemapping):
+        nicks = self._nicks
+        self.casemapping = casemapping
+        self._nicks = OrderedDict(
+            (self.fold(nick), nick) for nick in nicks.values()
+        )
+        self.status = dict(
+            (self.fold(nicks[key]), online)
+            for key, online in self.status.items()
+        )
+        self._monitored = set(self.fold(nicks[key]) for key in self._monitored)
+
+    def _on_376(self, client, prefix, args):
+        if self.mode is None:
+            self._start(client)
+
+    # No MOTD, registration is complete all the same.
+    _on_422 = _on_376
+
+    def _on_303(self, client, prefix, args):
+        if not self._polls:
+            return
+
+        polled = self._polls[0][1]
+        online = set(self.fold(nick) for nick in args[-1].split())
+        if not online.issubset(polled):
+            # The reply to an ISON sent by someone else.
+            return
+
+        self._polls.popleft()
+        for key in polled:
+            self._set(client, key, key in online)
+
+    def _on_730(self, client, prefix, args):
+        for target in args[-1].split(','):
+            self._set(client, target.split('!', 1)[0], True)
+
+    def _on_731(self, client, prefix, args):
+        for nick in args[-1].split(','):
+            self._set(client, nick, False)
+
+    def _on_734(self, client, prefix, args):
+        # The list is full, poll these instead.
+        for nick in args[2].split(','):
+            self._monitored.discard(self.fold(nick))
+
+    def _on_600(self, client, prefix, args):
+        self._set(client, args[1], True)
+
+    _on_604 = _on_600
+
+    def _on_601(self, client, prefix, args):
+        self._set(client, args[1], False)
+
+    _on_605 = _on_601
+
+    def _on_512(self, client, prefix, args):
+        # The WATCH list is full.
+        if len(args) > 1:
+            self._monitored.discard(self.fold(args[1]))
+
+    def _on_QUIT(self, client, prefix, args):
+        # Saves a poll for nicks that aren't monitored.
+        if prefix is not None and \
+                self.fold(prefix.nick) not in self._monitored:
+            self._set(client, prefix.nick, False)
+
+    def _on_NICK(self, client, prefix, args):
+        if prefix is None or not args:
+            return
+
+        if self.fold(prefix.nick) not in self._monitored:
+            self._set(client, prefix.nick, False)
+        if self.fold(args[0]) not in self._monitored:
+            self._set(client, args[0], True)
@@ -4,23 +4,42 @@ from utopia import signals
 
 
 class ProtocolPlugin(object):
-    def __init__(self):
+    # Commands whose first argument is the target.
+    _target_commands = frozenset((
+        'NOTICE',
+        'PRIVMSG',
+        'KICK',
+        'BAN',
+        'MODE',
+        'JOIN',
+        'PART'
+    ))
+
+    def __init__(self, commands=None):
         """
         A plugin, which handles firing of protocol events. E.g.
         if the client receives a `JOIN` command, this plugin will
         fire a `on_JOIN` event. Every on-event also has a new target
         parameter containing the user/channel the command was sent to,
         for global events this parameter is None.
+
+        :param commands: If provided, the only commands events are needed
+                         for. Clients created with `commands` skip parsing
+                         everything else. RPL_WELCOME and PING are always
+                         handled.
         """
-        self._target_commands = (
-            'NOTICE',
-            'PRIVMSG',
-            'KICK',
-            'BAN',
-            'MODE',
-            'JOIN',
-            'PART'
-        )
+        self.commands = None
+        if commands is not None:
+            self.commands = frozenset(self._wire(c) for c in commands) | \
+                frozenset(('001', 'PING'))
+
+    @classmethod
+    def _wire(cls, command):
+        """
+        Returns the command received from the server the event for
+        `command` is fired for.
+        """
+        return command.upper()
 
     def bind(self, client):
         signals.on_raw_message.connect(self.on_raw, sender=client)
@@ -48,11 +67,17 @@ class ProtocolPlugin(object):
         client.identity._nick = args[0]
 
     def on_ping(self, client, prefix, target, args):
-        client.sendraw('PONG {0}'.format(' '.join(args[:2])))
+        client.send('PONG', *args[:2])
 
 
 class EasyProtocolPlugin(ProtocolPlugin):
-    def __init__(self, pubmsg=True):
+    _target_commands = ProtocolPlugin._target_commands | frozenset((
+        'PRIVNOTICE',
+        'PUBNOTICE',
+        'PUBMSG'
+    ))
+
+    def __init__(self, pubmsg=True, commands=None):
         """
         A plugin to improve protocol events and make them easier to use
         (e.g. CTCP events).
@@ -62,24 +87,16 @@ class EasyProtocolPlugin(ProtocolPlugin):
                        sent to a channel or directly to the user.
                        PRIVMSG/PRIVNOTICE indicate it was sent to the user,
                        PUBMSG/PUBNOTICE indicate it was sent to a channel.
+        :param commands: See `ProtocolPlugin`. RPL_ISUPPORT is always
+                         handled. Events made up by this plugin (such as
+                         PUBMSG and CTCP_VERSION) ask for the command
+                         they are made from.
         """
-        ProtocolPlugin.__init__(self)
+        ProtocolPlugin.__init__(self, commands)
+        if self.commands is not None:
+            self.commands |= frozenset(('005',))
 
         self.pubmsg = pubmsg
-        self._target_commands = (
-            # default values
-            'NOTICE',
-            'PRIVMSG',
-            'KICK',
-            'BAN',
-            'MODE',
-            'JOIN',
-            'PART',
-            # pubmsg values
-            'PRIVNOTICE',
-            'PUBNOTICE',
-            'PUBMSG'
-        )
 
         self._isupport = (set(), dict())
 
@@ -87,6 +104,15 @@ class EasyProtocolPlugin(ProtocolPlugin):
     def isupport(self):
         return self._isupport
 
+    @classmethod
+    def _wire(cls, command):
+        command = command.upper()
+        if command.startswith('CTCPREPLY') or command.endswith('NOTICE'):
+            return 'NOTICE'
+        if command.startswith('CTCP') or command.endswith('MSG'):
+            return 'PRIVMSG'
+        return command
+
     def bind(self, client):
         ProtocolPlugin.bind(self, client)
         signals.m.on_005.connect(self.on_005, sender=client)
@@ -154,6 +180,8 @@ class EasyProtocolPlugin(ProtocolPlugin):
 
 
 class ISupportPlugin(object):
+    commands = ('005',)
+
     def __init__(self, callback=None):
         """
         A plugin to automatically unpack IRC isupport messages.
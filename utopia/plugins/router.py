@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""
+Routes bot commands such as "!seen nick" to their handlers.
+
+Command names, aliases and subcommands are kept in a prefix trie, so a
+message is routed with a single walk over its first words no matter how
+many commands are registered, and unambiguous abbreviations come for
+free.
+"""
+import inspect
+import re
+import time
+
+import utopia.parsing
+from utopia import signals
+
+# Double quoted (with backslash escapes) or bare words.
+_WORD = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)', re.UNICODE)
+_ESCAPE = re.compile(r'\\(.)')
+
+
+class CommandError(Exception):
+    """
+    Raised by handlers (or the router itself) to report a problem to the
+    user, see `on_command_error`.
+    """
+    pass
+
+
+class CommandCooldown(CommandError):
+    def __init__(self, message, remaining):
+        CommandError.__init__(self, message)
+        #: Seconds left until the command may be used again.
+        self.remaining = remaining
+
+
+def split_args(text):
+    """
+    Splits `text` into words, treating double quoted strings as a single
+    word. Returns a list of (word, start offset) tuples.
+    """
+    words = []
+    for match in _WORD.finditer(text):
+        quoted, bare = match.groups()
+        if bare is None:
+            bare = _ESCAPE.sub(r'\1', quoted)
+        words.append((bare, match.start()))
+    return words
+
+
+def _required_args(func):
+    try:
+        spec = inspect.getfullargspec(func)
+    except AttributeError:
+        spec = inspect.getargspec(func)
+
+    # Everything but the invocation (and self, for bound methods).
+    names = spec.args[1:]
+    if inspect.ismethod(func):
+        names = names[1:]
+    return len(names) - len(spec.defaults or ())
+
+
+class _Node(object):
+    __slots__ = ('children', 'command', 'below')
+
+    def __init__(self):
+        self.children = {}
+        #: The command named by the path to this node, if any.
+        self.command = None
+        #: Maps every command named below this node to the number of its
+        #: names (including aliases) there.
+        self.below = {}
+
+
+class _Trie(object):
+    __slots__ = ('root',)
+
+    def __init__(self):
+        self.root = _Node()
+
+    def __bool__(self):
+        return bool(self.root.below)
+    __nonzero__ = __bool__
+
+    def insert(self, name, command):
+        node = self.root
+        path = [node]
+        for char in name:
+            node = node.children.setdefault(char, _Node())
+            path.append(node)
+
+        if node.command is not None:
+            raise ValueError('{0!r} is already registered.'.format(name))
+        node.command = command
+
+        for node in path:
+            node.below[command] = node.below.get(command, 0) + 1
+
+    def delete(self, name):
+        node = self.root
+        path = [(None, node)]
+        for char in name:
+            node = node.children[char]
+            path.append((char, node))
+
+        command, node.command = node.command, None
+        for i, (char, node) in enumerate(path):
+            node.below[command] -= 1
+            if not node.below[command]:
+                del node.below[command]
+            if not node.below and i:
+                # Nothing left further down.
+                del path[i - 1][1].children[char]
+                break
+
+    def walk(self, text, start):
+        """
+        Follows the word starting at `start` in `text`. Returns the node
+        reached (or None) and the offset just past the word.
+        """
+        node = self.root
+        end = len(text)
+        i = start
+        while i < end and not text[i].isspace():
+            if node is not None:
+                node = node.children.get(text[i].lower())
+            i += 1
+        return node, i
+
+
+class Command(object):
+    __slots__ = ('name', 'func', 'aliases', 'args', 'required', 'cooldown',
+                 'per', 'help', 'subcommands')
+
+    def __init__(self, name, func=None, aliases=(), args=None,
+                 cooldown=None, per='user', help=None):
+        self.name = name
+        self.func = func
+        self.aliases = tuple(aliases)
+        self.args = args
+        self.required = None
+        self.cooldown = cooldown
+        self.per = per
+        self.help = help or (func.__doc__ if func else None)
+        self.subcommands = _Trie()
+
+        if args is not None:
+            self.required = min(_required_args(func), len(args))
+
+    def __repr__(self):
+        return '<Command {0!r}>'.format(self.name)
+
+
+class Invocation(object):
+    """
+    Passed to handlers as their first argument.
+    """
+    __slots__ = ('client', 'prefix', 'target', 'channel', 'command', 'args',
+                 'text')
+
+    def __init__(self, client, prefix, target, channel, command, args,
+                 text):
+        self.client = client
+        self.prefix = prefix
+        #: Where the command was sent, a channel or the client's nick.
+        self.target = target
+        #: The channel the command was used in, or None.
+        self.channel = channel
+        self.command = command
+        #: The words following the command.
+        self.args = args
+        #: Everything following the command, unsplit.
+        self.text = text
+
+    @property
+    def reply_to(self):
+        return self.channel or self.prefix.nick
+
+    def reply(self, text):
+        self.client.send('PRIVMSG', self.reply_to, text)
+
+
+class CommandRouter(object):
+    commands = ('005', 'PRIVMSG')
+
+    def __init__(self, prefix='!', abbreviations=True, private=True):
+        """
+        A plugin dispatching commands in messages starting with `prefix`
+        to handlers registered with `command` or `add`. Works with
+        `ProtocolPlugin` and `EasyProtocolPlugin` alike.
+
+        Handlers are called as ``func(invocation, *args)``. Handlers can
+        raise `CommandError`, which is sent as `on_command_error` along
+        with argument and cooldown errors.
+
+        :param prefix: The string commands start with.
+        :param abbreviations: If True, any prefix of a name that only one
+                              command starts with invokes that command.
+        :param private: If True, commands may also be sent in private
+                        messages, without the prefix.
+        """
+        self.prefix = prefix
+        self.abbreviations = abbreviations
+        self.private = private
+        self.chantypes = '!&#+'
+
+        self._trie = _Trie()
+        self._commands = {}
+        # Maps (command, user or channel) to when it was last used.
+        self._last_used = {}
+
+    def bind(self, client):
+        signals.m.on_PRIVMSG.connect(self.on_privmsg, sender=client)
+        signals.m.on_PUBMSG.connect(self.on_privmsg, sender=client)
+        signals.m.on_005.connect(self.on_005, sender=client)
+
+        return self
+
+    def __contains__(self, name):
+        return name.lower() in self._commands
+
+    def __getitem__(self, name):
+        return self._commands[name.lower()]
+
+    def add(self, name, func=None, aliases=(), args=None, cooldown=None,
+            per='user', help=None):
+        """
+        Registers a command.
+
+        :param name: The command's name. Subcommands are named after
+                     their parent, such as 'config set'. Parents without
+                     a handler of their own are created as needed.
+        :param func: The handler.
+        :param aliases: Alternative names, at the same level.
+        :param args: If provided, a sequence of callables converting
+                     each word following the command (such as `int`),
+                     passed to `func` as positional arguments. The last
+                     one receives the rest of the message when there are
+                     more words. Otherwise only `invocation.args` is set.
+        :param cooldown: If set, seconds before the command can be used
+                         again.
+        :param per: What the cooldown applies to, 'user', 'channel' or
+                    'global'.
+        """
+        names = name.lower().split()
+        if not names:
+            raise ValueError('Command names may not be empty.')
+
+        key = ' '.join(names)
+        command = self._commands.get(key)
+        if command is not None and command.func is not None:
+            raise ValueError('{0!r} is already registered.'.format(name))
+
+        new = Command(key, func, aliases, args, cooldown, per, help)
+        trie = self._parent(names[:-1])
+        if command is None:
+            trie.insert(names[-1], new)
+        else:
+            # Replace the placeholder created for a subcommand.
+            new.subcommands = command.subcommands
+            trie.delete(names[-1])
+            trie.insert(names[-1], new)
+
+        for alias in new.aliases:
+            trie.insert(alias.lower(), new)
+
+        self._commands[key] = new
+        return new
+
+    def _parent(self, names):
+        trie = self._trie
+        for i in range(len(names)):
+            key = ' '.join(names[:i + 1])
+            command = self._commands.get(key)
+            if command is None:
+                command = self._commands[key] = Command(key)
+                trie.insert(names[i], command)
+            trie = command.subcommands
+        return trie
+
+    def remove(self, name):
+        """
+        Removes a command, along with its aliases and subcommands.
+        """
+        names = name.lower().split()
+        key = ' '.join(names)
+        command = self._commands.pop(key)
+
+        trie = self._trie
+        for i in range(len(names) - 1):
+            trie = self._commands[' '.join(names[:i + 1])].subcommands
+        for alias in (names[-1],) + command.aliases:
+            trie.delete(alias.lower())
+
+        for other in list(self._commands):
+            if other.startswith(key + ' '):
+                del self._commands[other]
+
+    def command(self, name, **kwargs):
+        """
+        A decorator registering the decorated function as a command. See
+        `add`.
+        """
+        def decorator(func):
+            self.add(name, func, **kwargs)
+            return func
+        return decorator
+
+    def on_005(self, client, prefix, target, args):
+        chantypes = utopia.parsing.unpack_005(args)[1].get('CHANTYPES')
+        if chantypes:
+            self.chantypes = ''.join(chantypes)
+
+    def on_privmsg(self, client, prefix, target, args):
+        if prefix is None or not args or not self._trie:
+            return
+
+        text = args[-1]
+        channel = None
+        if utopia.parsing.is_channel(target, self.chantypes):
+            channel = target
+
+        if text.startswith(self.prefix):
+            start = len(self.prefix)
+        elif channel is None and self.private:
+            start = 0
+        else:
+            return
+
+        self.route(client, prefix, target, channel, text, start)
+
+    def route(self, client, prefix, target, channel, text, start=0):
+        """
+        Finds and invokes the command at `start` in `text`. Returns the
+        command, or None if there wasn't one.
+        """
+        command = None
+        trie = self._trie
+        end = start
+        while trie:
+            node, word_end = trie.walk(text, start)
+            if node is None or word_end == start:
+                break
+
+            found = node.command
+            if found is None and len(node.below) == 1 and \
+                    self.abbreviations:
+                found = next(iter(node.below))
+            if found is None:
+                if command is None and len(node.below) > 1 and \
+                        self.abbreviations:
+                    self._error(client, Invocation(
+                        client, prefix, target, channel, None, [], u''
+                    ), CommandError('Ambiguous command, did you mean {0}?'
+                                    .format(', '.join(sorted(
+                                        c.name for c in node.below)))))
+                break
+
+            command, end = found, word_end
+            trie = command.subcommands
+            start = end
+            while start < len(text) and text[start].isspace():
+                start += 1
+
+        if command is None:
+            return None
+
+        rest = text[end:].strip()
+        words = split_args(rest)
+        invocation = Invocation(
+            client, prefix, target, channel, command,
+            [word for word, _ in words], rest
+        )
+
+        try:
+            if command.func is None:
+                raise CommandError('Usage: {0} <{1}>'.format(
+                    command.name,
+                    '|'.join(sorted(c.name.split()[-1]
+                                    for c in command.subcommands.root.below))
+                ))
+            # A usage error doesn't count as a use.
+            values = self._convert(command, rest, words)
+            self._check_cooldown(invocation)
+            command.func(invocation, *values)
+        except CommandError as e:
+            self._error(client, invocation, e)
+
+        return command
+
+    def _convert(self, command, rest, words):
+        if command.args is None:
+            return ()
+
+        count = len(command.args)
+        if len(words) < command.required:
+            raise CommandError('Usage: {0} expects at least {1} '
+                               'argument(s).'.format(command.name,
+                                                     command.required))
+        if len(words) > count:
+            # The last argument receives the rest of the message.
+            words = words[:count - 1] + [(rest[words[count - 1][1]:], 0)]
+
+        values = []
+        for convert, (word, _) in zip(command.args, words):
+            try:
+                values.append(convert(word))
+            except ValueError:
+                raise CommandError('Invalid argument {0!r} for {1}.'.format(
+                    word, command.name))
+        return values
+
+    def _check_cooldown(self, invocation):
+        command = invocation.command
+        if not command.cooldown:
+            return
+
+        if command.per == 'channel':
+            key = (command, invocation.reply_to.lower())
+        elif command.per == 'global':
+            key = (command, None)
+        else:
+            key = (command, invocation.prefix.nick.lower())
+
+        now = time.time()
+        remaining = self._last_used.get(key, 0) + command.cooldown - now
+        if remaining > 0:
+            raise CommandCooldown(
+                '{0} can be used again in {1:.0f}s.'.format(
+                    command.name, remaining),
+                remaining
+            )
+
+        self._last_used[key] = now
+        if len(self._last_used) > 1024:
+            self._expire(now)
+
+    def _expire(self, now):
+        for key, used in list(self._last_used.items()):
+            if used + key[0].cooldown <= now:
+                del self._last_used[key]
+
+    def _error(self, client, invocation, error):
+        signals.on_command_error.send(
+            client,
+            invocation=invocation,
+            error=error
+        )
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Tracks what a client has learned about the server and its channels, and
+saves it so a restarted client can pick up where it left off.
+"""
+import json
+import os
+import zlib
+
+import utopia.parsing
+from utopia import signals
+
+#: Bumped whenever the snapshot layout changes. Older snapshots are
+#: ignored.
+SNAPSHOT_VERSION = 1
+
+# The fewest parameters each handled message needs. Messages with fewer
+# (or without a prefix, for those sent by users) are ignored.
+_MIN_ARGS = {
+    '001': 1, '005': 0, 'JOIN': 1, 'PART': 1, 'KICK': 2, 'QUIT': 0,
+    'NICK': 1, 'MODE': 1, 'TOPIC': 1, '324': 3, '331': 2, '332': 3,
+    '353': 4, '366': 2
+}
+_FROM_USER = ('JOIN', 'PART', 'QUIT', 'NICK')
+
+
+class Channel(object):
+    __slots__ = ('name', 'topic', 'modes', 'users', 'provisional')
+
+    def __init__(self, name, topic=None, modes=None, users=None,
+                 provisional=False):
+        self.name = name
+        self.topic = topic
+        #: Maps channel modes (excluding lists such as bans) to their
+        #: parameter, or None.
+        self.modes = modes if modes is not None else {}
+        #: Maps nicks to their status prefixes (such as '@').
+        self.users = users if users is not None else {}
+        #: True while the channel was loaded from a snapshot and hasn't
+        #: been confirmed by the server yet.
+        self.provisional = provisional
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'topic': self.topic,
+            'modes': self.modes,
+            'users': self.users
+        }
+
+
+class StatePlugin(object):
+    commands = ('001', '005', 'JOIN', 'PART', 'KICK', 'QUIT', 'NICK',
+                'MODE', 'TOPIC', '324', '331', '332', '353', '366')
+
+    def __init__(self, path=None, rejoin=True):
+        """
+        A plugin tracking ISUPPORT and the channels the client is in,
+        along with their topics, modes and users.
+
+        :param path: If provided, the state is loaded from this file
+                     (if it exists) and saved to it on disconnect.
+        :param rejoin: If True, channels loaded from a snapshot are joined
+                       again once registered. Their modes are only
+                       queried if the snapshot didn't have any; topics
+                       and names are sent by the server on join anyway.
+        """
+        self.path = path
+        self.rejoin = rejoin
+
+        self.nick = None
+        self.isupport = (set(), dict())
+        #: Maps lower cased channel names to `Channel` objects.
+        self.channels = {}
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def bind(self, client):
+        self.nick = self.nick or client.identity.nick
+        signals.on_message.connect(self.have_message, sender=client)
+        if self.path is not None:
+            signals.on_disconnect.connect(
+                self.have_disconnected,
+                sender=client
+            )
+
+        # Let other plugins start from the restored ISUPPORT.
+        for plugin in getattr(client, '_plugins', ()):
+            isupport = getattr(plugin, 'isupport', None)
+            if isinstance(isupport, tuple) and isupport is not self.isupport:
+                isupport[0].update(self.isupport[0])
+                isupport[1].update(self.isupport[1])
+
+        return self
+
+    def __getitem__(self, channel):
+        return self.channels[channel.lower()]
+
+    @property
+    def provisional(self):
+        """
+        The names of channels that haven't been confirmed by the server
+        since they were loaded.
+        """
+        return [c.name for c in self.channels.values() if c.provisional]
+
+    def save(self, path=None):
+        """
+        Writes a compressed snapshot of the current state to `path`
+        (defaults to the path given on creation), replacing it
+        atomically.
+        """
+        path = path or self.path
+        data = zlib.compress(json.dumps({
+            'version': SNAPSHOT_VERSION,
+            'nick': self.nick,
+            'isupport': [sorted(self.isupport[0]), self.isupport[1]],
+            'channels': [c.to_dict() for c in self.channels.values()]
+        }, separators=(',', ':')).encode('utf-8'))
+
+        with open(path + '.tmp', 'wb') as fout:
+            fout.write(data)
+        os.rename(path + '.tmp', path)
+
+    def load(self, path=None):
+        """
+        Replaces the current state with the snapshot in `path`. Every
+        loaded channel is provisional until the server confirms it.
+        """
+        with open(path or self.path, 'rb') as fin:
+            snapshot = json.loads(zlib.decompress(fin.read()).decode('utf-8'))
+
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            return
+
+        self.nick = snapshot['nick']
+        rest, params = snapshot['isupport']
+        # JSON turned the tuples unpack_005 returns into lists.
+        self.isupport[0].update(rest)
+        self.isupport[1].update(
+            (k, tuple(v) if isinstance(v, list) else v)
+            for k, v in params.items()
+        )
+
+        self.channels = dict(
+            (c['name'].lower(), Channel(provisional=True, **c))
+            for c in snapshot['channels']
+        )
+
+    def have_disconnected(self, client):
+        self.save()
+
+    def have_message(self, client, message):
+        command = message.command
+        handler = getattr(self, '_on_' + command, None)
+        if handler is None or len(message.args) < _MIN_ARGS[command]:
+            return
+        if message.prefix is None and command in _FROM_USER:
+            return
+
+        handler(client, message.prefix, message.args)
+
+    def _is_me(self, nick):
+        casemapping = self.isupport[1].get('CASEMAPPING', 'rfc1459')
+        return self.nick is not None and (
+            utopia.parsing.irc_lower(nick, casemapping) ==
+            utopia.parsing.irc_lower(self.nick, casemapping)
+        )
+
+    def _channel(self, name):
+        key = name.lower()
+        channel = self.channels.get(key)
+        if channel is None:
+            channel = self.channels[key] = Channel(name)
+        return channel
+
+    def _prefixes(self):
+        return self.isupport[1].get('PREFIX') or {'o': '@', 'v': '+'}
+
+    def _on_001(self, client, prefix, args):
+        self.nick = args[0]
+
+        # A new connection, nothing is confirmed any more.
+        for channel in self.channels.values():
+            channel.provisional = True
+
+        if self.rejoin and self.channels:
+            # Keys are matched to channels by position, so keyed
+            # channels go first.
+            channels = sorted(
+                self.channels.values(),
+                key=lambda c: (not c.modes.get('k'), c.name)
+            )
+            for i in range(0, len(channels), 10):
+                batch = channels[i:i + 10]
+                keys = [c.modes['k'] for c in batch if c.modes.get('k')]
+                client.send(
+                    'JOIN',
+                    u','.join(c.name for c in batch),
+                    *([u','.join(keys)] if keys else [])
+                )
+            for channel in self.channels.values():
+                if not channel.modes:
+                    client.send('MODE', channel.name)
+
+    def _on_005(self, client, prefix, args):
+        rest, params = utopia.parsing.unpack_005(args)
+        self.isupport[0].update(rest)
+        self.isupport[1].update(params)
+
+    def _on_JOIN(self, client, prefix, args):
+        channel = self._channel(args[0])
+        if self._is_me(prefix.nick):
+            channel.users.clear()
+        channel.users[prefix.nick] = ''
+
+    def _on_PART(self, client, prefix, args):
+        if self._is_me(prefix.nick):
+            self.channels.pop(args[0].lower(), None)
+        else:
+            self._channel(args[0]).users.pop(prefix.nick, None)
+
+    def _on_KICK(self, client, prefix, args):
+        if self._is_me(args[1]):
+            self.channels.pop(args[0].lower(), None)
+        else:
+            self._channel(args[0]).users.pop(args[1], None)
+
+    def _on_QUIT(self, client, prefix, args):
+        for channel in self.channels.values():
+            channel.users.pop(prefix.nick, None)
+
+    def _on_NICK(self, client, prefix, args):
+        if self._is_me(prefix.nick):
+            self.nick = args[0]
+
+        for channel in self.channels.values():
+            if prefix.nick in channel.users:
+                channel.users[args[0]] = channel.users.pop(prefix.nick)
+
+    def _on_TOPIC(self, client, prefix, args):
+        self._channel(args[0]).topic = args[1] if len(args) > 1 else None
+
+    def _on_331(self, client, prefix, args):
+        self._channel(args[1]).topic = None
+
+    def _on_332(self, client, prefix, args):
+        self._channel(args[1]).topic = args[2]
+
+    def _on_353(self, client, prefix, args):
+        channel = self._channel(args[2])
+        symbols = ''.join(self._prefixes().values())
+        for nick in args[3].split():
+            stripped = nick.lstrip(symbols)
+            channel.users[stripped] = nick[:len(nick) - len(stripped)]
+
+    def _on_366(self, client, prefix, args):
+        channel = self.channels.get(args[1].lower())
+        if channel is not None:
+            channel.provisional = False
+
+    def _on_324(self, client, prefix, args):
+        channel = self._channel(args[1])
+        channel.modes.clear()
+        self._apply_modes(channel, args[2], args[3:])
+
+    def _on_MODE(self, client, prefix, args):
+        chantypes = self.isupport[1].get('CHANTYPES', '#&!+')
+        if utopia.parsing.is_channel(args[0], chantypes) and len(args) > 1:
+            self._apply_modes(self._channel(args[0]), args[1], args[2:])
+
+    def _apply_modes(self, channel, modes, params):
+        """
+        Applies a mode string such as '+ol-k nick 10 key' to `channel`.
+        """
+        prefixes = self._prefixes()
+        chanmodes = self.isupport[1].get('CHANMODES') or ('b', 'k', 'l')
+        lists, always, when_set = [
+            str(kind) for kind in (tuple(chanmodes) + ('',) * 3)[:3]
+        ]
+
+        params = list(params)
+        adding = True
+        for mode in modes:
+            if mode in '+-':
+                adding = mode == '+'
+            elif mode in prefixes:
+                nick = params.pop(0) if params else None
+                status = channel.users.get(nick)
+                if status is None:
+                    continue
+                symbol = prefixes[mode]
+                if adding and symbol not in status:
+                    channel.users[nick] = status + symbol
+                elif not adding:
+                    channel.users[nick] = status.replace(symbol, '')
+            elif mode in lists:
+                # Bans and the like aren't tracked.
+                if params:
+                    params.pop(0)
+            elif mode in always or (adding and mode in when_set):
+                param = params.pop(0) if params else None
+                if adding:
+                    channel.modes[mode] = param
+                else:
+                    channel.modes.pop(mode, None)
+            elif adding:
+                channel.modes[mode] = None
+            else:
+                channel.modes.pop(mode, None)
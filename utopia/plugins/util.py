@@ -3,51 +3,229 @@
 Utility plugins, typically used for debugging and tests.
 """
 import logging
+import mmap
+import os
+import random
+import struct
+import time
+from collections import defaultdict, deque
+
+import gevent
+import gevent.threadpool
 
 from utopia import signals
 
+#: A single record in a RecPlugin index file, the time the line was
+#: received and the offset of the line in the log.
+INDEX_RECORD = struct.Struct('<dQ')
+
 
 class RecPlugin(object):
-    def __init__(self, terminate_on=None):
+    def __init__(self, terminate_on=None, maxlen=1024, path=None):
         """
         A utility plugin to log messages that occur during a clients lifetime.
 
         :param terminate_on: An iterable of commands that will cause the
                              client to terminate when received.
+        :param maxlen: The number of messages kept in `received`. Older
+                       messages are dropped. If None, nothing is dropped.
+        :param path: If provided, every raw line is also appended to this
+                     file, along with a timestamp index at `path + '.idx'`.
+                     Use `RecordedLog` to read or replay it.
         """
         self.terminate_on = terminate_on or tuple()
-        self.received = []
+        self.received = deque(maxlen=maxlen)
+        # Number of times each command has been received, including
+        # messages that have since fallen out of `received`.
+        self.counts = defaultdict(int)
+        self.path = path
+
+        self._log = None
+        self._index = None
+        self._offset = 0
 
     def bind(self, client):
         signals.on_raw_message.connect(
             self.have_raw_message,
             sender=client
         )
+
+        if self.path is not None:
+            self._log = open(self.path, 'ab')
+            self._index = open(self.path + '.idx', 'ab')
+            self._offset = os.path.getsize(self.path)
+
+            signals.on_raw_line.connect(self.have_raw_line, sender=client)
+            signals.on_disconnect.connect(
+                self.have_disconnected,
+                sender=client
+            )
+
         return self
 
+    def have_raw_line(self, client, line):
+        data = line.encode('utf-8') + b'\r\n'
+        self._index.write(INDEX_RECORD.pack(time.time(), self._offset))
+        self._log.write(data)
+        self._offset += len(data)
+
     def have_raw_message(self, client, prefix, command, args):
         self.received.append((prefix, command, args))
+        self.counts[command] += 1
 
         if command in self.terminate_on:
             client.terminate()
 
+    def have_disconnected(self, client):
+        self.flush()
+
     def did_receive(self, command):
-        for prefix, command_recv, args in self.received:
-            if command_recv == command:
-                return True
-        return False
+        return self.counts.get(command, 0) > 0
+
+    def flush(self):
+        if self._log is not None:
+            self._log.flush()
+            self._index.flush()
+
+    def close(self):
+        """
+        Closes the on-disk log, if any.
+        """
+        if self._log is not None:
+            self._log.close()
+            self._index.close()
+            self._log = self._index = None
+
+
+def _map(path):
+    with open(path, 'rb') as fin:
+        if not os.fstat(fin.fileno()).st_size:
+            return b''
+        return mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class RecordedLog(object):
+    def __init__(self, path):
+        """
+        Read-only, memory-mapped access to a log written by `RecPlugin`.
+
+        :param path: The path the `RecPlugin` was given.
+        """
+        self._log = _map(path)
+        self._index = _map(path + '.idx')
+
+    def __len__(self):
+        return len(self._index) // INDEX_RECORD.size
+
+    def __getitem__(self, i):
+        """
+        Returns a (timestamp, line) tuple for the `i`th recorded line.
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+
+        timestamp, start = INDEX_RECORD.unpack_from(
+            self._index, i * INDEX_RECORD.size
+        )
+        if i + 1 < len(self):
+            end = INDEX_RECORD.unpack_from(
+                self._index, (i + 1) * INDEX_RECORD.size
+            )[1]
+        else:
+            end = len(self._log)
+
+        return timestamp, self._log[start:end - 2].decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def find(self, timestamp):
+        """
+        Returns the position of the first line recorded at or after
+        `timestamp`.
+        """
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found = INDEX_RECORD.unpack_from(
+                self._index, mid * INDEX_RECORD.size
+            )[0]
+            if found < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def replay(self, client, realtime=False, speed=1.0, start=None,
+               end=None):
+        """
+        Feeds recorded lines back through `client.process_line`, parsing
+        and dispatching them as if they had just been received.
+
+        :param client: The client to dispatch on.
+        :param realtime: If True, sleep between lines to reproduce the
+                         original timing. Otherwise replay as fast as
+                         possible.
+        :param speed: Playback speed multiplier when `realtime` is True.
+        :param start: Only replay lines recorded at or after this time.
+        :param end: Only replay lines recorded before this time.
+        :returns: The number of lines replayed.
+        """
+        first = 0 if start is None else self.find(start)
+        last = len(self) if end is None else self.find(end)
+
+        began = time.time()
+        origin = None
+        for i in range(first, last):
+            timestamp, line = self[i]
+
+            if realtime:
+                if origin is None:
+                    origin = timestamp
+                delay = (timestamp - origin) / speed - (time.time() - began)
+                if delay > 0:
+                    gevent.sleep(delay)
+            elif not i % 1000:
+                # Give the dispatch greenlets a chance to run.
+                gevent.sleep(0)
+
+            client.process_line(line)
+
+        return last - first
+
+    def close(self):
+        for mapped in (self._log, self._index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
 
 
 class LogPlugin(object):
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, level=logging.DEBUG, commands=None,
+                 ignore=None, sample=None):
         """
         A utility plugin to log all messages as they're recieved by the
         client.
 
+        Messages are only formatted if the logger would actually emit
+        them. To keep slow handlers off the hub, attach a
+        `BatchingHandler` to the logger.
+
         :param logger: A logger to send debugging messages to. If None is
                        specified, the 'LogPlugin' logger will be used instead.
+        :param level: The level messages are logged at.
+        :param commands: If provided, only these commands are logged.
+        :param ignore: An iterable of commands that are never logged.
+        :param sample: If provided, only this fraction (0.0 to 1.0) of
+                       messages is logged, chosen at random.
         """
         self.logger = logger or logging.getLogger('LogPlugin')
+        self.level = level
+        self.commands = frozenset(commands) if commands is not None else None
+        self.ignore = frozenset(ignore or ())
+        self.sample = sample
 
     def bind(self, client):
         signals.on_raw_message.connect(
@@ -57,11 +235,125 @@ class LogPlugin(object):
         return self
 
     def have_raw_message(self, client, prefix, command, args):
-        self.logger.debug(
-            '{client.host}: ({prefix}) {command} {args}'.format(
-                client=client,
-                prefix=prefix,
-                command=command,
-                args=args
-            )
+        if not self.logger.isEnabledFor(self.level):
+            return
+
+        if self.commands is not None and command not in self.commands:
+            return
+
+        if command in self.ignore:
+            return
+
+        if self.sample is not None and random.random() >= self.sample:
+            return
+
+        self.logger.log(
+            self.level,
+            '%s: (%s) %s %s',
+            client.host,
+            prefix,
+            command,
+            args
         )
+
+
+class BatchingHandler(logging.Handler):
+    def __init__(self, target, interval=1.0, capacity=1000):
+        """
+        A logging handler that buffers records and passes them on to
+        `target` in batches from a dedicated background thread, so slow
+        handlers (files, sockets, syslog) never block the hub.
+
+        Records may be logged from any thread. Batches are scheduled on
+        the hub of the thread that created the handler.
+
+        :param target: The `logging.Handler` that does the actual writing.
+        :param interval: Maximum number of seconds a record is buffered.
+        :param capacity: Flush immediately once this many records are
+                         buffered.
+        """
+        logging.Handler.__init__(self)
+        self.target = target
+        self.interval = interval
+        self.capacity = capacity
+
+        self._buffer = deque()
+        self._flusher = None
+        # True while a call to _schedule is waiting to run on the hub.
+        self._requested = False
+        self._closed = False
+        self._loop = gevent.get_hub().loop
+        # A single thread keeps batches in order.
+        self._pool = gevent.threadpool.ThreadPool(1)
+
+    def prepare(self, record):
+        # Format now, since the arguments (such as a message's args list)
+        # may be modified by the time the record is written.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Tracebacks can't be kept around, but their text can.
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info
+            )
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        # Called with the handler's lock held, but maybe not on the hub's
+        # thread, so greenlets are only ever started from _schedule.
+        self._buffer.append(self.prepare(record))
+
+        if self._requested:
+            return
+        if self._flusher is None or len(self._buffer) >= self.capacity:
+            self._requested = True
+            self._loop.run_callback_threadsafe(self._schedule)
+
+    def _schedule(self):
+        self._requested = False
+        if self._closed:
+            return
+        if len(self._buffer) >= self.capacity:
+            self.flush()
+        elif self._buffer and self._flusher is None:
+            self._flusher = gevent.spawn_later(
+                self.interval,
+                self._scheduled_flush
+            )
+
+    def _scheduled_flush(self):
+        self._flusher = None
+        self.flush()
+
+    def flush(self):
+        """
+        Passes the buffered records on to the background thread. Must be
+        called on the hub's thread.
+        """
+        buffer = self._buffer
+        if not buffer:
+            return
+
+        # Other threads may append meanwhile, take only what's there.
+        batch = [buffer.popleft() for _ in range(len(buffer))]
+        self._pool.spawn(self._write, batch)
+
+    def _write(self, batch):
+        for record in batch:
+            self.target.handle(record)
+        self.target.flush()
+
+    def close(self):
+        """
+        Flushes any buffered records and waits for them to be written.
+        The target handler is left open.
+        """
+        self._closed = True
+        if self._flusher is not None:
+            self._flusher.kill()
+            self._flusher = None
+        self.flush()
+        self._pool.join()
+        self._pool.kill()
+        logging.Handler.close(self)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Spreads outgoing messages over a pool of connections.
+
+Servers throttle each connection separately, so sending through several
+connections multiplies the throughput available to a single process.
+"""
+import logging
+
+import gevent
+import gevent.pool
+import gevent.queue
+
+import utopia.parsing
+from utopia import signals
+from utopia.ratelimit import TokenBucket
+
+logger = logging.getLogger('utopia.pool')
+
+
+class _Member(object):
+    def __init__(self, client, rate, burst):
+        self.client = client
+        self.bucket = TokenBucket(rate, burst)
+        self.queue = gevent.queue.Queue()
+        # Lines queued but not yet sent.
+        self.backlog = 0
+        self.connected = True
+
+    @property
+    def budget(self):
+        """
+        The flood control budget left once the backlog has been sent.
+        """
+        return self.bucket.tokens - self.backlog
+
+
+class SenderPool(object):
+    def __init__(self, clients, rate=1.0, burst=5, chantypes='!&#+'):
+        """
+        Sends messages through whichever connection in `clients` is in
+        the target channel and has the most flood control budget left.
+
+        Lines for a target are kept in order by sending them all on one
+        connection for as long as any of them are still queued. Spreading
+        happens across targets, so a single busy target is limited to
+        one connection's rate.
+
+        :param clients: The clients to send through. They keep doing
+                        their own reading, and should already be (or
+                        become) members of the channels sent to.
+        :param rate: Lines per second each connection may send.
+        :param burst: Lines each connection may send in a burst.
+        :param chantypes: Prefixes of channel names.
+        """
+        self.chantypes = chantypes
+        self.members = [_Member(c, rate, burst) for c in clients]
+
+        #: Maps lowercased channel names to the members that joined them.
+        self.channels = {}
+
+        # Maps targets to [member, queued lines] while lines are queued.
+        self._pinned = {}
+        self._workers = gevent.pool.Group()
+        # Receivers are kept alive here, signals only hold weak references.
+        self._receivers = []
+
+        for member in self.members:
+            self._watch(member)
+            self._workers.spawn(self._send_loop, member)
+
+    def _watch(self, member):
+        def on_message(client, message):
+            self._track(member, message)
+
+        def on_connect(client):
+            member.connected = True
+
+        def on_disconnect(client):
+            member.connected = False
+            for members in self.channels.values():
+                members.discard(member)
+
+        self._receivers.extend((on_message, on_connect, on_disconnect))
+        signals.on_message.connect(on_message, sender=member.client)
+        signals.on_connect.connect(on_connect, sender=member.client)
+        signals.on_disconnect.connect(on_disconnect, sender=member.client)
+
+    def _track(self, member, message):
+        command, args = message.command, message.args
+        nick = member.client.identity.nick
+
+        if command == 'KICK':
+            if len(args) > 1 and args[1] == nick:
+                self.channels.get(args[0].lower(), set()).discard(member)
+        elif command in ('JOIN', 'PART'):
+            if message.prefix is None or message.prefix[0] != nick:
+                return
+
+            channel = args[0].lower()
+            if command == 'JOIN':
+                self.channels.setdefault(channel, set()).add(member)
+            else:
+                self.channels.get(channel, set()).discard(member)
+
+    def route(self, target):
+        """
+        Returns the client the next message to `target` would be sent
+        through.
+
+        :raises ValueError: If no connection can send to `target`.
+        """
+        return self._route(target).client
+
+    def _route(self, target):
+        key = target.lower()
+        pinned = self._pinned.get(key)
+        if pinned is not None:
+            return pinned[0]
+
+        if utopia.parsing.is_channel(target, self.chantypes):
+            candidates = self.channels.get(key)
+        else:
+            candidates = [m for m in self.members if m.connected]
+
+        if not candidates:
+            raise ValueError('No connection can send to {0}'.format(target))
+
+        return max(candidates, key=lambda m: m.budget)
+
+    def send(self, target, command, *args):
+        """
+        Queues a message whose first argument is `target`.
+        """
+        self._queue(target, [(command, (target,) + args)])
+
+    def privmsg(self, target, text):
+        """
+        Sends a PRIVMSG, split the same way as `ProtocolClient.privmsg`.
+        """
+        self._queue(target, [
+            ('PRIVMSG', (target, line))
+            for line in utopia.parsing.ssplit(text, 420)
+        ])
+
+    def notice(self, target, text):
+        """
+        Sends a NOTICE, split the same way as `ProtocolClient.notice`.
+        """
+        self._queue(target, [
+            ('NOTICE', (target, line))
+            for line in utopia.parsing.ssplit(text, 420)
+        ])
+
+    def _queue(self, target, messages):
+        if not messages:
+            return
+
+        # Raise invalid messages here rather than in the send loop.
+        for command, args in messages:
+            utopia.parsing.pack_message(command, args)
+
+        member = self._route(target)
+        key = target.lower()
+        pinned = self._pinned.setdefault(key, [member, 0])
+        pinned[1] += len(messages)
+
+        member.backlog += len(messages)
+        member.queue.put((key, messages))
+
+    def _send_loop(self, member):
+        while True:
+            key, messages = member.queue.get()
+            for command, args in messages:
+                member.bucket.wait()
+                member.backlog -= 1
+                try:
+                    member.client.send(command, *args)
+                except Exception:
+                    logger.exception('Sending %s to %s failed.', command,
+                                     key)
+
+            pinned = self._pinned[key]
+            pinned[1] -= len(messages)
+            if not pinned[1]:
+                del self._pinned[key]
+
+    def close(self):
+        """
+        Stops sending. Lines still queued are dropped.
+        """
+        self._workers.kill()
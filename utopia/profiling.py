@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in profiling of signal dispatch.
+
+While a :class:`DispatchProfiler` is installed, every signal sent through
+:mod:`utopia.signals` is timed per receiver. Receivers that run past a
+threshold are flagged as slow and, where gevent's hub monitoring is
+available, receivers that were active while the monitor thread saw the
+hub blocked are flagged as blocking.
+"""
+import logging
+import sys
+import time
+from collections import defaultdict
+
+import gevent
+
+from utopia import signals
+
+try:
+    from gevent.events import EventLoopBlocked, subscribers
+except ImportError:
+    # Hub monitoring was added in gevent 1.3.
+    EventLoopBlocked = subscribers = None
+
+
+logger = logging.getLogger('utopia.profiling')
+
+
+def qualname(receiver):
+    """
+    Returns a dotted, human readable name for a signal receiver, such as
+    ``utopia.plugins.protocol.ProtocolPlugin.on_raw``.
+    """
+    name = getattr(receiver, '__qualname__', None)
+    if name is None:
+        name = getattr(receiver, '__name__', None)
+        owner = getattr(receiver, '__self__', None)
+        if name is None:
+            name = type(receiver).__name__
+        elif owner is not None:
+            if not isinstance(owner, type):
+                owner = type(owner)
+            name = '{0}.{1}'.format(owner.__name__, name)
+
+    module = getattr(receiver, '__module__', None)
+    if module:
+        return '{0}.{1}'.format(module, name)
+    return name
+
+
+class ReceiverStats(object):
+    __slots__ = ('calls', 'total', 'max', 'slow', 'blocked')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.blocked = 0
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'total': self.total,
+            'max': self.max,
+            'slow': self.slow,
+            'blocked': self.blocked
+        }
+
+
+class DispatchProfiler(object):
+    def __init__(self, threshold=0.1, monitor=True):
+        """
+        Records per-receiver call counts, cumulative and maximum run time
+        for every signal dispatch while installed.
+
+        Times are inclusive; a receiver that sends another signal (such
+        as `ProtocolPlugin.on_raw`) is charged for the nested receivers
+        as well.
+
+        :param threshold: Receivers running longer than this many seconds
+                          are flagged as slow. Also used as gevent's
+                          `max_blocking_time` when monitoring.
+        :param monitor: If True, start gevent's hub monitoring thread
+                        (when available) and flag the receiver that was
+                        running whenever the hub is reported blocked.
+        """
+        self.threshold = threshold
+        self.monitor = monitor
+        self._stats = defaultdict(dict)
+        # Maps greenlet -> receiver that greenlet is currently running.
+        self._running = {}
+        self._monitoring = False
+        # The monitoring thread, if this profiler started it, and the
+        # gevent settings it replaced.
+        self._thread = None
+        self._config = None
+
+    def install(self):
+        """
+        Start profiling all signal dispatch.
+        """
+        signals.Signal.profiler = self
+
+        if self.monitor and subscribers is not None:
+            config = gevent.config
+            if self._config is None:
+                self._config = (config.max_blocking_time,
+                                config.monitor_thread)
+            config.max_blocking_time = self.threshold
+            config.monitor_thread = True
+
+            hub = gevent.get_hub()
+            if hub.periodic_monitoring_thread is None:
+                self._thread = hub.start_periodic_monitoring_thread()
+            subscribers.append(self._on_event)
+            self._monitoring = True
+
+        return self
+
+    def uninstall(self):
+        """
+        Stop profiling. Collected statistics are kept until `reset()`.
+        The monitoring thread keeps running, see `stop()`.
+        """
+        if signals.Signal.profiler is self:
+            signals.Signal.profiler = None
+
+        if self._monitoring:
+            subscribers.remove(self._on_event)
+            self._monitoring = False
+
+    def stop(self, timeout=None):
+        """
+        Uninstalls the profiler and stops the monitoring thread if
+        `install` started it, waiting up to `timeout` seconds (forever
+        if None) for it to exit.
+
+        :returns: True if no monitoring thread is left running.
+        """
+        self.uninstall()
+
+        if self._config is not None:
+            config = gevent.config
+            config.max_blocking_time, config.monitor_thread = self._config
+            self._config = None
+
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return True
+
+        thread.kill()
+        hub = gevent.get_hub()
+        if hub.periodic_monitoring_thread is thread:
+            hub.periodic_monitoring_thread = None
+
+        # gevent starts the thread without a handle to join, but it
+        # leaves sys._current_frames() once it notices it was killed.
+        deadline = None if timeout is None else time.time() + timeout
+        while thread.monitor_thread_ident in sys._current_frames():
+            if deadline is not None and time.time() >= deadline:
+                return False
+            gevent.sleep(0.01)
+        return True
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset(self):
+        self._stats.clear()
+
+    def report(self):
+        """
+        Returns a dict of ``{signal name: {receiver qualname: stats}}``,
+        where stats is a dict with the keys `calls`, `total`, `max`,
+        `slow` and `blocked`.
+        """
+        return dict(
+            (signal_name, dict(
+                (name, stats.as_dict()) for name, stats in receivers.items()
+            ))
+            for signal_name, receivers in self._stats.items()
+        )
+
+    def _entry(self, signal_name, name):
+        receivers = self._stats[signal_name]
+        stats = receivers.get(name)
+        if stats is None:
+            stats = receivers[name] = ReceiverStats()
+        return stats
+
+    def dispatch(self, signal, sender, kwargs):
+        if not signal.receivers:
+            return []
+
+        return [
+            (receiver, self.call(signal, receiver, sender, kwargs))
+            for receiver in signal.receivers_for(sender)
+        ]
+
+    def call(self, signal, receiver, sender, kwargs):
+        """
+        Calls a single receiver of `signal`, recording how long it took.
+        """
+        current = gevent.getcurrent()
+        previous = self._running.get(current)
+
+        # [signal name, receiver name, seen blocked by the monitor]
+        running = [signal.name, qualname(receiver), False]
+        self._running[current] = running
+        start = time.time()
+        try:
+            return receiver(sender, **kwargs)
+        finally:
+            self._record(running, time.time() - start)
+            if previous is None:
+                self._running.pop(current, None)
+            else:
+                self._running[current] = previous
+
+    def _record(self, running, elapsed):
+        signal_name, name, blocked = running
+        stats = self._entry(signal_name, name)
+        stats.calls += 1
+        stats.total += elapsed
+        if elapsed > stats.max:
+            stats.max = elapsed
+        if blocked:
+            stats.blocked += 1
+        if elapsed > self.threshold:
+            stats.slow += 1
+            logger.warning(
+                'Receiver %s for %s took %.3fs.', name, signal_name, elapsed
+            )
+
+    def _on_event(self, event):
+        # Called from gevent's monitoring thread, not the hub.
+        if not isinstance(event, EventLoopBlocked):
+            return
+
+        running = self._running.get(event.greenlet)
+        if running is None or running[2]:
+            return
+
+        running[2] = True
+        logger.warning(
+            'Receiver %s for %s blocked the hub for over %.3fs.',
+            running[1], running[0], event.blocking_time
+        )
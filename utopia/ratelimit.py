@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Rate limiting helpers.
+"""
+import time
+
+import gevent
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None):
+        """
+        A token bucket refilling at `rate` tokens per second, holding at
+        most `burst` tokens (defaults to one second's worth).
+
+        Tokens can be taken on credit; the bucket then goes negative and
+        callers are told how long to wait for it to recover.
+
+        :param rate: Tokens added per second.
+        :param burst: Maximum number of tokens held.
+        """
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.time()
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    @property
+    def tokens(self):
+        """
+        The number of tokens currently available (negative if in debt).
+        """
+        self._refill()
+        return self._tokens
+
+    def consume(self, amount=1):
+        """
+        Takes `amount` tokens if they are available, returning True, or
+        takes nothing and returns False.
+        """
+        self._refill()
+        if self._tokens >= amount:
+            self._tokens -= amount
+            return True
+        return False
+
+    def take(self, amount=1):
+        """
+        Takes `amount` tokens, even if that puts the bucket in debt, and
+        returns the number of seconds to wait before using them.
+        """
+        self._refill()
+        self._tokens -= amount
+        if self._tokens >= 0:
+            return 0
+        return -self._tokens / self.rate
+
+    def wait(self, amount=1):
+        """
+        Takes `amount` tokens, sleeping until they are paid for.
+        """
+        delay = self.take(amount)
+        if delay > 0:
+            gevent.sleep(delay)
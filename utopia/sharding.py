@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""
+Spreads a large set of channels over many connections in several worker
+processes.
+
+Channels are assigned to connection "slots" with a consistent hash ring,
+so losing (or adding) a slot only moves the channels that hashed to it.
+Each worker process runs the clients for its slots and relays every line
+it receives to the `Coordinator` over a Unix socket, where it is parsed
+and fired as `signals.on_shard_message`. Workers hold no application
+logic, so plugins and receivers only live in the coordinator.
+
+Run a worker by hand with ``python -m utopia.sharding <socket> <index>``.
+"""
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+
+import gevent
+import gevent.queue
+import gevent.server
+import gevent.socket
+
+import utopia
+import utopia.parsing
+from utopia import signals
+from utopia.core import Connection
+
+
+class HashRing(object):
+    def __init__(self, nodes=(), replicas=160):
+        """
+        A consistent hash ring. Every node is placed on the ring
+        `replicas` times to even out the share of keys each one gets.
+        """
+        self.replicas = replicas
+        self._hashes = []
+        self._nodes = {}
+
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key):
+        if not isinstance(key, bytes):
+            key = u'{0}'.format(key).encode('utf-8')
+        return struct.unpack_from('>Q', hashlib.md5(key).digest())[0]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @property
+    def nodes(self):
+        return set(self._nodes.values())
+
+    def add(self, node):
+        for i in range(self.replicas):
+            h = self._hash(u'{0}-{1}'.format(node, i))
+            if h not in self._nodes:
+                self._nodes[h] = node
+                bisect.insort(self._hashes, h)
+
+    def remove(self, node):
+        for h in [h for h, n in self._nodes.items() if n == node]:
+            del self._nodes[h]
+        self._hashes = sorted(self._nodes)
+
+    def get(self, key):
+        """
+        Returns the node `key` belongs to, or None if the ring is empty.
+        """
+        for node in self.iter_nodes(key):
+            return node
+        return None
+
+    def iter_nodes(self, key):
+        """
+        Yields every node once, starting with the one `key` belongs to and
+        following the ring from there.
+        """
+        if not self._hashes:
+            return
+
+        start = bisect.bisect(self._hashes, self._hash(key))
+        seen = set()
+        total = len(self.nodes)
+        for i in range(len(self._hashes)):
+            node = self._nodes[self._hashes[(start + i) % len(self._hashes)]]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == total:
+                    return
+
+
+def channel_limit(isupport, chantype='#'):
+    """
+    Returns the maximum number of `chantype` channels a connection may be
+    in according to the server's ISUPPORT parameters (as returned by
+    `utopia.parsing.unpack_005`), or None if there is no limit.
+    """
+    chanlimit = isupport.get('CHANLIMIT')
+    if chanlimit:
+        for prefixes, limit in chanlimit.items():
+            if chantype in prefixes:
+                return limit if isinstance(limit, int) and limit else None
+
+    return isupport.get('MAXCHANNELS') or None
+
+
+def _frame(*parts):
+    line = u' '.join(u'{0}'.format(part) for part in parts)
+    return line.encode('utf-8') + b'\r\n'
+
+
+def _read_lines(sock):
+    """
+    Yields decoded lines from `sock` until it is closed.
+    """
+    buffered = b''
+    while True:
+        try:
+            data = sock.recv(65536)
+        except gevent.socket.error:
+            return
+        if not data:
+            return
+
+        lines = (buffered + data).split(b'\r\n')
+        buffered = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8')
+
+
+def _write_lines(sock, queue):
+    while True:
+        batch = [queue.get()]
+        while len(batch) < 256 and not queue.empty():
+            batch.append(queue.get())
+        sock.sendall(b''.join(batch))
+
+
+class Coordinator(object):
+    def __init__(self, identity, host, port=6667, ssl=False, channels=(),
+                 workers=None, connections=1, max_channels=None,
+                 replicas=160):
+        """
+        Runs `workers` processes with `connections` clients each and
+        spreads `channels` over them.
+
+        Each connection joins at most as many channels as the server's
+        ISUPPORT CHANLIMIT (or MAXCHANNELS) allows, and `max_channels`
+        if given. Channels a full connection can't take are placed on
+        the next connection along the ring. Channels no connection can
+        take are kept in `pending`.
+
+        :param identity: The `utopia.client.Identity` to base each
+                         connection's identity on. The slot number is
+                         appended to the nick.
+        :param workers: Number of worker processes, defaults to the
+                        number of CPUs.
+        :param connections: Number of connections per worker.
+        :param max_channels: An optional per connection channel limit.
+        """
+        if workers is None:
+            import multiprocessing
+            workers = multiprocessing.cpu_count()
+
+        self.identity = identity
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.workers = workers
+        self.connections = connections
+        self.max_channels = max_channels
+
+        self.ring = HashRing(range(workers * connections), replicas)
+
+        #: Channels waiting for a connection.
+        self.pending = set(channels)
+        #: Maps each joined channel to its slot.
+        self.placed = {}
+
+        # Channel limits of the slots that are ready to join channels.
+        self._limits = {}
+        self._joined = {}
+        # Outgoing queues of the connected workers.
+        self._queues = {}
+        self._processes = []
+        self._directory = None
+        self._server = None
+
+    @property
+    def path(self):
+        return os.path.join(self._directory, 'ipc')
+
+    def slots(self, worker):
+        return range(
+            worker * self.connections,
+            (worker + 1) * self.connections
+        )
+
+    def slot_for(self, channel):
+        """
+        Returns the slot `channel` has been joined on, or None.
+        """
+        return self.placed.get(channel.lower())
+
+    def start(self):
+        """
+        Starts the IPC socket and the worker processes.
+        """
+        self._directory = tempfile.mkdtemp(prefix='utopia-')
+
+        listener = gevent.socket.socket(gevent.socket.AF_UNIX)
+        listener.bind(self.path)
+        listener.listen(self.workers)
+        self._server = gevent.server.StreamServer(listener, self._handle)
+        self._server.start()
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(utopia.__file__))] +
+            env.get('PYTHONPATH', '').split(os.pathsep)
+        ).rstrip(os.pathsep)
+
+        for worker in range(self.workers):
+            self._processes.append(subprocess.Popen(
+                [sys.executable, '-m', 'utopia.sharding', self.path,
+                 str(worker)],
+                env=env
+            ))
+
+        return self
+
+    def stop(self):
+        """
+        Disconnects every connection and stops the workers.
+        """
+        for queue in self._queues.values():
+            queue.put(_frame('*', 'stop'))
+        gevent.sleep(0)
+
+        for process in self._processes:
+            for _ in range(50):
+                if process.poll() is not None:
+                    break
+                gevent.sleep(0.1)
+            else:
+                process.kill()
+                process.wait()
+        del self._processes[:]
+
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+    def send(self, slot, command, *args):
+        """
+        Sends an IRC message on the connection in `slot`.
+        """
+        worker = slot // self.connections
+        self._queues[worker].put(
+            u'{0} '.format(slot).encode('utf-8') +
+            utopia.parsing.pack_message(command, args)
+        )
+
+    def send_channel(self, channel, command, *args):
+        """
+        Sends an IRC message on the connection that joined `channel`.
+
+        :raises KeyError: If `channel` hasn't been joined.
+        """
+        slot = self.slot_for(channel)
+        if slot is None:
+            raise KeyError(channel)
+        self.send(slot, command, *args)
+
+    def add_channels(self, channels):
+        for channel in channels:
+            if channel.lower() not in self.placed:
+                self.pending.add(channel)
+        self._place()
+
+    def remove_channels(self, channels):
+        parts = {}
+        for channel in channels:
+            self.pending.discard(channel)
+            slot = self.placed.pop(channel.lower(), None)
+            if slot is not None:
+                self._joined[slot].discard(channel.lower())
+                parts.setdefault(slot, []).append(channel)
+
+        for slot, channels in parts.items():
+            self._join(slot, channels, 'PART')
+        self._place()
+
+    def _place(self):
+        """
+        Joins pending channels on the first slot along the ring that is
+        ready and has room for them. Channels whose preferred slot isn't
+        ready yet wait for it.
+        """
+        joins = {}
+        for channel in list(self.pending):
+            for slot in self.ring.iter_nodes(channel.lower()):
+                if slot not in self._limits:
+                    break
+
+                limit = self._limits[slot]
+                if limit is None or len(self._joined[slot]) < limit:
+                    self.pending.discard(channel)
+                    self.placed[channel.lower()] = slot
+                    self._joined[slot].add(channel.lower())
+                    joins.setdefault(slot, []).append(channel)
+                    break
+
+        for slot, channels in joins.items():
+            self._join(slot, channels)
+
+    def _join(self, slot, channels, command='JOIN'):
+        # Keep each line well under the 512 byte limit.
+        batch, size = [], 0
+        for channel in sorted(channels):
+            if batch and size + len(channel) > 400:
+                self.send(slot, command, u','.join(batch))
+                batch, size = [], 0
+            batch.append(channel)
+            size += len(channel) + 1
+        if batch:
+            self.send(slot, command, u','.join(batch))
+
+    def _ready(self, slot, limit):
+        limit = int(limit) or None
+        if self.max_channels is not None:
+            limit = min(limit or self.max_channels, self.max_channels)
+
+        self._limits[slot] = limit
+        # Only new connections start out empty, a repeated MOTD keeps
+        # the channels already placed on the slot.
+        self._joined.setdefault(slot, set())
+        self._place()
+
+    def _lost(self, slot):
+        """
+        Forgets `slot`, moving its channels to the rest of the ring.
+        """
+        self.ring.remove(slot)
+        self._limits.pop(slot, None)
+        for channel in self._joined.pop(slot, ()):
+            del self.placed[channel]
+            self.pending.add(channel)
+
+        signals.on_shard_lost.send(self, slot=slot)
+        self._place()
+
+    def _handle(self, sock, address):
+        worker = None
+        protocol = Connection()
+        try:
+            for line in _read_lines(sock):
+                slot, _, line = line.partition(u' ')
+
+                if slot != u'*':
+                    message = protocol.parse_line(line)
+                    if message is not None:
+                        signals.on_shard_message.send(
+                            self, slot=int(slot), message=message
+                        )
+                    continue
+
+                event, _, args = line.partition(u' ')
+                if event == u'hello':
+                    worker = int(args)
+                    self._queues[worker] = queue = gevent.queue.Queue()
+                    queue.put(_frame('*', 'config', json.dumps({
+                        'host': self.host,
+                        'port': self.port,
+                        'ssl': self.ssl,
+                        'slots': [
+                            [owned, self._identity(owned)]
+                            for owned in self.slots(worker)
+                        ]
+                    })))
+                    gevent.spawn(_write_lines, sock, queue).link(
+                        lambda g: sock.close()
+                    )
+                elif event == u'ready':
+                    slot, limit = args.split()
+                    self._ready(int(slot), limit)
+                elif event == u'closed':
+                    self._lost(int(args))
+        finally:
+            sock.close()
+            if worker is not None:
+                self._queues.pop(worker, None)
+                for slot in self.slots(worker):
+                    if slot in self.ring.nodes:
+                        self._lost(slot)
+
+    def _identity(self, slot):
+        identity = self.identity
+        return [
+            u'{0}{1}'.format(identity.nick, slot),
+            identity.user,
+            identity.real,
+            identity.password
+        ]
+
+
+def run_worker(path, worker):
+    """
+    Runs the connections of a single worker process until the coordinator
+    tells it to stop or goes away.
+    """
+    from utopia.client import Identity, ProtocolClient
+    from utopia.plugins.handshake import HandshakePlugin
+    from utopia.plugins.protocol import ISupportPlugin, ProtocolPlugin
+
+    ipc = gevent.socket.socket(gevent.socket.AF_UNIX)
+    ipc.connect(path)
+    outgoing = gevent.queue.Queue()
+    writer = gevent.spawn(_write_lines, ipc, outgoing)
+    outgoing.put(_frame('*', 'hello', worker))
+
+    clients = {}
+    # Keeps the receivers alive, signals only hold weak references.
+    receivers = []
+
+    def start(slot, identity, config):
+        isupport = ISupportPlugin()
+        client = ProtocolClient(
+            Identity(*identity),
+            config['host'],
+            port=config['port'],
+            ssl=config['ssl'],
+            plugins=[HandshakePlugin, ProtocolPlugin(), isupport]
+        )
+        clients[slot] = client
+
+        def on_line(client, line):
+            outgoing.put(_frame(slot, line))
+
+        def on_motd(client, prefix, target, args):
+            outgoing.put(_frame(
+                '*', 'ready', slot,
+                channel_limit(isupport.isupport[1]) or 0
+            ))
+
+        def on_disconnect(client):
+            outgoing.put(_frame('*', 'closed', slot))
+
+        receivers.extend((on_line, on_motd, on_disconnect))
+        signals.on_raw_line.connect(on_line, sender=client)
+        signals.m.on_376.connect(on_motd, sender=client)
+        signals.m.on_422.connect(on_motd, sender=client)
+        signals.on_disconnect.connect(on_disconnect, sender=client)
+        client.connect()
+
+    for line in _read_lines(ipc):
+        slot, _, line = line.partition(u' ')
+        if slot != u'*':
+            client = clients.get(int(slot))
+            if client is not None:
+                client.sendraw(line)
+            continue
+
+        event, _, args = line.partition(u' ')
+        if event == u'config':
+            config = json.loads(args)
+            for slot, identity in config['slots']:
+                start(slot, identity, config)
+        elif event == u'stop':
+            break
+
+    for client in clients.values():
+        if client.socket is not None:
+            client.quit()
+    gevent.sleep(0.5)
+    for client in clients.values():
+        if client.socket is not None:
+            client.terminate()
+    writer.kill()
+    ipc.close()
+
+
+if __name__ == '__main__':
+    run_worker(sys.argv[1], int(sys.argv[2]))
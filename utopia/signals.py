@@ -1,7 +1,63 @@
 # -*- coding: utf-8 -*-
+import logging
+
 import blinker
 
-namespace = blinker.Namespace()
+logger = logging.getLogger('utopia.signals')
+
+
+class Signal(blinker.NamedSignal):
+    """
+    A blinker signal whose dispatch can be routed through an optional
+    profiler (see :mod:`utopia.profiling`).
+    """
+    #: When not None, every send() is handed to `profiler.dispatch`.
+    profiler = None
+
+    def send(self, *sender, **kwargs):
+        profiler = Signal.profiler
+        if profiler is None:
+            return blinker.NamedSignal.send(self, *sender, **kwargs)
+
+        if len(sender) > 1:
+            raise TypeError(
+                'send() accepts only one positional argument, '
+                '{0} given'.format(len(sender))
+            )
+
+        return profiler.dispatch(self, sender[0] if sender else None, kwargs)
+
+    def send_isolated(self, sender, **kwargs):
+        """
+        Like `send`, but a receiver raising an exception is logged and
+        left out of the results instead of stopping the others. Used
+        where receivers run on a client's read loop.
+        """
+        profiler = Signal.profiler
+        results = []
+        for receiver in self.receivers_for(sender):
+            try:
+                if profiler is None:
+                    value = receiver(sender, **kwargs)
+                else:
+                    value = profiler.call(self, receiver, sender, kwargs)
+            except Exception:
+                logger.exception(
+                    'Receiver %r for %s failed.', receiver, self.name
+                )
+                continue
+            results.append((receiver, value))
+        return results
+
+
+class Namespace(blinker.Namespace):
+    def signal(self, name, doc=None):
+        try:
+            return self[name]
+        except KeyError:
+            return self.setdefault(name, Signal(name, doc))
+
+namespace = Namespace()
 signal = namespace.signal
 
 
@@ -38,6 +94,27 @@ Triggered whenever a message is received from the server.
 :param args: The command arguments recevied.
 """)
 
+on_raw_line = signal('on-raw-line', doc="""
+Triggered synchronously for every complete line received from the server,
+before it is dispatched. Receivers must not block.
+
+:param client: The client recieving this message.
+:param line: The decoded line, without the trailing CRLF.
+""")
+
+on_message = signal('on-message', doc="""
+Triggered synchronously for every message received from the server, right
+after `on_raw_line`, with the parsed message itself. Receivers must not
+block.
+
+A receiver returning True takes over the message: it isn't dispatched to
+`on_raw_message` (and the protocol events built on it). Used to coalesce
+batches of lines into a single event.
+
+:param client: The client recieving this message.
+:param message: The `utopia.core.Message`.
+""")
+
 on_registered = signal('on-registered', doc="""
 Triggered when registration with the server is completed.
 This typically means the client has received RPL_WELCOME.
@@ -45,4 +122,135 @@ This typically means the client has received RPL_WELCOME.
 :param client: The client recieving this message.
 """)
 
+on_stats = signal('on-stats', doc="""
+Triggered periodically with a metrics snapshot when a client was created
+with metrics enabled and a `stats_interval`.
+
+:param client: The client the statistics belong to.
+:param stats: A dict, as returned by `CoreClient.metrics_snapshot()`.
+""")
+
+on_dcc_offer = signal('on-dcc-offer', doc="""
+Triggered when a DCC SEND offer is received, see `DCCPlugin.accept`.
+
+:param client: The client recieving the offer.
+:param offer: A `utopia.plugins.dcc.Offer`.
+""")
+
+on_dcc_complete = signal('on-dcc-complete', doc="""
+Triggered when a DCC transfer finishes successfully.
+
+:param client: The client the transfer belongs to.
+:param transfer: The `utopia.plugins.dcc.Transfer`.
+""")
+
+on_dcc_failed = signal('on-dcc-failed', doc="""
+Triggered when a DCC transfer fails or times out.
+
+:param client: The client the transfer belongs to.
+:param transfer: The `utopia.plugins.dcc.Transfer`.
+:param error: The exception that ended the transfer.
+""")
+
+on_lag = signal('on-lag', doc="""
+Triggered by `KeepalivePlugin` whenever the reply to one of its PINGs
+arrives.
+
+:param client: The client that measured the lag.
+:param lag: The round trip time in seconds.
+""")
+
+on_timeout = signal('on-timeout', doc="""
+Triggered by `KeepalivePlugin` when nothing has been received for too
+long, right before the client is terminated.
+
+:param client: The client whose connection is considered dead.
+:param silence: Seconds since anything was last received.
+""")
+
+on_match = signal('on-match', doc="""
+Triggered by `MatcherPlugin` for messages containing any of its keywords.
+
+:param client: The client recieving the message.
+:param prefix: The sender's prefix.
+:param target: The channel or nick the message was sent to.
+:param text: The message text.
+:param matches: The set of keys that matched.
+""")
+
+on_command_error = signal('on-command-error', doc="""
+Triggered by `CommandRouter` when a command couldn't be run, such as when
+it is ambiguous, on cooldown, given bad arguments or its handler raised
+`CommandError`.
+
+:param client: The client recieving the command.
+:param invocation: The `Invocation`. Its `command` is None for ambiguous
+                   commands.
+:param error: The `CommandError`.
+""")
+
+on_flood = signal('on-flood', doc="""
+Triggered by `FloodPlugin` when a sender or channel goes over a limit.
+
+:param client: The client recieving the flood.
+:param kind: Which limit was exceeded, 'messages', 'repeats', 'joins' or
+             'highlights'.
+:param prefix: The `Prefix` of the sender that went over the limit.
+:param channel: The channel involved, or None.
+:param count: The (estimated) count within the window.
+""")
+
+on_batch = signal('on-batch', doc="""
+Triggered by `BatchPlugin` when an IRCv3 batch is complete.
+
+:param client: The client recieving the batch.
+:param batch: The `utopia.plugins.batch.Batch`, with its type, parameters
+              and messages.
+""")
+
+on_netsplit = signal('on-netsplit', doc="""
+Triggered by `BatchPlugin` once for each netsplit, instead of a QUIT per
+user lost in it.
+
+:param client: The client recieving the netsplit.
+:param servers: The two servers that split, as a tuple.
+:param prefixes: The `Prefix` of every user lost in the split.
+""")
+
+on_netjoin = signal('on-netjoin', doc="""
+Triggered by `BatchPlugin` once the servers of a netsplit relinked,
+instead of a JOIN per user and channel.
+
+:param client: The client recieving the netjoin.
+:param servers: The two servers that relinked, as a tuple.
+:param joins: A list of (`Prefix`, channel) tuples.
+""")
+
+on_presence = signal('on-presence', doc="""
+Triggered by `PresencePlugin` when a tracked nick comes online or goes
+offline, including when it is first known.
+
+:param client: The client tracking the nick.
+:param nick: The nick, as it was added.
+:param online: True if the nick is online.
+""")
+
+on_shard_message = signal('on-shard-message', doc="""
+Triggered by a `utopia.sharding.Coordinator` for every message one of its
+connections receives.
+
+:param client: The coordinator.
+:param slot: The number of the connection that received the message.
+:param message: The `utopia.core.Message`.
+""")
+
+on_shard_lost = signal('on-shard-lost', doc="""
+Triggered by a `utopia.sharding.Coordinator` when one of its connections
+(or its whole worker process) goes away. Its channels are moved to the
+remaining connections.
+
+:param client: The coordinator.
+:param slot: The number of the lost connection.
+""")
+
 m = LazySignalProxy()
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Timers for plugins, run from a single greenlet.
+
+Timers are kept in a hierarchical timing wheel: each level is a ring of
+64 slots, the first covering one tick per slot, the next 64 ticks per
+slot and so on. Scheduling and cancelling are O(1) and a timer is only
+touched again when it moves down a level or expires, so a million
+pending timeouts cost a million small objects rather than a million
+sleeping greenlets.
+"""
+import logging
+import math
+import time
+
+import gevent
+import gevent.event
+
+logger = logging.getLogger('utopia.timers')
+
+_BITS = 6
+_SLOTS = 1 << _BITS
+_MASK = _SLOTS - 1
+
+
+class Timer(object):
+    __slots__ = ('deadline', 'interval', 'func', 'args', 'tick', '_wheel',
+                 '_slot')
+
+    def __init__(self, wheel, deadline, interval, func, args):
+        #: When the timer is (next) due, in `time.time()` seconds.
+        self.deadline = deadline
+        #: For repeating timers, the seconds between calls.
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self.tick = None
+        self._wheel = wheel
+        # The slot (a set) the timer is in, or None once it has expired
+        # or was cancelled.
+        self._slot = None
+
+    @property
+    def active(self):
+        return self._slot is not None
+
+    def cancel(self):
+        """
+        Cancels the timer. Does nothing if it already expired.
+        """
+        if self._slot is not None:
+            self._slot.discard(self)
+            self._slot = None
+            self._wheel._count -= 1
+
+
+class TimerWheel(object):
+    def __init__(self, resolution=0.1, levels=4):
+        """
+        Runs callbacks after a delay, or repeatedly.
+
+        Callbacks are run one after another from the wheel's greenlet,
+        so they should be quick; spawn a greenlet for anything that may
+        block. Timers due at the same time (within `resolution`) are run
+        together in a single wake up.
+
+        :param resolution: The length of a tick in seconds. Timers fire
+                           up to this late.
+        :param levels: The number of wheels. With the defaults timers up
+                       to 19 days out are placed directly, further ones
+                       wait in the last wheel.
+        """
+        self.resolution = resolution
+        self.levels = levels
+
+        self._wheels = [
+            [set() for _ in range(_SLOTS)] for _ in range(levels)
+        ]
+        # Ticks covered by all the wheels together.
+        self._range = 1 << (_BITS * levels)
+        self._start = time.time()
+        # The last tick that was processed.
+        self._tick = 0
+        self._count = 0
+
+        self._driver = None
+        self._wakeup = gevent.event.Event()
+        # The tick the driver is sleeping until, or None.
+        self._sleeping_until = None
+
+    def __len__(self):
+        """
+        The number of pending timers.
+        """
+        return self._count
+
+    def call_later(self, delay, func, *args):
+        """
+        Calls ``func(*args)`` once, `delay` seconds from now. Returns the
+        `Timer`, which can be cancelled.
+        """
+        return self._schedule(
+            Timer(self, time.time() + delay, None, func, args)
+        )
+
+    def call_every(self, interval, func, *args):
+        """
+        Calls ``func(*args)`` every `interval` seconds until cancelled.
+        Calls are scheduled from the previous due time, so they don't
+        drift.
+        """
+        return self._schedule(
+            Timer(self, time.time() + interval, interval, func, args)
+        )
+
+    def cancel(self, timer):
+        timer.cancel()
+
+    def close(self):
+        """
+        Cancels every timer and stops the driving greenlet. The wheel can
+        still be used afterwards.
+        """
+        for wheel in self._wheels:
+            for slot in wheel:
+                for timer in slot:
+                    timer._slot = None
+                slot.clear()
+        self._count = 0
+
+        if self._driver is not None:
+            self._driver.kill(block=False)
+            self._driver = None
+
+    def _now(self):
+        return int((time.time() - self._start) / self.resolution)
+
+    def _schedule(self, timer):
+        if not self._count:
+            # The wheel is empty, there is nothing to step through.
+            self._tick = max(self._tick, self._now())
+
+        timer.tick = int(math.ceil(
+            (timer.deadline - self._start) / self.resolution
+        ))
+        self._place(timer, self._tick + 1)
+        self._count += 1
+
+        if self._driver is None:
+            self._driver = gevent.spawn(self._run)
+        elif self._sleeping_until is None or \
+                timer.tick < self._sleeping_until:
+            self._wakeup.set()
+
+        return timer
+
+    def _place(self, timer, base):
+        """
+        Puts `timer` in the slot for its tick, relative to `base`, the
+        next tick to be processed.
+        """
+        tick = max(timer.tick, base)
+        delta = tick - base
+        if delta >= self._range:
+            # Too far out, it is placed again once this slot comes up.
+            tick = base + self._range - 1
+            delta = self._range - 1
+
+        level = (delta.bit_length() - 1) // _BITS if delta else 0
+        slot = self._wheels[level][(tick >> (_BITS * level)) & _MASK]
+        slot.add(timer)
+        timer._slot = slot
+
+    def _advance(self):
+        """
+        Processes the next tick, returning the timers that expired.
+        """
+        tick = self._tick = self._tick + 1
+
+        # Move timers down from every wheel that wrapped around.
+        level = 1
+        while level < self.levels and \
+                not tick & ((1 << (_BITS * level)) - 1):
+            slot = self._wheels[level][(tick >> (_BITS * level)) & _MASK]
+            if slot:
+                timers = list(slot)
+                slot.clear()
+                for timer in timers:
+                    self._place(timer, tick)
+            level += 1
+
+        slot = self._wheels[0][tick & _MASK]
+        if not slot:
+            return ()
+
+        timers = list(slot)
+        slot.clear()
+        expired = []
+        for timer in timers:
+            if timer.tick > tick:
+                # Was out of range when placed, not due yet.
+                self._place(timer, tick + 1)
+            else:
+                expired.append(timer)
+        return expired
+
+    def _next_tick(self):
+        """
+        The next tick that may have work: an occupied slot of the first
+        wheel or, failing that, its next wrap around.
+        """
+        wheel = self._wheels[0]
+        tick = self._tick + 1
+        while tick & _MASK:
+            if wheel[tick & _MASK]:
+                return tick
+            tick += 1
+        return tick
+
+    def _run(self):
+        while True:
+            now = self._now()
+
+            if not self._count:
+                # Nothing to cascade either, skip straight to now.
+                self._tick = max(self._tick, now)
+                self._sleeping_until = None
+                self._wakeup.clear()
+                self._wakeup.wait()
+                continue
+
+            expired = []
+            while self._tick < now:
+                expired.extend(self._advance())
+
+            if expired:
+                self._fire(expired)
+                continue
+
+            self._sleeping_until = self._next_tick()
+            self._wakeup.clear()
+            self._wakeup.wait(max(
+                0,
+                self._start + self._sleeping_until * self.resolution -
+                time.time()
+            ))
+
+    def _fire(self, expired):
+        expired.sort(key=lambda timer: timer.deadline)
+        for timer in expired:
+            if timer._slot is None:
+                # Cancelled by an earlier callback.
+                continue
+            timer._slot = None
+            self._count -= 1
+
+            if timer.interval is not None:
+                timer.deadline += timer.interval
+                now = time.time()
+                if timer.deadline <= now:
+                    # Skip calls missed while the hub was blocked.
+                    missed = (now - timer.deadline) // timer.interval + 1
+                    timer.deadline += missed * timer.interval
+                self._schedule(timer)
+
+            try:
+                timer.func(*timer.args)
+            except Exception:
+                logger.exception('Timer callback %r failed.', timer.func)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Shared TLS contexts and session resumption.
+
+Building an `SSLContext` and doing a full handshake for every connection
+is expensive. Clients share a single context by default, and the last
+session negotiated with each server is cached so reconnects can resume it
+(Python 3.6 and newer).
+"""
+import time
+from collections import OrderedDict
+
+import gevent.ssl
+
+_default_context = None
+
+
+def default_context():
+    """
+    Returns the process wide client `SSLContext` used when none is given,
+    creating it on first use.
+
+    For compatibility with `ssl.wrap_socket`, which was used before, this
+    context does not verify certificates. Pass your own context (such as
+    one from `ssl.create_default_context()`) to `connect` to verify them.
+    """
+    global _default_context
+    if _default_context is None:
+        _default_context = context_from_args({})
+    return _default_context
+
+
+def context_from_args(ssl_args):
+    """
+    Builds an `SSLContext` from the keyword arguments `ssl.wrap_socket`
+    accepts (`keyfile`, `certfile`, `cert_reqs`, `ssl_version`,
+    `ca_certs` and `ciphers`).
+    """
+    context = gevent.ssl.SSLContext(
+        ssl_args.get('ssl_version', gevent.ssl.PROTOCOL_SSLv23)
+    )
+    context.verify_mode = ssl_args.get('cert_reqs', gevent.ssl.CERT_NONE)
+
+    if ssl_args.get('certfile'):
+        context.load_cert_chain(
+            ssl_args['certfile'],
+            ssl_args.get('keyfile')
+        )
+    if ssl_args.get('ca_certs'):
+        context.load_verify_locations(ssl_args['ca_certs'])
+    if ssl_args.get('ciphers'):
+        context.set_ciphers(ssl_args['ciphers'])
+
+    return context
+
+
+class SessionCache(object):
+    def __init__(self, maxsize=1024):
+        """
+        A bounded, least recently used cache of TLS sessions keyed by
+        the context and (host, port), see `session_key`. A session can
+        only be resumed with the context that negotiated it, so entries
+        are stored as (context, session), which also keeps the id in the
+        key from being reused.
+        """
+        self.maxsize = maxsize
+        self._sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, key):
+        session = self._sessions.pop(key, None)
+        if session is not None:
+            self._sessions[key] = session
+        return session
+
+    def put(self, key, session):
+        self._sessions.pop(key, None)
+        self._sessions[key] = session
+        while len(self._sessions) > self.maxsize:
+            self._sessions.popitem(last=False)
+
+    def discard(self, key):
+        self._sessions.pop(key, None)
+
+
+#: The session cache shared by all clients by default.
+sessions = SessionCache()
+
+
+def session_key(context, host, port):
+    """
+    The `SessionCache` key for sessions negotiated with `context`.
+    """
+    return (id(context), host, port)
+
+
+def wrap_socket(sock, host, port, context=None, cache=sessions):
+    """
+    Wraps a connected socket, setting SNI to `host` and resuming a cached
+    session `context` negotiated with (`host`, `port`) when possible.
+
+    :param sock: A connected socket.
+    :param host: The server's hostname.
+    :param port: The server's port.
+    :param context: The `SSLContext` to use, defaults to
+                    `default_context()`.
+    :param cache: The `SessionCache` to use, or None to disable session
+                  resumption.
+    :returns: A tuple of the wrapped socket, the handshake time in
+              seconds and whether a session was resumed.
+    """
+    context = context or default_context()
+
+    kwargs = {'do_handshake_on_connect': False}
+    if gevent.ssl.HAS_SNI:
+        kwargs['server_hostname'] = host
+
+    if cache is not None:
+        key = session_key(context, host, port)
+        entry = cache.get(key)
+        if entry is not None:
+            if entry[0] is context:
+                kwargs['session'] = entry[1]
+            else:
+                # Wrapping with another context's session raises a
+                # ValueError after the socket was already taken over.
+                cache.discard(key)
+
+    try:
+        sock = context.wrap_socket(sock, **kwargs)
+    except TypeError:
+        # Session resumption requires Python 3.6, this is never resumed.
+        kwargs.pop('session', None)
+        sock = context.wrap_socket(sock, **kwargs)
+
+    started = time.time()
+    sock.do_handshake()
+    handshake_time = time.time() - started
+
+    if cache is not None:
+        remember_session(sock, host, port, cache)
+
+    return sock, handshake_time, bool(getattr(sock, 'session_reused', False))
+
+
+def remember_session(sock, host, port, cache=sessions):
+    """
+    Stores the current session of `sock` in `cache`. With TLS 1.3 the
+    server may only send its session ticket after the handshake, so
+    this is worth calling again before closing a connection.
+    """
+    try:
+        session = getattr(sock, 'session', None)
+    except (ValueError, gevent.ssl.SSLError):
+        return
+
+    if session is not None:
+        cache.put(
+            session_key(sock.context, host, port),
+            (sock.context, session)
+        )